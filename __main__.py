@@ -1,161 +1,187 @@
-from amr_parser import sent_to_graph, graph_to_sent, read_file, save_graphs, evaluate_smatch
-from nmt_english import Translator
+from amr_parser import sent_to_graph, graph_to_sent, read_file, save_graphs, evaluate_smatch, parse_corpus, unify_graph_files
+from amr_parser import stog_model_version
+from scheduler import FILE_PATTERN, discover_jobs, schedule_translations
+from model_registry import registry
+from caches import ParseCache
+from instrumentation import context, tracer
+from quantization import set_threads
+from supervision import add_supervision_arguments, supervisor_from_arguments
+from smatch_eval import GoldIndex, category_sizes, evaluate_languages
+from stages import Manifest, StageRunner, parse_resumable
+import argparse
 import multiprocessing
 import os
 import locale
-
-
-def truncate_files(filename):
-    # cut off the last 5 lines to omit the obsolete AMR graph
-    with open(filename, mode='r+', encoding=preferred_encoding) as f:
-        lines = f.readlines()[:-5]
-        f.truncate()
-        f.seek(0)
-        f.writelines(lines)
+import sys
 
 
 if __name__ == '__main__':
     multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Translate, parse and evaluate the LDC2020T07 dataset. Work whose "
+                                                 "inputs and models are unchanged since the last run is skipped, "
+                                                 "interrupted parses resume from their last checkpoint.")
+    parser.add_argument("stages", nargs="+", choices=["translate", "parse", "evaluate"])
+    parser.add_argument("-unify", action="store_true",
+                        help="unify the freshly parsed files per language before evaluating")
+    parser.add_argument("-gsii", action="store_true", help="use the GSII parser (AMRgraphs_GSII)")
+    parser.add_argument("-model_dir", default=None, help="path to the AMR model dir (default: amrlib's model)")
+    parser.add_argument("-corpus_parse", action="store_true",
+                        help="parse all translated files together (deduplicated, but without checkpoints)")
+    parser.add_argument("-checkpoint_every", type=int, default=100, help="sentences between parse checkpoints")
+    parser.add_argument("-translation_max_tokens", type=int, default=None,
+                        help="token budget per translation batch, e.g. 4096 (default: EasyNMT's batching)")
+    parser.add_argument("-translation_cores", type=int, default=None,
+                        help="number of cores for translation (default: all)")
+    parser.add_argument("-translation_memory_mb", type=int, default=None,
+                        help="memory budget for translation in MB, limits the languages translated at once")
+    parser.add_argument("-sequential_smatch", action="store_true",
+                        help="score the languages one after another (with amrlib's sub-scores)")
+    parser.add_argument("-smatch_seed", type=int, default=0, help="seed of the SMATCH alignment search")
+    parser.add_argument("-quantize", action="store_true",
+                        help="translate and parse with int8 models on CPU (quantized once, cached in cache/quantized)")
+    parser.add_argument("-threads", type=int, default=None, help="torch threads for parsing (default: torch's default)")
+    add_supervision_arguments(parser)
+    parser.add_argument("-supervision_log", default="supervision.jsonl",
+                        help="where -supervise records the split, retried and fallback sentences")
+    parser.add_argument("-manifest", default="cache/manifest.json")
+    parser.add_argument("-force", action="store_true", help="redo all work, even if it is up to date")
+    parser.add_argument("-trace", default=None, help="save the timing spans of all stages to this file")
+    parser.add_argument("-trace_format", choices=["jsonl", "chrome"], default="jsonl",
+                        help="JSON lines or Chrome trace format (chrome://tracing, ui.perfetto.dev)")
+    parser.add_argument("-profile", default=None,
+                        help="sample the Python stacks and save them to this file (collapsed flame graph format)")
+    parser.add_argument("-profile_interval", type=float, default=0.01, help="seconds between profile samples")
+    args = parser.parse_args()
+
+    if args.profile:
+        tracer.start_profiler(args.profile_interval)
+    if args.threads is not None:
+        set_threads(args.threads)
+
     preferred_encoding = locale.getpreferredencoding()
     preferred_encoding = 'utf-8'
-    english_source_sentences = os.listdir("amr_2-four_translations/english_source_sentences")  # where the original english sentence files are stored
-    files_to_translate = os.listdir("amr_2-four_translations/data")  # where the original source language files are stored
-    translations = sorted(os.listdir("translations"))  # where the translated files are stored
-    gold_amr_dir = os.listdir("amr_2-four_translations/AMR")  # where the gold AMR graphs are stored
-    amr_graphs = sorted(os.listdir("AMRgraphs"))  # where to store the parsed AMR graphs
-    
+
     if not os.path.exists('translations'):
         os.makedirs('translations')
-        
+
     if not os.path.exists('AMRgraphs'):
         os.makedirs('AMRgraphs')
-    
+
     categories = ["bolt", "consensus", "dfa", "proxy", "xinhua"]  # categories included in the dataset for each language
     languages = ["DE", "ES", "IT", "ZH"]  # languages included in the dataset
 
-    AMR_model_dir = None  # Only for running on colab: enter path to AMR model dir
+    AMR_model_dir = args.model_dir
+    if args.gsii:
+        AMR_model_dir = "model_parse_gsii-v0_1_0/"  # Only for running on colab or for non-standard parser: enter path to AMR model dir
+    amr_dir = "AMRgraphs_GSII" if args.gsii else "AMRgraphs"  # where to store the parsed AMR graphs
     gold_amrs_unified = "amr_2-four_translations/AMR/GOLD_AMR_unified.txt"
+    gold_amr_categories = ["amr_2-four_translations/AMR/amr-release-2.0-amrs-test-" + cat + ".txt" for cat in categories]
 
-    translate = False
-    parseamr = False
-    amr_gsii = False
-    evaluate = True
-    unify_files = False
-
-    if translate:
-        source_languages = ['de', 'es', 'it', 'zh']
-    
-        for source_language in source_languages:
-            if source_language == 'de':
-                german = [0, 4, 8, 12, 16]
-                files_to_translate = [files_to_translate[i] for i in german]
-                print("GERMAN - files:", files_to_translate, "\n")
-                
-            elif source_language == 'es':
-                spanish= [1, 5, 9, 13, 17]
-                files_to_translate = [files_to_translate[i] for i in spanish]
-                print("SPANISH - files:", files_to_translate)
-               
-            elif source_language == 'it':    
-                italian = [2, 6, 10, 14, 18]
-                files_to_translate = [files_to_translate[i] for i in italian]
-                print("ITALIAN - files:", files_to_translate)
-                
-            elif source_language == 'zh':   
-                mandarin = [3, 7, 11, 15, 19]
-                files_to_translate = [files_to_translate[i] for i in mandarin]
-                print("MANDARIN - files:", files_to_translate)
-            
-            
-            for file_to_translate, source_sentence in zip(files_to_translate, english_source_sentences):
-                translator = Translator()
-                translator.load_sentences("amr_2-four_translations/data/" + file_to_translate, "amr_2-four_translations/english_source_sentences/" + source_sentence)
-                translator.translate(source_language=source_language)
-                translator.save_translation("translations/" + file_to_translate[:-4] + "_nmt.txt")
-            
-                translator.evaluate_bleu()
-                translator.evaluate_cosine_similarity()
-                
-                with open("translation_evaluation.txt", "a", encoding='utf-8') as fa:
-                    fa.write("\n---")
-
-    if parseamr:
-        if amr_gsii:
-            amr_graphs = sorted(os.listdir("AMRgraphs_GSII"))  # where to store the parsed AMR graphs
-            # AMR_model_dir = None #for standard model
-            AMR_model_dir = "model_parse_gsii-v0_1_0/"  # Only for running on colab or for non-standard parser: enter path to AMR model dir
-            # parse all translated files to AMR graphs and store them in AMRgraphs folder
-            sentences = read_file("translations/amr-release-2.0-amrs-test-proxy.sentences.ES_nmt.txt")  # + translations[i])
-            graphs = sent_to_graph(sentences, AMR_model_dir, verbose=False)
-            new_path = "AMRgraphs_GSII/amr-release-2.0-amrs-test-proxy.sentences.ES_AMR.txt"
-            save_graphs(graphs, path=new_path)
+    runner = StageRunner(Manifest(args.manifest), force=args.force)
+    supervisor = supervisor_from_arguments(args)
+
+    translation_timings = []
+    if "translate" in args.stages:
+        # all (language, category) files, largest first within each language
+        jobs = discover_jobs()
+        signatures = {}
+        # the version of the translations, as in Translator.cache_name
+        translation_version = (("opus-mt:int8" if args.quantize else "opus-mt") +
+                               (":" + supervisor.version() if supervisor is not None else ""))
+        for source_language in jobs:
+            todo = []
+            for job in jobs[source_language]:
+                signature = runner.signature("translate", [job["path"], job["gold_path"]], translation_version)
+                if runner.up_to_date(job["translation_path"], signature, [job["translation_path"]]):
+                    runner.skip("translate", job["translation_path"])
+                else:
+                    signatures[job["translation_path"]] = signature
+                    todo.append(job)
+            jobs[source_language] = todo
+        jobs = {source_language: todo for source_language, todo in jobs.items() if todo}
+
+        if jobs:
+            # the languages run concurrently, each in its own process with its own model
+            translation_timings = schedule_translations(jobs, cores=args.translation_cores, memory_mb=args.translation_memory_mb,
+                                  max_tokens=args.translation_max_tokens, quantize=args.quantize,
+                                  supervisor=supervisor,
+                                  on_done=lambda job, result: runner.record(
+                                      job["translation_path"], signatures[job["translation_path"]],
+                                      [job["translation_path"]], result, result["seconds"]))
+
+    if "parse" in args.stages:
+        parse_cache = ParseCache("cache/graphs.sqlite")
+        translations = sorted(os.listdir("translations"))  # where the translated files are stored
+        if args.gsii:
+            if not os.path.exists(amr_dir):
+                os.makedirs(amr_dir)
+            # parse the translated file to AMR graphs and store them in AMRgraphs_GSII folder
+            parse_resumable(runner, "translations/amr-release-2.0-amrs-test-proxy.sentences.ES_nmt.txt",
+                            amr_dir + "/amr-release-2.0-amrs-test-proxy.sentences.ES_AMR.txt", AMR_model_dir,
+                            cache=parse_cache, checkpoint_every=args.checkpoint_every, quantize=args.quantize,
+                            supervisor=supervisor)
+
+        elif args.corpus_parse:
+            # parse the deduplicated sentences of all translated files in one go
+            input_paths = ["translations/" + translation for translation in translations]
+            output_paths = [amr_dir + "/" + translation[:-8] + "_AMR.txt" for translation in translations]
+            runner.run("parse", amr_dir + "/*", input_paths, output_paths,
+                       stog_model_version(AMR_model_dir, args.quantize, supervisor),
+                       lambda checkpoint: parse_corpus(input_paths, output_paths, AMR_model_dir, cache=parse_cache,
+                                                       quantize=args.quantize, supervisor=supervisor))
 
         else:
-            for i in range(len(translations)):
+            for translation in translations:
                 # parse all translated files to AMR graphs and store them in AMRgraphs folder
-                sentences = read_file("translations/" + translations[i])
-                graphs = sent_to_graph(sentences, AMR_model_dir)
-                new_path = "AMRgraphs/" + translations[i][:-8] + "_AMR.txt"
-                save_graphs(graphs, path=new_path)
-
-        if evaluate:
-            # unify categories per language into one file and truncate parsed files before unification:
-            if amr_gsii:
-                # unify categories per language into one file and truncate parsed files before unification:
-                if unify_files:
-                    # for file in amr_graphs:
-                    #     # truncate all files
-                    #     truncate_files('AMRgraphss_GSII/'+file)
-                    unification_dict = {"DE": [], "ES": [], "IT": [], "ZH": []}
-                    for lang in languages:
-                        for cat in categories:
-                            # order files per language
-                            filename = "amr-release-2.0-amrs-test-" + cat + ".sentences." + lang + "_AMR.txt"
-                            unification_dict[lang].append(filename)
-                    for lang in languages:
-                        # unify parsed AMR graph files into one file per language
-                        f0 = open("AMRgraphs_GSII/Unified-test-sentences." + lang + "_AMR.txt", 'a+',
-                                  encoding=preferred_encoding)
-                        for k in range(len(categories)):
-                            f1 = open("AMRgraphs_GSII/" + unification_dict[lang][k], 'r', encoding=preferred_encoding)
-                            f0.write(f1.read())
-                            f1.close()
-
-                    # # unify gold data into one file:
-                    # gamr = open("amr_2-four_translations/AMR/GOLD_AMR_unified.txt", 'a+', encoding=preferred_encoding)
-                    # for i in range(len(gold_amr_dir)):
-                    #     f1 = open("amr_2-four_translations/AMR/" + gold_amr_dir[i], 'r', encoding=preferred_encoding)
-                    #     gamr.write(f1.read())
-                    #     f1.close()
+                match = FILE_PATTERN.match(translation[:-8] + ".txt")
+                with context(language=match.group("language").lower() if match else None,
+                             category=match.group("category") if match else None):
+                    parse_resumable(runner, "translations/" + translation,
+                                    amr_dir + "/" + translation[:-8] + "_AMR.txt", AMR_model_dir,
+                                    cache=parse_cache, checkpoint_every=args.checkpoint_every,
+                                    quantize=args.quantize, supervisor=supervisor)
 
-                for lang in languages:
-                    print("Smatch for " + lang + ": \n")
-                    evaluate_smatch(gold_amrs_unified, "AMRgraphs_GSII/Unified-test-sentences." + lang + "_AMR.txt")
-            else:
-                if unify_files:
-                    for file in amr_graphs:
-                        # truncate all files
-                        truncate_files('AMRgraphs/'+file)
-                    unification_dict = {"DE": [], "ES": [], "IT": [], "ZH": []}
-                    for lang in languages:
-                        for cat in categories:
-                            # order files per language
-                            filename = "amr-release-2.0-amrs-test-" + cat + ".sentences." + lang + "_AMR.txt"
-                            unification_dict[lang].append(filename)
-                    for lang in languages:
-                        # unify parsed AMR graph files into one file per language
-                        f0 = open("AMRgraphs/Unified-test-sentences." + lang + "_AMR.txt", 'a+', encoding=preferred_encoding)
-                        for k in range(len(categories)):
-                            f1 = open("AMRgraphs/" + unification_dict[lang][k], 'r', encoding=preferred_encoding)
-                            f0.write(f1.read())
-                            f1.close()
-                    # unify gold data into one file:
-                    gamr = open("amr_2-four_translations/AMR/GOLD_AMR_unified.txt", 'a+', encoding=preferred_encoding)
-                    for i in range(len(gold_amr_dir)):
-                        f1 = open("amr_2-four_translations/AMR/" + gold_amr_dir[i], 'r', encoding=preferred_encoding)
-                        gamr.write(f1.read())
-                        f1.close()
+    if "evaluate" in args.stages:
+        unified_paths = {lang: amr_dir + "/Unified-test-sentences." + lang + "_AMR.txt" for lang in languages}
+        if args.unify:
+            # unify categories per language (dropping the obsolete last graph of each file) and the gold data
+            pred_paths = {lang: [amr_dir + "/amr-release-2.0-amrs-test-" + cat + ".sentences." + lang + "_AMR.txt"
+                                 for cat in categories] for lang in languages}
+            runner.run("unify", amr_dir + "/Unified-test-sentences",
+                       [path for paths in pred_paths.values() for path in paths] + gold_amr_categories,
+                       list(unified_paths.values()) + [gold_amrs_unified], None,
+                       lambda checkpoint: unify_graph_files(pred_paths, gold_amr_categories, unified_paths,
+                                                            gold_amrs_unified, encoding=preferred_encoding))
+
+        if not args.sequential_smatch:
+            def score(checkpoint):
+                return evaluate_languages(GoldIndex.from_file(gold_amrs_unified), unified_paths,
+                                          category_sizes(gold_amr_categories, categories), seed=args.smatch_seed)
 
+            # the scores depend on the seed of the alignment search; the sequential
+            # mode is not recorded, so the version also names the pooled mode
+            results = runner.run("evaluate", amr_dir + "/SMATCH", [gold_amrs_unified] + list(unified_paths.values()),
+                                 [], "pooled-smatch-seed%d" % args.smatch_seed, score)
+            if runner.timings[-1][2] == "skipped":
                 for lang in languages:
-                    print("Smatch for " + lang + ": \n")
-                    evaluate_smatch(gold_amrs_unified, "AMRgraphs/Unified-test-sentences." + lang + "_AMR.txt")
\ No newline at end of file
+                    print("SMATCH for {} -> P: {:.3f},  R: {:.3f},  F: {:.3f}".format(lang, *results[lang]["total"]))
+        else:
+            for lang in languages:
+                print("Smatch for " + lang + ": \n")
+                with context(language=lang.lower()):
+                    evaluate_smatch(gold_amrs_unified, unified_paths[lang], seed=args.smatch_seed)
+
+    runner.report()
+    if supervisor is not None:
+        supervisor.report()
+        supervisor.write(args.supervision_log)
+    registry.report()
+    tracer.summary()
+    if args.trace:
+        tracer.write(args.trace, args.trace_format)
+    if args.profile:
+        tracer.stop_profiler(args.profile)
+    if any("error" in timing for timing in translation_timings):
+        sys.exit("Translation of {} files failed".format(
+            sum("error" in timing for timing in translation_timings)))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Random access to the graphs of an AMR file (gold or parsed). A sidecar index
+<file>.idx.npz stores the byte offset and length of every graph block and its
+"# ::id" (if any); it is rebuilt only when the file's mtime or size changes.
+Graphs are sliced out of a memory map of the file, so fetching graph k does not
+read the rest of the file.
+"""
+
+import mmap
+import os
+import numpy as np
+
+
+def build_index(path):
+    """
+    Scan an AMR file once and locate its graph blocks. Blocks are delimited
+    as in amr_parser.iter_graph_blocks: blank lines end a block only after
+    its first graph line.
+
+    Parameters
+    ----------
+    path : String
+        Absolute or relative file path to the graphs.
+
+    Returns
+    -------
+    offsets : numpy.ndarray
+        Matrix of shape (number of graphs, 2) with byte offset and length of
+        each block (without the separating blank line).
+    ids : numpy.ndarray
+        The "# ::id" of each graph, "" if it has none.
+
+    """
+    offsets = []
+    ids = []
+    start = end = None
+    graph_id = ""
+    has_graph = False
+    position = 0
+    with open(path, mode='rb') as f:
+        for line in f:
+            content = line.rstrip(b"\r\n")
+            if not content.strip():
+                if has_graph:
+                    offsets.append((start, end - start))
+                    ids.append(graph_id)
+                    start = None
+                    graph_id = ""
+                    has_graph = False
+            else:
+                if start is None:
+                    start = position
+                stripped = content.lstrip()
+                if not stripped.startswith(b"#"):
+                    has_graph = True
+                elif stripped.startswith(b"# ::id ") and not has_graph:
+                    graph_id = stripped[7:].split(maxsplit=1)[0].decode('utf-8')
+                end = position + len(content)
+            position += len(line)
+    if has_graph:
+        offsets.append((start, end - start))
+        ids.append(graph_id)
+    return np.array(offsets, dtype=np.int64).reshape(-1, 2), np.array(ids, dtype=str)
+
+
+class AMRCorpus(object):
+
+    def __init__(self, path, encoding='utf-8'):
+        """
+        Open an AMR file and load (or build) its offset index.
+
+        Parameters
+        ----------
+        path : String
+            Absolute or relative file path to the graphs.
+        encoding : String, optional
+            Encoding of the file. The default is 'utf-8'.
+
+        """
+        self.path = path
+        self.encoding = encoding
+        self.index_path = path + ".idx.npz"
+        self.offsets, self.ids = self._load_index()
+        self._graph_numbers = None
+        self._file = open(path, mode='rb')
+        # an empty file cannot be memory-mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self.offsets) else b""
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+    def _load_index(self):
+        stamp = self._stamp()
+        if os.path.exists(self.index_path):
+            with np.load(self.index_path) as index:
+                if np.array_equal(index["stamp"], stamp):
+                    return index["offsets"], index["ids"]
+
+        offsets, ids = build_index(self.path)
+        # write next to the file and rename, so readers never see a partial index
+        temp_path = "%s.%d.tmp" % (self.index_path, os.getpid())
+        try:
+            with open(temp_path, mode='wb') as f:
+                np.savez(f, stamp=stamp, offsets=offsets, ids=ids)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # read-only directory: use the index without saving it
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return offsets, ids
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, graph_number):
+        offset, length = self.offsets[graph_number]
+        return self._map[offset:offset + length].decode(self.encoding)
+
+    def __iter__(self):
+        for graph_number in range(len(self)):
+            yield self[graph_number]
+
+    def raw(self, graph_number):
+        """
+        Zero-copy view of the bytes of graph graph_number.
+
+        Returns
+        -------
+        memoryview
+
+        """
+        offset, length = self.offsets[graph_number]
+        return memoryview(self._map)[offset:offset + length]
+
+    def graph_number(self, graph_id):
+        """
+        Number of the graph with "# ::id" graph_id (KeyError if unknown).
+
+        """
+        if self._graph_numbers is None:
+            self._graph_numbers = {graph_id: n for n, graph_id in enumerate(self.ids) if graph_id}
+        return self._graph_numbers[graph_id]
+
+    def by_id(self, graph_id):
+        return self[self.graph_number(graph_id)]
+
+    def sample(self, n, seed=0):
+        """
+        Draw n distinct graphs at random.
+
+        Returns
+        -------
+        list
+            List of (graph number, graph) tuples in file order.
+
+        """
+        rng = np.random.default_rng(seed)
+        graph_numbers = np.sort(rng.choice(len(self), size=min(n, len(self)), replace=False))
+        return [(int(k), self[k]) for k in graph_numbers]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
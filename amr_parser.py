@@ -4,11 +4,19 @@ Created on Fri Mar 12 15:46:32 2021
 
 @author: Yoalli R.G.
 """
-import amrlib
-from amrlib.evaluate.smatch_enhanced import compute_scores
+from model_registry import get_model
+from instrumentation import span
+from graph_store import read_entries, write_graph_store
+from smatch_eval import compute_scores, compute_smatch
+import hashlib
 import locale
 import multiprocessing
 import os
+import time
+
+# written in place of graphs the parser failed to produce
+PLACEHOLDER_GRAPH = "# ::snt\n\n(t / thing \n \t :ARG1-of (r / resemble-01))"
+
 
 def read_file(filename):
     """
@@ -25,12 +33,231 @@ def read_file(filename):
         List of english sentences.
 
     """
-    with open(filename, encoding=locale.getpreferredencoding(), mode='r') as sf:
-        lines = sf.readlines()
+    with span("read_sentences", "io", file=filename) as args:
+        with open(filename, encoding=locale.getpreferredencoding(), mode='r') as sf:
+            lines = sf.readlines()
+        args["sentences"] = len(lines)
     return lines
 
 
-def sent_to_graph(sent_list, path_to_model=None, verbose=False, device=None):
+def import_amrlib():
+    """
+    Import amrlib on first use, so that scoring and file handling do not pay
+    for its import.
+
+    """
+    import amrlib
+    return amrlib
+
+
+def load_stog(path_to_model=None, device=None, quantize=False):
+    """
+    Load the sentence to graph model (once per process).
+
+    Parameters
+    ----------
+    path_to_model : String, optional
+        Path to the AMR model dir. The default is amrlib's standard model.
+    device : String, optional
+        Device to load the model to.
+    quantize : Boolean, optional
+        Use int8 linear layers for inference on CPU (see quantization.py).
+
+    Returns
+    -------
+    stog
+        amrlib sentence to graph inference object.
+
+    """
+    def load():
+        stog = import_amrlib().load_stog_model(model_dir=path_to_model, device=device)
+        if quantize:
+            from quantization import quantize_stog
+            stog = quantize_stog(stog, stog_model_version(path_to_model))
+        return stog
+
+    return get_model("stog", load, name="int8" if quantize else None, model_dir=path_to_model, device=device)
+
+
+def load_gtos(path_to_model=None, device=None):
+    """
+    Load the graph to sentence model (once per process).
+
+    Parameters
+    ----------
+    path_to_model : String, optional
+        Path to the AMR model dir. The default is amrlib's standard model.
+    device : String, optional
+        Device to load the model to.
+
+    Returns
+    -------
+    gtos
+        amrlib graph to sentence inference object.
+
+    """
+    # without a device, amrlib picks one itself
+    kwargs = {} if device is None else {"device": device}
+    return get_model("gtos", lambda: import_amrlib().load_gtos_model(model_dir=path_to_model, **kwargs),
+                     model_dir=path_to_model, device=device)
+
+
+def stog_model_version(path_to_model=None, quantize=False, supervisor=None):
+    """
+    Identify the sentence to graph model by its resolved directory, its
+    amrlib metadata and the modification times of its files, so that cached
+    graphs are invalidated when the model changes.
+
+    Parameters
+    ----------
+    path_to_model : String, optional
+        Path to the AMR model dir. The default is amrlib's standard model.
+    quantize : Boolean, optional
+        Identify the int8 version of the model (whose graphs can differ).
+    supervisor : supervision.Supervisor, optional
+        Identify graphs parsed under its budgets (split sentences, greedy
+        retries).
+
+    Returns
+    -------
+    String
+        Model version identifier.
+
+    """
+    if path_to_model is None:
+        path_to_model = os.path.join(import_amrlib().defaults.data_dir, 'model_stog')
+    model_dir = os.path.realpath(path_to_model)
+    fingerprint = hashlib.sha1(model_dir.encode("utf-8"))
+    for name in sorted(os.listdir(model_dir)):
+        stat = os.stat(os.path.join(model_dir, name))
+        fingerprint.update("{}:{}:{}".format(name, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return (os.path.basename(model_dir) + "-" + fingerprint.hexdigest()[:12] + ("-int8" if quantize else "") +
+            ("-" + supervisor.version() if supervisor is not None else ""))
+
+
+def combine_graphs(sentence, graphs):
+    """
+    Combine the graphs of the pieces of a split sentence into one
+    multi-sentence graph (pieces that failed to parse are left out).
+
+    Returns
+    -------
+    String
+        The combined graph, None if no piece was parsed.
+
+    """
+    import penman
+    branches = [("/", "multi-sentence")]
+    for k, graph in enumerate(graph for graph in graphs if graph is not None):
+        tree = penman.parse(graph)
+        # the variables of each piece get a suffix to keep them apart
+        variables = {variable for variable, _ in tree.nodes()}
+
+        def rename(node):
+            variable, edges = node
+            return (variable + "_" + str(k + 1),
+                    [(role, rename(target) if isinstance(target, tuple) else
+                      target + "_" + str(k + 1) if target in variables and role != "/" else target)
+                     for role, target in edges])
+
+        branches.append((":snt" + str(k + 1), rename(tree.node)))
+    if len(branches) == 1:
+        return None
+    return penman.format(penman.Tree(("m", branches), metadata={"snt": sentence}))
+
+
+def parse_supervised(stog, sent_list, supervisor):
+    """
+    Parse sentences under a supervision.Supervisor: over-long sentences are
+    parsed in pieces and combined into a multi-sentence graph, generation is
+    stopped at the time budget and failed sentences are parsed again with
+    greedy search (one beam, one returned sequence).
+
+    Returns
+    -------
+    graphs
+        AMR graphs in the order of sent_list (None for failed parses).
+
+    """
+    from supervision import deadline_kwargs, generate_kwargs
+
+    # beam search settings of the T5 parser (other amrlib parsers have none)
+    settings = {name: getattr(stog, name) for name in ("num_beams", "num_ret_seq") if hasattr(stog, name)}
+
+    def parse(batch, seconds, greedy=False):
+        if greedy:
+            for name in settings:
+                setattr(stog, name, 1)
+        try:
+            kwargs = deadline_kwargs(seconds)
+            if not kwargs:
+                return stog.parse_sents(batch)
+            with generate_kwargs(stog.model, **kwargs):
+                return stog.parse_sents(batch)
+        finally:
+            for name, value in settings.items():
+                setattr(stog, name, value)
+
+    return supervisor.run("parse", sent_list,
+                          process=parse,
+                          retry=lambda sentence, seconds: parse([sentence], seconds, greedy=True)[0],
+                          failed=lambda sentence, graph: graph is None,
+                          fallback=lambda sentence: None,
+                          join=combine_graphs)
+
+
+def parse_sents(stog, sent_list, cache=None, model_version=None, supervisor=None):
+    """
+    Parse sentences with a loaded sentence to graph model. With a cache, only
+    the distinct sentences that are not cached yet are parsed.
+
+    Parameters
+    ----------
+    stog : Object
+        amrlib sentence to graph inference object.
+    sent_list : List
+        List of english sentences to be parsed.
+    cache : caches.ParseCache, optional
+        Cache of previously parsed graphs.
+    model_version : String, optional
+        Version of the model, see stog_model_version(). Required with a cache.
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence (see parse_supervised()).
+
+    Returns
+    -------
+    graphs
+        AMR graphs in the order of sent_list (None for failed parses).
+
+    """
+    def parse(sentences):
+        if supervisor is not None:
+            return parse_supervised(stog, sentences, supervisor)
+        return stog.parse_sents(sentences)
+
+    if cache is None:
+        with span("parse", "generation", sentences=len(sent_list)):
+            return parse(sent_list)
+
+    graphs = cache.get_many(model_version, sent_list)
+    uncached = list(dict.fromkeys(s for s, g in zip(sent_list, graphs) if g is None))
+    print("Parse cache:", len(sent_list) - sum(g is None for g in graphs), "hits,",
+          len(uncached), "unique sentences to parse")
+    if uncached:
+        with span("parse", "generation", sentences=len(uncached)):
+            parsed = parse(uncached)
+        cached = parsed
+        if supervisor is not None:
+            # fallbacks and graphs stopped at a time budget are not cached
+            cached = [None if i in supervisor.degraded else graph for i, graph in enumerate(parsed)]
+        cache.put_many(model_version, uncached, cached)
+        parsed = dict(zip(uncached, parsed))
+        graphs = [parsed[s] if g is None else g for s, g in zip(sent_list, graphs)]
+    return graphs
+
+
+def sent_to_graph(sent_list, path_to_model=None, verbose=False, device=None, cache=None, quantize=False,
+                  supervisor=None):
     """
     Parse english sentence to AMR graph.
 
@@ -40,6 +267,12 @@ def sent_to_graph(sent_list, path_to_model=None, verbose=False, device=None):
         List of english sentences to be parsed.
     verbose : Boolean, optional
         For printing the parsed graphs.
+    cache : caches.ParseCache, optional
+        Cache of previously parsed graphs.
+    quantize : Boolean, optional
+        Parse with the int8 model (see load_stog()).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence (see parse_supervised()).
 
     Returns
     -------
@@ -48,9 +281,10 @@ def sent_to_graph(sent_list, path_to_model=None, verbose=False, device=None):
 
     """
     print("Parsing sentences to AMR...")
-    stog = amrlib.load_stog_model(model_dir=path_to_model, device=device)
+    stog = load_stog(path_to_model, device, quantize)
     print("Model loaded.")
-    graphs = stog.parse_sents(sent_list)
+    model_version = stog_model_version(path_to_model, quantize, supervisor) if cache is not None else None
+    graphs = parse_sents(stog, sent_list, cache, model_version, supervisor)
     if verbose:
         for graph in graphs:
             print(graph)
@@ -58,6 +292,88 @@ def sent_to_graph(sent_list, path_to_model=None, verbose=False, device=None):
     return graphs
 
 
+def parse_corpus(input_paths, output_paths, path_to_model=None, device=None, batch_size=64,
+                 cache=None, compare_per_file=False, quantize=False, supervisor=None):
+    """
+    Parse several files of english sentences with a single model instance.
+    The sentences of all files are deduplicated, sorted by token length to
+    reduce padding and parsed in large batches; the graphs are then saved to
+    one output file per input file in the original order.
+
+    Parameters
+    ----------
+    input_paths : List
+        Paths to the files with english sentences, one sentence per line.
+    output_paths : List
+        Paths to save the graphs of each input file to.
+    path_to_model : String, optional
+        Path to the AMR model dir.
+    device : String, optional
+        Device to load the model to.
+    batch_size : int, optional
+        Number of sentences per batch. The default is 64.
+    cache : caches.ParseCache, optional
+        Cache of previously parsed graphs.
+    compare_per_file : Boolean, optional
+        Additionally parse each file on its own (without cache) and report
+        the throughput of both approaches.
+    quantize : Boolean, optional
+        Parse with the int8 model (see load_stog()).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence (see parse_supervised()).
+
+    Returns
+    -------
+    dict
+        Number of sentences, unique sentences, dedup ratio, seconds and
+        sentences per second.
+
+    """
+    files = [read_file(path) for path in input_paths]
+    unique = list(dict.fromkeys(sentence for sentences in files for sentence in sentences))
+    unique.sort(key=lambda sentence: len(sentence.split()), reverse=True)
+    n_sentences = sum(len(sentences) for sentences in files)
+
+    print("Parsing", n_sentences, "sentences from", len(files), "files to AMR...")
+    stog = load_stog(path_to_model, device, quantize)
+    model_version = stog_model_version(path_to_model, quantize, supervisor) if cache is not None else None
+    default_batch_size = stog.batch_size
+    stog.batch_size = batch_size
+    start = time.perf_counter()
+    try:
+        parsed = {}
+        for i in range(0, len(unique), batch_size):
+            batch = unique[i:i + batch_size]
+            parsed.update(zip(batch, parse_sents(stog, batch, cache, model_version, supervisor)))
+    finally:
+        stog.batch_size = default_batch_size
+    elapsed = time.perf_counter() - start
+
+    for sentences, path in zip(files, output_paths):
+        save_graphs([parsed[sentence] for sentence in sentences], path)
+
+    report = {"sentences": n_sentences,
+              "unique_sentences": len(unique),
+              "dedup_ratio": len(unique) / n_sentences if n_sentences else 1.0,
+              "seconds": elapsed,
+              "sentences_per_second": n_sentences / elapsed if elapsed else 0.0}
+    print("Corpus parse: {} of {} sentences unique (dedup ratio {:.3f}), {:.2f} sentences/s".format(
+        len(unique), n_sentences, report["dedup_ratio"], report["sentences_per_second"]))
+
+    if compare_per_file:
+        start = time.perf_counter()
+        for sentences in files:
+            stog.parse_sents(sentences)
+        per_file_elapsed = time.perf_counter() - start
+        report["per_file_sentences_per_second"] = n_sentences / per_file_elapsed if per_file_elapsed else 0.0
+        print("Per-file parse: {:.2f} sentences/s (corpus parse is {:.2f}x faster)".format(
+            report["per_file_sentences_per_second"],
+            report["sentences_per_second"] / report["per_file_sentences_per_second"]
+            if report["per_file_sentences_per_second"] else float("inf")))
+
+    return report
+
+
 def graph_to_sent(graphs, path_to_model=None, verbose=False):
     """
     Parse AMR graphs to english sentences.
@@ -76,8 +392,9 @@ def graph_to_sent(graphs, path_to_model=None, verbose=False):
 
     """
     print("Parsing AMR graphs to sentences...")
-    gtos = amrlib.load_gtos_model(model_dir=path_to_model)
-    sents, _ = gtos.generate(graphs)
+    gtos = load_gtos(path_to_model)
+    with span("generate", "generation", sentences=len(graphs)):
+        sents, _ = gtos.generate(graphs)
     if verbose:
         for sent in sents:
             print(sent)
@@ -85,7 +402,7 @@ def graph_to_sent(graphs, path_to_model=None, verbose=False):
     return sents
 
 
-def save_graphs(graphs, path):
+def save_graphs(graphs, path, store_path=None):
     """
     Save graphs to path where each graph is separated by a new line.
 
@@ -94,24 +411,176 @@ def save_graphs(graphs, path):
     graphs : Object
     path : String
         Absolute or relative file path to save graphs to.
+    store_path : String, optional
+        If given, the graphs are also saved in the binary format of
+        graph_store (by convention "....amrb"), which loads and scores
+        without parsing PENMAN text.
 
     Returns
     -------
     None.
 
     """
-    with open(path, mode="w", encoding='utf-8') as gr:
-        for graph in graphs:
-            if graph == None:
-                gr.write("# ::snt\n\n(t / thing \n \t :ARG1-of (r / resemble-01))")
-                gr.write("\n\n")
-            else:
-                gr.write(graph)
-                gr.write("\n\n")
+    with span("save_graphs", "serialization", file=path, sentences=len(graphs)):
+        with open(path, mode="w", encoding='utf-8') as gr:
+            write_graphs(graphs, gr)
     print("Graphs saved to", path)
+    failed = sum(graph is None for graph in graphs)
+    if failed:
+        print("  {} of {} graphs failed to parse and were saved as placeholders".format(failed, len(graphs)))
+    if store_path is not None:
+        # failed graphs as the same placeholder, so both files score the same
+        with span("save_graph_store", "serialization", file=store_path, sentences=len(graphs)):
+            write_graph_store([PLACEHOLDER_GRAPH if graph is None else graph for graph in graphs], store_path)
+        print("Binary graphs saved to", store_path)
+
+
+def write_graphs(graphs, gr):
+    """
+    Write graphs to an open file where each graph is separated by a new line.
+    Graphs the parser failed to produce (None) are replaced by a placeholder.
+
+    Parameters
+    ----------
+    graphs : Object
+    gr : File
+        File object opened for writing.
+
+    Returns
+    -------
+    None.
+
+    """
+    for graph in graphs:
+        if graph == None:
+            gr.write(PLACEHOLDER_GRAPH)
+            gr.write("\n\n")
+        else:
+            gr.write(graph)
+            gr.write("\n\n")
+
+
+def iter_graph_blocks(path, encoding='utf-8'):
+    """
+    Read an AMR file lazily, one graph at a time. A block consists of the
+    comment lines and the graph lines of one graph; blank lines between
+    comments (as in the placeholder graph or a file header) stay inside the
+    block.
+
+    Parameters
+    ----------
+    path : String
+        Absolute or relative file path to the graphs.
+    encoding : String, optional
+        Encoding of the file. The default is 'utf-8'.
 
+    Yields
+    ------
+    String
+        Text of one block without the separating blank line.
 
-def evaluate_smatch(gold_path, pred_path):
+    """
+    with open(path, mode='r', encoding=encoding) as f:
+        lines = []
+        has_graph = False
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                if has_graph:
+                    yield "\n".join(lines)
+                    lines = []
+                    has_graph = False
+                elif lines:
+                    lines.append(line)
+                continue
+            if not line.lstrip().startswith("#"):
+                has_graph = True
+            lines.append(line)
+        if has_graph:
+            yield "\n".join(lines)
+
+
+def unify_graph_files(pred_paths, gold_paths, unified_paths, gold_unified_path, encoding='utf-8'):
+    """
+    Concatenate the parsed graph files of each language and the gold graph
+    files into one file each, category by category, in a single buffered
+    pass. A trailing placeholder graph (parsed from the empty last line of a
+    translation file) is dropped if a file has one graph more than its gold
+    file. All files are written to temporary files first and then renamed,
+    so a rerun replaces the unified files instead of appending to them.
+
+    Parameters
+    ----------
+    pred_paths : dict
+        Paths to the parsed files of each category per language, e.g.
+        {"DE": ["...-bolt.sentences.DE_AMR.txt", ...]}.
+    gold_paths : List
+        Paths to the gold files of each category, in the same order.
+    unified_paths : dict
+        Path to the unified file of each language.
+    gold_unified_path : String
+        Path to the unified gold file.
+    encoding : String, optional
+        Encoding of all files. The default is 'utf-8'.
+
+    Returns
+    -------
+    dict
+        Number of graphs written for "gold" and for each language.
+
+    """
+    targets = dict(unified_paths, gold=gold_unified_path)
+    temp_paths = {}
+    outputs = {}
+    counts = {key: 0 for key in targets}
+    try:
+        for key, path in targets.items():
+            temp_paths[key] = "%s.%d.tmp" % (path, os.getpid())
+            outputs[key] = open(temp_paths[key], mode='w', encoding=encoding)
+
+        for category, gold_path in enumerate(gold_paths):
+            gold_graphs = 0
+            for block in iter_graph_blocks(gold_path, encoding):
+                outputs["gold"].write(block + "\n\n")
+                gold_graphs += 1
+            counts["gold"] += gold_graphs
+
+            for language, paths in pred_paths.items():
+                # hold back one block to decide whether the last one is obsolete
+                previous = None
+                graphs = 0
+                for block in iter_graph_blocks(paths[category], encoding):
+                    if previous is not None:
+                        outputs[language].write(previous + "\n\n")
+                    previous = block
+                    graphs += 1
+                if previous is not None:
+                    if previous == PLACEHOLDER_GRAPH and graphs > gold_graphs:
+                        graphs -= 1
+                    else:
+                        outputs[language].write(previous + "\n\n")
+                if graphs != gold_graphs:
+                    print("Warning:", paths[category], "has", graphs, "graphs,", gold_path, "has", gold_graphs)
+                counts[language] += graphs
+
+        for output in outputs.values():
+            output.close()
+        for key, path in targets.items():
+            os.replace(temp_paths[key], path)
+    except BaseException:
+        for output in outputs.values():
+            output.close()
+        for temp_path in temp_paths.values():
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+
+    for key, path in targets.items():
+        print("Unified", counts[key], "graphs into", path)
+    return counts
+
+
+def evaluate_smatch(gold_path, pred_path, seed=0):
     """
     Compute SMATCH score for predicted AMR graphs based on gold graphs.
 
@@ -120,14 +589,47 @@ def evaluate_smatch(gold_path, pred_path):
     gold_path : Object
     pred_path : String
         Absolute or relative file path to gold graphs and predicted graphs.
+    seed : int, optional
+        Seed of the random initializations of the alignments. The default
+        is 0.
 
     Returns
     -------
-    None.
+    dict
+        (precision, recall, F1) of the SMATCH score and each sub-score.
 
     """
-    scores = compute_scores(pred_path, gold_path)
+    with span("smatch", "scoring", file=pred_path):
+        scores = compute_scores(pred_path, gold_path, seed)
     print("SMATCH scores: " + str(scores))
+    return scores
+
+
+def smatch_scores(gold_path, pred_path, seed=0):
+    """
+    Compute the SMATCH precision, recall and F1 score for predicted AMR graphs
+    based on gold graphs without the additional sub-scores.
+
+    Parameters
+    ----------
+    gold_path : String
+    pred_path : String
+        Absolute or relative file path to gold graphs and predicted graphs.
+    seed : int, optional
+        Seed of the random initializations of the alignments. The default
+        is 0.
+
+    Returns
+    -------
+    dict
+        Precision, recall and F1 score.
+
+    """
+    with span("smatch", "scoring", file=pred_path) as args:
+        pred_entries, gold_entries = read_entries(pred_path), read_entries(gold_path)
+        args["sentences"] = len(gold_entries)
+        precision, recall, f_score = compute_smatch(pred_entries, gold_entries, seed)
+    return {"precision": precision, "recall": recall, "f1": f_score}
 
 #
 # if __name__ == '__main__':
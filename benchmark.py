@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the pipeline: translation, AMR parsing and generation,
+and the BLEU, cosine similarity and SMATCH evaluations, on inputs of
+increasing size. Sentences per second, model load times, peak memory and
+per-batch latencies are written to JSON and can be compared against a stored
+baseline to detect regressions (e.g. after upgrading amrlib, easynmt or
+torch). The startup time of each entry point (importing it without running
+it) and the heavy libraries it imports are tracked in the same way.
+
+The inputs are the small fixtures in benchmark_fixtures/ (repeated to the
+requested sizes) unless other files are given. With -stub, lightweight stand-in
+models are registered instead of the pretrained ones, so the benchmark runs
+offline and measures the pipeline's own overhead.
+
+With -quantization_report, the pretrained models are run with fp32 and with
+int8 linear layers (see quantization.py) at each number of threads, and
+their throughput, peak memory, BLEU and SMATCH are compared.
+
+Usage:
+    python benchmark.py [-sizes 16 64 256] [-stub] [-output <file>] [-baseline <file>] [-threshold 0.1]
+    python benchmark.py -quantization_report [-sizes 64] [-threads 1 4]
+"""
+
+from amr_parser import sent_to_graph, graph_to_sent, load_stog, load_gtos, parse_sents, evaluate_smatch, write_graphs
+from nmt_english import Translator, load_sbert
+from model_registry import registry, get_model
+from amr_corpus import AMRCorpus
+from smatch_eval import compute_smatch
+from graph_store import read_entries
+import bleu as bleu_scoring
+from pipeline import peak_rss_mb
+import argparse
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures")
+SBERT_NAME = 'bert-base-nli-mean-tokens'
+BENCHMARKS = ["translate", "sent_to_graph", "graph_to_sent", "evaluate_bleu", "evaluate_cosine_similarity",
+              "evaluate_smatch"]
+ENTRY_POINTS = ["__main__.py", "x_parse.py", "x_parse_server.py", "pipeline.py", "nmt_english.py", "smatch_eval.py"]
+# libraries that should only be imported when a model is loaded
+HEAVY_MODULES = ["torch", "transformers", "easynmt", "sentence_transformers", "amrlib"]
+
+
+class StubTranslator(object):
+    """
+    Stand-in for EasyNMT: returns the known translation of fixture sentences
+    and other sentences unchanged.
+
+    """
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def translate(self, documents, target_lang, source_lang=None, batch_size=16, **kwargs):
+        return [self.pairs.get(document, document) for document in documents]
+
+
+class StubParser(object):
+    """
+    Stand-in for the amrlib sentence to graph model: returns the fixture graph
+    of known sentences and a fixed graph for all others.
+
+    """
+
+    def __init__(self, graphs):
+        self.graphs = graphs
+        self.batch_size = 16
+
+    def parse_sents(self, sentences):
+        return [self.graphs.get(sentence.strip(), "# ::snt " + sentence.strip() + "\n(t / thing)")
+                for sentence in sentences]
+
+
+class StubGenerator(object):
+    """
+    Stand-in for the amrlib graph to sentence model: returns the "# ::snt" of
+    each graph.
+
+    """
+
+    def generate(self, graphs):
+        sentences = []
+        for graph in graphs:
+            lines = [line[8:] for line in graph.splitlines() if line.startswith("# ::snt ")]
+            sentences.append(lines[0] if lines else "")
+        return sentences, [False] * len(graphs)
+
+
+class StubEncoder(object):
+    """
+    Stand-in for Sentence-BERT: hashed bag-of-words vectors.
+
+    """
+
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, device=None, **kwargs):
+        embeddings = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                embeddings[i, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dim] += 1.0
+        return embeddings
+
+
+def install_stubs(source_sentences, gold_sentences, graphs):
+    """
+    Register the stub models under the keys the pipeline loads its models
+    with, so that Translator, sent_to_graph and graph_to_sent use them.
+
+    """
+    registry.evict()
+    graphs_by_sentence = {}
+    for graph in graphs:
+        for line in graph.splitlines():
+            if line.startswith("# ::snt "):
+                graphs_by_sentence[line[8:].strip()] = graph
+    get_model("easynmt", lambda: StubTranslator(dict(zip(source_sentences, gold_sentences))),
+              name="opus-mt", device="cpu")
+    get_model("stog", lambda: StubParser(graphs_by_sentence))
+    get_model("gtos", lambda: StubGenerator())
+    get_model("sbert", lambda: StubEncoder(), name=SBERT_NAME)
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def read_inputs(source_file=None, gold_file=None, graph_file=None):
+    """
+    Read the sentences to translate, the English gold sentences and the gold
+    graphs (the fixtures unless other files are given).
+
+    """
+    inputs = {"source": read_lines(source_file or os.path.join(FIXTURE_DIR, "sentences.es.txt")),
+              "gold": read_lines(gold_file or os.path.join(FIXTURE_DIR, "sentences.en.txt"))}
+    with AMRCorpus(graph_file or os.path.join(FIXTURE_DIR, "graphs.txt")) as corpus:
+        inputs["graphs"] = list(corpus)
+    return inputs
+
+
+def repeat(items, size):
+    return [items[i % len(items)] for i in range(size)]
+
+
+def measure_model_loads():
+    """
+    Returns
+    -------
+    dict
+        Seconds to load each model (close to 0 if it was already resident).
+
+    """
+    loads = {}
+    for kind, load in [("easynmt", lambda: Translator()),
+                       ("stog", lambda: load_stog()),
+                       ("gtos", lambda: load_gtos()),
+                       ("sbert", lambda: get_model("sbert", lambda: load_sbert(SBERT_NAME), name=SBERT_NAME))]:
+        start = time.perf_counter()
+        load()
+        loads[kind] = time.perf_counter() - start
+    return loads
+
+
+def measure_startup(entry_points=ENTRY_POINTS, repeats=5):
+    """
+    Time importing each entry point in a fresh interpreter (its module level
+    code, without the __main__ block) and record which heavy libraries it
+    imports.
+
+    Returns
+    -------
+    dict
+        For each entry point the median seconds and the heavy modules
+        imported.
+
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ("import json, runpy, sys; sys.path.insert(0, {!r}); runpy.run_path({!r}, run_name='startup'); "
+            "print(json.dumps([m for m in {!r} if m in sys.modules]))")
+    startup = {}
+    for entry_point in entry_points:
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, "-c", code.format(project_dir, os.path.join(project_dir, entry_point),
+                                                                       HEAVY_MODULES)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, cwd=project_dir)
+            seconds.append(time.perf_counter() - start)
+        startup[entry_point] = {"seconds": statistics.median(seconds),
+                                "heavy_modules": json.loads(output.stdout.decode("utf-8").splitlines()[-1])}
+    return startup
+
+
+def timed_batches(items, batch_size, operation):
+    """
+    Apply operation to items batch by batch.
+
+    Returns
+    -------
+    list
+        Latency of each batch in seconds.
+
+    """
+    latencies = []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        begin = time.perf_counter()
+        operation(batch)
+        latencies.append(time.perf_counter() - begin)
+    return latencies
+
+
+def run_benchmark(name, size, inputs, batch_size, source_language):
+    """
+    Run one benchmark on inputs of the given size.
+
+    Returns
+    -------
+    dict
+        Sentences, seconds, sentences per second, batch latencies in ms
+        (p50, p99, mean) and peak RSS in MB.
+
+    """
+    source_sentences = repeat(inputs["source"], size)
+    gold_sentences = repeat(inputs["gold"], size)
+    graphs = repeat(inputs["graphs"], size)
+
+    translator = Translator()
+    translator.to_translate_path = "benchmark"
+    translator.gold_sentences = gold_sentences
+    translator.translation = gold_sentences
+    if name.startswith("evaluate_") and name != "evaluate_smatch":
+        translator.translation = translator.translate_sentences(source_sentences, source_language)
+
+    if name == "translate":
+        latencies = timed_batches(source_sentences, batch_size,
+                                  lambda batch: translator.translate_sentences(batch, source_language))
+    elif name == "sent_to_graph":
+        latencies = timed_batches(gold_sentences, batch_size, sent_to_graph)
+    elif name == "graph_to_sent":
+        latencies = timed_batches(graphs, batch_size, graph_to_sent)
+    elif name == "evaluate_bleu":
+        latencies = timed_batches([None], 1, lambda _: translator.evaluate_bleu())
+    elif name == "evaluate_cosine_similarity":
+        latencies = timed_batches([None], 1, lambda _: translator.evaluate_cosine_similarity())
+    else:
+        # score the parses of the gold graphs' sentences against the gold graphs
+        sentences = [line[8:] for graph in graphs for line in graph.splitlines() if line.startswith("# ::snt ")]
+        with open("gold.txt", mode="w", encoding="utf-8") as f:
+            write_graphs(graphs, f)
+        with open("pred.txt", mode="w", encoding="utf-8") as f:
+            write_graphs(parse_sents(load_stog(), sentences), f)
+        latencies = timed_batches([None], 1, lambda _: evaluate_smatch("gold.txt", "pred.txt"))
+
+    seconds = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {"sentences": size,
+            "seconds": seconds,
+            "sentences_per_second": size / seconds if seconds else 0.0,
+            "batch_latency_ms": {"p50": float(np.percentile(latencies_ms, 50)),
+                                 "p99": float(np.percentile(latencies_ms, 99)),
+                                 "mean": float(np.mean(latencies_ms))},
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def _precision_run(precision, threads, inputs, size, source_language, results):
+    """
+    Translate and parse size sentences with the fp32 or int8 models in this
+    process, score them and put the result on the results queue (see
+    quantization_report()).
+
+    """
+    from quantization import set_threads
+    quantize = precision == "int8"
+    result = {"precision": precision, "threads": set_threads(threads), "sentences": size}
+    source_sentences = repeat(inputs["source"], size)
+    gold_sentences = repeat(inputs["gold"], size)
+    graphs = repeat(inputs["graphs"], size)
+    sentences = [line[8:] for graph in graphs for line in graph.splitlines() if line.startswith("# ::snt ")]
+
+    with contextlib.redirect_stdout(sys.stderr):
+        start = time.perf_counter()
+        translator = Translator(quantize=quantize)
+        # EasyNMT loads (and quantizes) the model of a language pair on first use
+        translator.translate_sentences(source_sentences[:1], source_language)
+        stog = load_stog(quantize=quantize)
+        result["load_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        translation = translator.translate_sentences(source_sentences, source_language)
+        seconds = time.perf_counter() - start
+        result["translate_sentences_per_second"] = size / seconds if seconds else 0.0
+        result["bleu"] = float(np.mean(bleu_scoring.sentence_bleu_scores(
+            bleu_scoring.corpus_stats(gold_sentences, translation))))
+
+        start = time.perf_counter()
+        parsed = parse_sents(stog, sentences)
+        seconds = time.perf_counter() - start
+        result["parse_sentences_per_second"] = len(sentences) / seconds if seconds else 0.0
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, to_write in [("gold.txt", graphs), ("pred.txt", parsed)]:
+                with open(os.path.join(workdir, name), mode="w", encoding="utf-8") as f:
+                    write_graphs(to_write, f)
+            result["smatch"] = compute_smatch(read_entries(os.path.join(workdir, "pred.txt")),
+                                              read_entries(os.path.join(workdir, "gold.txt")))[2]
+    result["peak_rss_mb"] = peak_rss_mb()
+    results.put(result)
+
+
+def quantization_report(inputs, source_language="es", size=64, thread_counts=(None,)):
+    """
+    Compare the fp32 and the int8 models at each number of threads. Every
+    run is a fresh process, so that its peak memory is its own.
+
+    Returns
+    -------
+    list
+        Precision, threads, load seconds, translation and parsing sentences
+        per second, peak RSS in MB, BLEU and SMATCH F1 of each run.
+
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    rows = []
+    for threads in thread_counts:
+        for precision in ["fp32", "int8"]:
+            # not a pool worker: the SMATCH evaluation starts its own processes
+            process = context.Process(target=_precision_run,
+                                      args=(precision, threads, inputs, size, source_language, results))
+            process.start()
+            rows.append(results.get())
+            process.join()
+
+    print("\n{:<6} {:>7} {:>8} {:>15} {:>15} {:>12} {:>7} {:>7}".format(
+        "model", "threads", "load s", "translate s/s", "parse s/s", "peak RSS MB", "BLEU", "SMATCH"))
+    for row in rows:
+        print("{:<6} {:>7} {:>8.1f} {:>15.2f} {:>15.2f} {:>12} {:>7.4f} {:>7.4f}".format(
+            row["precision"], row["threads"], row["load_seconds"], row["translate_sentences_per_second"],
+            row["parse_sentences_per_second"],
+            "n/a" if row["peak_rss_mb"] is None else "{:.0f}".format(row["peak_rss_mb"]),
+            row["bleu"], row["smatch"]))
+    return rows
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare the throughput of each benchmark and size with a baseline.
+
+    Returns
+    -------
+    list
+        (benchmark, size, baseline sentences/s, current sentences/s) of all
+        regressions by more than threshold (a fraction).
+
+    """
+    regressions = []
+    for entry_point, result in results.get("startup", {}).items():
+        reference = baseline.get("startup", {}).get(entry_point)
+        if reference is None:
+            continue
+        change = result["seconds"] / reference["seconds"] - 1 if reference["seconds"] else 0.0
+        new_modules = sorted(set(result["heavy_modules"]) - set(reference["heavy_modules"]))
+        flag = "  REGRESSION" if change > threshold or new_modules else ""
+        print("startup {:<20} {:>8.3f}s -> {:>8.3f}s {:>+8.1%}{}{}".format(
+            entry_point, reference["seconds"], result["seconds"], change, flag,
+            " (now imports " + ", ".join(new_modules) + ")" if new_modules else ""))
+        if flag:
+            regressions.append(("startup", entry_point, reference["seconds"], result["seconds"]))
+    print("\n{:<28} {:>6} {:>16} {:>16} {:>8}".format("benchmark", "size", "baseline sent/s", "current sent/s", "change"))
+    for name, sizes in results["benchmarks"].items():
+        for size, result in sizes.items():
+            reference = baseline.get("benchmarks", {}).get(name, {}).get(size)
+            if reference is None or not reference["sentences_per_second"]:
+                continue
+            change = result["sentences_per_second"] / reference["sentences_per_second"] - 1
+            flag = "  REGRESSION" if change < -threshold else ""
+            print("{:<28} {:>6} {:>16.2f} {:>16.2f} {:>+8.1%}{}".format(
+                name, size, reference["sentences_per_second"], result["sentences_per_second"], change, flag))
+            if flag:
+                regressions.append((name, size, reference["sentences_per_second"], result["sentences_per_second"]))
+    return regressions
+
+
+def versions():
+    found = {"python": platform.python_version()}
+    for package in ["amrlib", "easynmt", "torch", "transformers", "sentence_transformers", "numpy", "smatch"]:
+        try:
+            module = __import__(package)
+            found[package] = getattr(module, "__version__", "unknown")
+        except ImportError:
+            found[package] = None
+    return found
+
+
+def run(sizes, benchmarks=BENCHMARKS, batch_size=16, stub=False, source_file=None, gold_file=None,
+        graph_file=None, source_language="es", startup=True):
+    """
+    Run the benchmarks on inputs of each size.
+
+    Returns
+    -------
+    dict
+        Environment, startup times, model load times and the results of each
+        benchmark by size.
+
+    """
+    inputs = read_inputs(source_file, gold_file, graph_file)
+    if stub:
+        install_stubs(inputs["source"], inputs["gold"], inputs["graphs"])
+
+    results = {"environment": dict(versions(), stub=stub, cpus=os.cpu_count(), time=time.time()),
+               "batch_size": batch_size,
+               "benchmarks": {}}
+    if startup:
+        # before this process loads any model, in fresh interpreters
+        results["startup"] = measure_startup()
+        for entry_point, result in results["startup"].items():
+            print("startup {:<20} {:8.3f}s  heavy modules: {}".format(
+                entry_point, result["seconds"], ", ".join(result["heavy_modules"]) or "none"))
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # the evaluations write their reports and scores to the working directory
+        os.chdir(workdir)
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                results["model_load_seconds"] = measure_model_loads()
+                for name in benchmarks:
+                    results["benchmarks"][name] = {}
+                    for size in sizes:
+                        results["benchmarks"][name][str(size)] = run_benchmark(name, size, inputs, batch_size,
+                                                                               source_language)
+        finally:
+            os.chdir(cwd)
+
+    for name, by_size in results["benchmarks"].items():
+        for size, result in by_size.items():
+            print("{:<28} {:>6} sentences: {:10.2f} sentences/s, batch p50 {:8.2f} ms, p99 {:8.2f} ms".format(
+                name, size, result["sentences_per_second"], result["batch_latency_ms"]["p50"],
+                result["batch_latency_ms"]["p99"]))
+    return results
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the pipeline.")
+    parser.add_argument("-sizes", type=int, nargs="+", default=[16, 64, 256], help="numbers of sentences")
+    parser.add_argument("-benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("-batch_size", type=int, default=16)
+    parser.add_argument("-stub", action="store_true", help="use stand-in models (offline)")
+    parser.add_argument("-source_file", default=None, help="sentences to translate (default: fixtures)")
+    parser.add_argument("-gold_file", default=None, help="English gold sentences (default: fixtures)")
+    parser.add_argument("-graph_file", default=None, help="gold AMR graphs (default: fixtures)")
+    parser.add_argument("-lang", default="es", help="language of the source file")
+    parser.add_argument("-output", default="benchmark_results.json")
+    parser.add_argument("-baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("-threshold", type=float, default=0.1, help="tolerated slowdown, e.g. 0.1 for 10%%")
+    parser.add_argument("-update_baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("-no_startup", action="store_true", help="do not measure the startup of the entry points")
+    parser.add_argument("-quantization_report", action="store_true",
+                        help="compare the fp32 and int8 models (on the first size) instead")
+    parser.add_argument("-threads", type=int, nargs="+", default=[None],
+                        help="torch threads of the quantization report (default: torch's default)")
+    args = parser.parse_args()
+
+    if args.quantization_report:
+        if args.stub:
+            parser.error("-quantization_report needs the pretrained models, not -stub")
+        inputs = read_inputs(args.source_file, args.gold_file, args.graph_file)
+        results = {"environment": dict(versions(), cpus=os.cpu_count(), time=time.time()),
+                   "quantization": quantization_report(inputs, args.lang, args.sizes[0], args.threads)}
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print("Results saved to", args.output)
+        sys.exit(0)
+
+    results = run(args.sizes, args.benchmarks, args.batch_size, args.stub, args.source_file, args.gold_file,
+                  args.graph_file, args.lang, not args.no_startup)
+    with open(args.output, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print("Results saved to", args.output)
+
+    regressions = []
+    if args.baseline is not None:
+        if args.update_baseline or not os.path.exists(args.baseline):
+            with open(args.baseline, mode="w", encoding="utf-8") as f:
+                json.dump(results, f, indent=1)
+            print("Baseline saved to", args.baseline)
+        else:
+            with open(args.baseline, encoding="utf-8") as f:
+                regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print("\n{} regression(s) by more than {:.0%}".format(len(regressions), args.threshold))
+        sys.exit(1)
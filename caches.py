@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk caches (SQLite) for results that are expensive to recompute
+between runs.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import unicodedata
+
+
+def normalize_sentence(sentence):
+    """
+    Normalize a sentence for cache lookups: unicode NFC, surrounding
+    whitespace removed and inner whitespace collapsed to single spaces.
+
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", sentence)).strip()
+
+
+def _hash_key(*parts):
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class TranslationCache(object):
+
+    def __init__(self, path="cache/translations.sqlite"):
+        """
+        Content-addressed cache of translations, keyed by model name, source
+        language, target language and the normalized source sentence.
+
+        Parameters
+        ----------
+        path : String, optional
+            Path to the SQLite database. The default is "cache/translations.sqlite".
+
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS translations "
+                                "(key TEXT PRIMARY KEY, translation TEXT NOT NULL)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(model_name, source_language, target_language, sentence):
+        return _hash_key(model_name, source_language, target_language, normalize_sentence(sentence))
+
+    def get_many(self, model_name, source_language, target_language, sentences):
+        """
+        Look up the translations of a list of sentences.
+
+        Returns
+        -------
+        list
+            Cached translation for each sentence, None for cache misses.
+
+        """
+        keys = [self.key(model_name, source_language, target_language, s) for s in sentences]
+        found = {}
+        unique_keys = list(set(keys))
+        # stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            rows = self.connection.execute("SELECT key, translation FROM translations WHERE key IN ({})".format(
+                ",".join("?" * len(batch))), batch)
+            found.update(rows)
+        return [found.get(k) for k in keys]
+
+    def put_many(self, model_name, source_language, target_language, sentences, translations):
+        """
+        Store the translations of a list of sentences.
+
+        Returns
+        -------
+        None.
+
+        """
+        rows = [(self.key(model_name, source_language, target_language, s), t)
+                for s, t in zip(sentences, translations)]
+        self.connection.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?)", rows)
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class ParseCache(object):
+
+    def __init__(self, path="cache/graphs.sqlite", max_bytes=512 * 1024 ** 2):
+        """
+        Cache of serialized PENMAN graphs, keyed by the version of the sentence
+        to graph model and the exact sentence. When the cached graphs exceed
+        max_bytes, the least recently used entries are evicted.
+
+        Parameters
+        ----------
+        path : String, optional
+            Path to the SQLite database. The default is "cache/graphs.sqlite".
+        max_bytes : int, optional
+            Maximum total size of the cached graphs. The default is 512 MB.
+
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS graphs (key TEXT PRIMARY KEY, model TEXT NOT NULL, "
+                                "graph TEXT NOT NULL, size INTEGER NOT NULL, last_used INTEGER NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS graphs_last_used ON graphs (last_used)")
+        self.connection.commit()
+        self._clock = self.connection.execute("SELECT COALESCE(MAX(last_used), 0) FROM graphs").fetchone()[0]
+        # total size of the cached graphs, kept up to date by put_many() so
+        # that the table is only summed when it may have to be evicted
+        self._size = self.size()
+
+    @staticmethod
+    def key(model_version, sentence):
+        return _hash_key(model_version, sentence)
+
+    def get_many(self, model_version, sentences):
+        """
+        Look up the graphs of a list of sentences.
+
+        Returns
+        -------
+        list
+            Cached graph for each sentence, None for cache misses.
+
+        """
+        keys = [self.key(model_version, s) for s in sentences]
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            rows = self.connection.execute("SELECT key, graph FROM graphs WHERE key IN ({})".format(
+                ",".join("?" * len(batch))), batch)
+            found.update(rows)
+        if found:
+            self._clock += 1
+            self.connection.executemany("UPDATE graphs SET last_used = ? WHERE key = ?",
+                                        [(self._clock, k) for k in found])
+            self.connection.commit()
+        return [found.get(k) for k in keys]
+
+    def put_many(self, model_version, sentences, graphs):
+        """
+        Store the graphs of a list of sentences. Failed parses (None) are not
+        cached.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._clock += 1
+        rows = {}
+        for s, g in zip(sentences, graphs):
+            if g is not None:
+                key = self.key(model_version, s)
+                rows[key] = (key, model_version, g, len(g.encode("utf-8")), self._clock)
+        # the sizes of the graphs that are replaced
+        replaced = 0
+        keys = list(rows)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            replaced += self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM graphs WHERE key IN ({})".format(
+                ",".join("?" * len(batch))), batch).fetchone()[0]
+        self.connection.executemany("INSERT OR REPLACE INTO graphs VALUES (?, ?, ?, ?, ?)", rows.values())
+        self.connection.commit()
+        self._size += sum(row[3] for row in rows.values()) - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        """
+        Returns
+        -------
+        int
+            Total size of the cached graphs in bytes.
+
+        """
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM graphs").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove least recently used graphs until the cache fits into max_bytes.
+
+        Returns
+        -------
+        int
+            Number of evicted graphs.
+
+        """
+        # other processes may share the database: start from its actual size
+        self._size = self.size()
+        excess = self._size - self.max_bytes
+        if excess <= 0:
+            return 0
+        # count the least recently used graphs that free enough space (the
+        # cursor reads them along the index and stops there), then delete
+        # them at once
+        evicted = 0
+        freed = 0
+        for (size,) in self.connection.execute("SELECT size FROM graphs ORDER BY last_used, key"):
+            if freed >= excess:
+                break
+            freed += size
+            evicted += 1
+        self.connection.execute("DELETE FROM graphs WHERE key IN "
+                                "(SELECT key FROM graphs ORDER BY last_used, key LIMIT ?)", (evicted,))
+        self.connection.commit()
+        self._size -= freed
+        return evicted
+
+    def invalidate(self, keep_model_version=None):
+        """
+        Remove cached graphs, e.g. after the parser model changed.
+
+        Parameters
+        ----------
+        keep_model_version : String, optional
+            Keep the graphs of this model version and remove all others. The
+            default removes all graphs.
+
+        Returns
+        -------
+        int
+            Number of removed graphs.
+
+        """
+        if keep_model_version is None:
+            cursor = self.connection.execute("DELETE FROM graphs")
+        else:
+            cursor = self.connection.execute("DELETE FROM graphs WHERE model != ?", (keep_model_version,))
+        self.connection.commit()
+        self._size = self.size()
+        return cursor.rowcount
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM graphs").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent store of sentence embeddings for one encoder model. Embeddings are
+appended to a float32 matrix on disk and read back through a memory map, so
+sentences that were encoded once (e.g. the English gold sentences) are never
+encoded again and are loaded without copying.
+
+Several processes (e.g. the translation workers of scheduler.py) can share a
+store: appends hold an exclusive lock on <model>.lock and first pick up the
+rows other processes appended.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# a key is a sha1 hex digest and a newline
+KEY_BYTES = 41
+
+
+class EmbeddingStore(object):
+
+    def __init__(self, directory, model_name):
+        """
+        Open (or create) the store of model_name in directory. The store
+        consists of <model>.f32 (the float32 matrix), <model>.keys (one
+        sentence hash per row) and <model>.json (dimension and row count).
+
+        Parameters
+        ----------
+        directory : String
+            Directory of the store files.
+        model_name : String
+            Name of the encoder model the embeddings were created with.
+
+        """
+        self.model_name = model_name
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        prefix = os.path.join(directory, model_name.replace("/", "_"))
+        self.matrix_path = prefix + ".f32"
+        self.keys_path = prefix + ".keys"
+        self.meta_path = prefix + ".json"
+        self.lock_path = prefix + ".lock"
+
+        self.dim = None
+        self.rows = 0
+        self.index = {}
+        self._matrix = None
+        self._load()
+
+    def _load(self):
+        # read the rows appended since the last call. The row count in the
+        # metadata is written last, so rows of an interrupted append beyond it
+        # are ignored
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["rows"] <= self.rows:
+            return
+        with open(self.keys_path, mode="rb") as f:
+            f.seek(self.rows * KEY_BYTES)
+            keys = f.read((meta["rows"] - self.rows) * KEY_BYTES).decode("ascii").split("\n")
+        for row, key in enumerate(keys[:meta["rows"] - self.rows], start=self.rows):
+            self.index[key] = row
+        self.dim, self.rows = meta["dim"], meta["rows"]
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_path, mode="a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def key(sentence):
+        return hashlib.sha1(sentence.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, sentence):
+        return self.key(sentence) in self.index
+
+    @property
+    def matrix(self):
+        """
+        Read-only memory map of all stored embeddings.
+
+        """
+        if self.rows == 0:
+            # numpy cannot map an empty file
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._matrix is None or len(self._matrix) != self.rows:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def add(self, sentences, embeddings):
+        """
+        Append the embeddings of sentences that are not stored yet.
+
+        Returns
+        -------
+        None.
+
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        with self._locked():
+            # another process may have appended rows (and some of these
+            # sentences) since this store was opened
+            self._load()
+            new = []
+            seen = set()
+            for i, sentence in enumerate(sentences):
+                key = self.key(sentence)
+                if key not in self.index and key not in seen:
+                    seen.add(key)
+                    new.append((i, key))
+            if not new:
+                return
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+
+            # truncate leftovers of an interrupted append before writing
+            with open(self.matrix_path, mode="ab") as f:
+                f.truncate(self.rows * self.dim * 4)
+                f.write(embeddings[[i for i, _ in new]].tobytes())
+            with open(self.keys_path, mode="a", encoding="utf-8") as f:
+                f.truncate(self.rows * KEY_BYTES)
+                for _, key in new:
+                    f.write(key + "\n")
+            for row, (_, key) in enumerate(new, start=self.rows):
+                self.index[key] = row
+            self.rows += len(new)
+            temp_path = "%s.%d.tmp" % (self.meta_path, os.getpid())
+            with open(temp_path, mode="w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": self.dim, "rows": self.rows}, f)
+            os.replace(temp_path, self.meta_path)
+
+    def get(self, sentences):
+        """
+        Return the stored embeddings of sentences (which must all be stored).
+        If the sentences occupy consecutive rows, e.g. a gold file that was
+        encoded as a whole, the result is a zero-copy view of the memory map.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape (number of sentences, dim).
+
+        """
+        if not len(sentences):
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        rows = np.fromiter((self.index[self.key(s)] for s in sentences), dtype=np.int64, count=len(sentences))
+        if np.all(np.diff(rows) == 1):
+            return self.matrix[rows[0]:rows[-1] + 1]
+        return self.matrix[rows]
+
+    def encode(self, sentences, encoder):
+        """
+        Return the embeddings of sentences, encoding only the sentences that
+        are not stored yet.
+
+        Parameters
+        ----------
+        sentences : List
+            Sentences to embed.
+        encoder : Callable
+            Function that maps a list of sentences to an embedding matrix.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape (number of sentences, dim).
+
+        """
+        missing = list(dict.fromkeys(s for s in sentences if s not in self))
+        if missing:
+            print("... encoding", len(missing), "of", len(sentences), "sentences")
+            self.add(missing, encoder(missing))
+        return self.get(sentences)
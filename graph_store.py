@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary storage of AMR graphs. All strings (variables, concepts, roles,
+constants, metadata) are interned into one table, and each graph is stored as
+integer arrays:
+
+- its PENMAN tree as (kind, role, value) rows in depth-first order, so the
+  graph converts back to the same PENMAN tree (metadata, variables, roles,
+  branch order and constants);
+- its smatch triples (instances, attributes, relations) as produced by the
+  smatch parser, so graphs can be scored without parsing text again.
+
+A file consists of a header (magic, version, JSON section table), the string
+table and one array per section; loading maps the file and reads the arrays
+in place.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import numpy as np
+import penman
+import amr
+
+MAGIC = b"AMRG"
+VERSION = 1
+STORE_SUFFIX = ".amrb"
+
+# kinds of the tree rows
+OPEN, ATOM, CLOSE = 0, 1, 2
+
+# columns of the graph index
+(FLAGS, TREE_START, TREE_END, META_START, META_END, INSTANCE_START, INSTANCE_END,
+ ATTRIBUTE_START, ATTRIBUTE_END, RELATION_START, RELATION_END) = range(11)
+HAS_GRAPH, HAS_TRIPLES = 1, 2
+
+_SECTIONS = [("index", np.int64, 11), ("tree", np.int32, 3), ("meta", np.int32, 2),
+             ("instances", np.int32, 1), ("attributes", np.int32, 4), ("relations", np.int32, 3)]
+
+
+def entry_line(graph):
+    """
+    Reduce a PENMAN graph to the one-line string smatch parses, exactly as
+    amrlib's get_entries does (comments dropped, lines joined, spaces
+    squeezed).
+
+    """
+    lines = [line.strip() for line in graph.splitlines()]
+    line = ' '.join(line for line in lines if line and not line.startswith('#'))
+    return re.sub(' +', ' ', line.replace('\t', ' '))
+
+
+def read_entries(path):
+    """
+    Read all graphs of an AMR file as one-line strings, as amrlib's
+    get_entries does (without importing amrlib).
+
+    """
+    with open(path) as f:
+        data = f.read()
+    return [line for line in (entry_line(block) for block in data.split('\n\n')) if line]
+
+
+def smatch_triples(line):
+    """
+    Parse a one-line graph with the smatch parser.
+
+    Returns
+    -------
+    tuple
+        Concepts of the nodes (in smatch's node order), attributes as
+        (name, node, value, name is wrapped in a list) and relations as
+        (name, node, node), or None if smatch cannot parse the graph.
+
+    """
+    try:
+        graph = amr.AMR.parse_AMR_line(line)
+        nodes = {name: i for i, name in enumerate(graph.nodes)}
+        attributes = [(name[0], i, value, True) if isinstance(name, list) else (name, i, value, False)
+                      for i in range(len(graph.nodes)) for name, value in graph.attributes[i]]
+        relations = [(name, i, nodes[target])
+                     for i in range(len(graph.nodes)) for name, target in graph.relations[i]]
+        return list(graph.node_values), attributes, relations
+    except Exception:
+        return None
+
+
+def write_graph_store(graphs, path):
+    """
+    Save graphs in the binary format.
+
+    Parameters
+    ----------
+    graphs : Iterable
+        PENMAN strings, None for graphs the parser failed to produce. Graphs
+        that are not valid PENMAN are stored as None (their smatch triples
+        are kept if smatch can parse them).
+    path : String
+        Absolute or relative file path, by convention ending in ".amrb".
+
+    Returns
+    -------
+    int
+        Number of graphs written.
+
+    """
+    strings = {}
+
+    def intern(string):
+        return strings.setdefault(string, len(strings))
+
+    rows = {name: [] for name, _, _ in _SECTIONS}
+
+    def add_tree(node, role):
+        var, branches = node
+        rows["tree"].append((OPEN, role, intern(var)))
+        for branch_role, target in branches:
+            if isinstance(target, tuple):
+                add_tree(target, intern(branch_role))
+            else:
+                rows["tree"].append((ATOM, intern(branch_role), intern(target)))
+        rows["tree"].append((CLOSE, -1, -1))
+
+    for graph in graphs:
+        flags = 0
+        spans = [len(rows["tree"]), len(rows["meta"]), len(rows["instances"]),
+                 len(rows["attributes"]), len(rows["relations"])]
+        if graph is not None:
+            try:
+                tree = penman.parse(graph)
+            except penman.DecodeError:
+                print("Warning: graph", len(rows["index"]), "is not valid PENMAN and is stored as None")
+            else:
+                flags |= HAS_GRAPH
+                rows["meta"].extend((intern(key), intern(value)) for key, value in tree.metadata.items())
+                add_tree(tree.node, -1)
+            triples = smatch_triples(entry_line(graph))
+            if triples is not None:
+                flags |= HAS_TRIPLES
+                concepts, attributes, relations = triples
+                rows["instances"].extend((intern(concept),) for concept in concepts)
+                rows["attributes"].extend((intern(name), i, intern(value), wrapped)
+                                          for name, i, value, wrapped in attributes)
+                rows["relations"].extend((intern(name), i, j) for name, i, j in relations)
+        ends = [len(rows["tree"]), len(rows["meta"]), len(rows["instances"]),
+                len(rows["attributes"]), len(rows["relations"])]
+        rows["index"].append([flags] + [x for span in zip(spans, ends) for x in span])
+
+    string_table = "\0".join(strings).encode('utf-8')
+    arrays = [(name, np.array(rows[name], dtype=dtype).reshape(-1, cols)) for name, dtype, cols in _SECTIONS]
+
+    # section offsets are relative to the end of the header, aligned to 8 bytes
+    sections = {"strings": [0, len(string_table)]}
+    offset = len(string_table)
+    for name, array in arrays:
+        offset += -offset % 8
+        sections[name] = [offset, len(array)]
+        offset += array.nbytes
+    header = json.dumps({"graphs": len(rows["index"]), "strings": len(strings), "sections": sections}).encode('utf-8')
+    header += b" " * (-(len(header) + 12) % 8)
+
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp_path, mode='wb') as f:
+            f.write(MAGIC + struct.pack("<II", VERSION, len(header)) + header)
+            f.write(string_table)
+            position = len(string_table)
+            for name, array in arrays:
+                f.write(b"\0" * (sections[name][0] - position))
+                f.write(array.tobytes())
+                position = sections[name][0] + array.nbytes
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(rows["index"])
+
+
+def convert(amr_path, store_path):
+    """
+    Convert an AMR text file (gold or parsed) to the binary format.
+
+    """
+    from amr_corpus import AMRCorpus
+    with AMRCorpus(amr_path) as corpus:
+        return write_graph_store(corpus, store_path)
+
+
+class GraphStore(object):
+
+    def __init__(self, path):
+        """
+        Open a file written by write_graph_store().
+
+        Parameters
+        ----------
+        path : String
+            Absolute or relative file path to the binary graphs.
+
+        """
+        self.path = path
+        with open(path, mode='rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self._map[:4]
+        version, header_length = struct.unpack("<II", self._map[4:12])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a graph store of version " + str(VERSION))
+        header = json.loads(self._map[12:12 + header_length].decode('utf-8'))
+        base = 12 + header_length
+
+        start, length = header["sections"]["strings"]
+        self.strings = self._map[base + start:base + start + length].decode('utf-8').split("\0")
+        for name, dtype, cols in _SECTIONS:
+            start, rows = header["sections"][name]
+            array = np.frombuffer(self._map, dtype=dtype, count=rows * cols, offset=base + start)
+            setattr(self, "_" + name, array.reshape(rows, cols))
+
+    def __len__(self):
+        return len(self._index)
+
+    def tree(self, graph_number):
+        """
+        Returns
+        -------
+        penman.Tree
+            The graph as a PENMAN tree, or None if no graph was stored.
+
+        """
+        row = self._index[graph_number]
+        if not row[FLAGS] & HAS_GRAPH:
+            return None
+        strings = self.strings
+        stack = []
+        root = None
+        for kind, role, value in self._tree[row[TREE_START]:row[TREE_END]].tolist():
+            if kind == OPEN:
+                node = (strings[value], [])
+                if stack:
+                    stack[-1][1].append((strings[role], node))
+                else:
+                    root = node
+                stack.append(node)
+            elif kind == ATOM:
+                stack[-1][1].append((strings[role], strings[value]))
+            else:
+                stack.pop()
+        metadata = {strings[key]: strings[value] for key, value in self._meta[row[META_START]:row[META_END]].tolist()}
+        return penman.Tree(root, metadata=metadata)
+
+    def penman(self, graph_number):
+        """
+        Returns
+        -------
+        String
+            The graph in PENMAN notation, or None if no graph was stored.
+
+        """
+        tree = self.tree(graph_number)
+        return None if tree is None else penman.format(tree)
+
+    def __getitem__(self, graph_number):
+        return self.penman(graph_number)
+
+    def __iter__(self):
+        for graph_number in range(len(self)):
+            yield self.penman(graph_number)
+
+    def smatch_triples(self, graph_number, prefix):
+        """
+        Smatch triples of a graph with nodes renamed to prefix0, prefix1, ...
+        (as amr.AMR.rename_node() and get_triples() return them).
+
+        Returns
+        -------
+        tuple
+            (instance, attribute, relation) triples, or None if smatch could
+            not parse the graph.
+
+        """
+        row = self._index[graph_number]
+        if not row[FLAGS] & HAS_TRIPLES:
+            return None
+        strings = self.strings
+        instances = [("instance", prefix + str(i), strings[concept])
+                     for i, (concept,) in enumerate(self._instances[row[INSTANCE_START]:row[INSTANCE_END]].tolist())]
+        attributes = [([strings[name]] if wrapped else strings[name], prefix + str(i), strings[value])
+                      for name, i, value, wrapped in self._attributes[row[ATTRIBUTE_START]:row[ATTRIBUTE_END]].tolist()]
+        relations = [(strings[name], prefix + str(i), prefix + str(j))
+                     for name, i, j in self._relations[row[RELATION_START]:row[RELATION_END]].tolist()]
+        return instances, attributes, relations
+
+    def close(self):
+        # drop the array views before closing the map they point into
+        for name, _, _ in _SECTIONS:
+            setattr(self, "_" + name, None)
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
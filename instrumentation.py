@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide tracing of where the pipeline spends its time. Code is wrapped
+in named spans (model load, tokenization, generation, serialization, file
+I/O, scoring) that record their duration, process, thread and attributes such
+as the number of sentences; attributes set with context() (e.g. language and
+category) are added to all spans inside. Spans are written as JSON lines or
+in the Chrome trace format (chrome://tracing, https://ui.perfetto.dev).
+
+An optional sampling profiler records the Python stacks of all threads at a
+fixed interval, labelled with the span each thread is in, and writes them in
+the collapsed format of flamegraph.pl / speedscope.
+"""
+
+from collections import Counter
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+# "stage" spans enclose a whole unit of work of a pipeline stage
+CATEGORIES = ["stage", "model", "tokenization", "generation", "serialization", "io", "scoring"]
+
+
+class Tracer(object):
+
+    def __init__(self, max_spans=1000000):
+        """
+        Parameters
+        ----------
+        max_spans : int, optional
+            Number of spans kept in memory; further spans are counted but not
+            recorded. The default is 1000000.
+
+        """
+        self.max_spans = max_spans
+        self.enabled = True
+        self.dropped = 0
+        self._spans = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # names of the open spans of each thread, for the profiler
+        self._open = {}
+        self.profiler = None
+
+    def _state(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+            self._local.context = {}
+            self._open[threading.get_ident()] = self._local.stack
+        return self._local
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """
+        Record the time spent in the with-block as a span. The yielded dict
+        holds the span's attributes; attributes known only at the end (e.g.
+        the number of sentences) can be added to it inside the block.
+
+        Parameters
+        ----------
+        name : String
+            Name of the span, e.g. "parse".
+        category : String
+            One of CATEGORIES.
+        **args
+            Attributes of the span.
+
+        """
+        if not self.enabled:
+            yield args
+            return
+        state = self._state()
+        args = dict(state.context, **args)
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        parent = state.stack[-1][0] if state.stack else None
+        state.stack.append((span_id, name))
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            duration = time.perf_counter() - start
+            state.stack.pop()
+            record = {"id": span_id, "parent": parent, "name": name, "cat": category, "start": start,
+                      "duration": duration, "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+            with self._lock:
+                if len(self._spans) < self.max_spans:
+                    self._spans.append(record)
+                else:
+                    self.dropped += 1
+
+    @contextlib.contextmanager
+    def context(self, **attributes):
+        """
+        Add attributes (e.g. language="es", category="bolt") to all spans
+        started in this thread inside the with-block.
+
+        """
+        state = self._state()
+        previous = state.context
+        state.context = dict(previous, **attributes)
+        try:
+            yield
+        finally:
+            state.context = previous
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def drain(self):
+        """
+        Remove and return the recorded spans, e.g. to send them from a worker
+        process to the main process.
+
+        """
+        with self._lock:
+            spans, self._spans = self._spans, []
+            return spans
+
+    def extend(self, spans):
+        """
+        Add spans recorded in another process (see drain()).
+
+        """
+        with self._lock:
+            self._spans.extend(spans[:max(0, self.max_spans - len(self._spans))])
+            self.dropped += max(0, len(spans) - self.max_spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans = []
+            self.dropped = 0
+
+    def write_jsonl(self, path):
+        """
+        Write the spans to path, one JSON object per line.
+
+        """
+        with open(path, mode="w", encoding="utf-8") as f:
+            for record in self.spans():
+                f.write(json.dumps(record))
+                f.write("\n")
+        print("Trace saved to", path)
+
+    def write_chrome_trace(self, path):
+        """
+        Write the spans to path in the Chrome trace event format.
+
+        """
+        spans = self.spans()
+        origin = min((record["start"] for record in spans), default=0.0)
+        events = [{"name": record["name"], "cat": record["cat"], "ph": "X",
+                   "ts": (record["start"] - origin) * 1e6, "dur": record["duration"] * 1e6,
+                   "pid": record["pid"], "tid": record["tid"], "args": record["args"]} for record in spans]
+        with open(path, mode="w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print("Trace saved to", path)
+
+    def write(self, path, trace_format="jsonl"):
+        """
+        Write the spans to path as "jsonl" or "chrome" trace.
+
+        """
+        if trace_format == "chrome":
+            self.write_chrome_trace(path)
+        else:
+            self.write_jsonl(path)
+
+    def summary(self, keys=("language", "category")):
+        """
+        Print the time spent per span category and name, and per group of
+        the attributes keys (e.g. per language and category). Nested spans
+        are counted in their own and in their enclosing span.
+
+        Returns
+        -------
+        dict
+            {(key values..., category, name): [spans, seconds, sentences]}.
+
+        """
+        totals = {}
+        for record in self.spans():
+            group = tuple(record["args"].get(key) for key in keys) + (record["cat"], record["name"])
+            total = totals.setdefault(group, [0, 0.0, 0])
+            total[0] += 1
+            total[1] += record["duration"]
+            total[2] += record["args"].get("sentences", 0) or 0
+
+        print("\nTime per stage:")
+        print("  " + "".join("{:<12}".format(key) for key in keys) +
+              "{:<15} {:<22} {:>7} {:>10} {:>10}".format("type", "span", "count", "seconds", "sentences"))
+        for group in sorted(totals, key=lambda group: tuple(str(value) for value in group)):
+            count, seconds, sentences = totals[group]
+            print("  " + "".join("{:<12}".format(str(value) if value is not None else "-")
+                                 for value in group[:len(keys)]) +
+                  "{:<15} {:<22} {:>7d} {:>10.2f} {:>10d}".format(group[-2], group[-1], count, seconds, sentences))
+        if self.dropped:
+            print("  ({} spans not recorded)".format(self.dropped))
+        return totals
+
+    def start_profiler(self, interval=0.01):
+        """
+        Start sampling the stacks of all threads every interval seconds.
+
+        Returns
+        -------
+        SamplingProfiler
+
+        """
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(self, interval)
+            self.profiler.start()
+        return self.profiler
+
+    def stop_profiler(self, path=None):
+        """
+        Stop the profiler and write its samples to path (if given).
+
+        """
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.stop()
+            if path is not None:
+                profiler.write_collapsed(path)
+        return profiler
+
+
+class SamplingProfiler(object):
+
+    def __init__(self, tracer, interval=0.01, max_depth=64):
+        """
+        Sample the Python stacks of all threads of this process in a
+        background thread.
+
+        Parameters
+        ----------
+        tracer : Tracer
+            Tracer whose open spans label the samples.
+        interval : float, optional
+            Seconds between samples. The default is 0.01.
+        max_depth : int, optional
+            Innermost frames kept per stack. The default is 64.
+
+        """
+        self.tracer = tracer
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < self.max_depth:
+                    code = frame.f_code
+                    frames.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                spans = [name for _, name in list(self.tracer._open.get(thread_id, ()))]
+                self.samples[";".join(["[" + name + "]" for name in spans] + frames[::-1])] += 1
+
+    def write_collapsed(self, path):
+        """
+        Write the samples to path in the collapsed stack format
+        ("span;frame;frame count" per line).
+
+        """
+        with open(path, mode="w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+        print("Profile saved to", path, "({} samples)".format(sum(self.samples.values())))
+
+
+tracer = Tracer()
+
+
+def span(name, category, **args):
+    """
+    Shortcut for tracer.span() on the process-wide tracer.
+
+    """
+    return tracer.span(name, category, **args)
+
+
+def context(**attributes):
+    """
+    Shortcut for tracer.context() on the process-wide tracer.
+
+    """
+    return tracer.context(**attributes)
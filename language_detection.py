@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Per-sentence language identification for mixed-language inputs, with the
+model of langid.py. langid classifies one string at a time; here the byte
+n-gram features of a whole batch of sentences are counted into one matrix and
+scored with a single matrix product, which gives the same languages as
+langid's classify() restricted to the same languages. The confidences are
+probabilities, as classify() returns them with norm_probs=True (by default
+langid returns the unnormalized log score).
+
+Sentences are then grouped by language so that each group can be translated
+with the opus-mt model of its language pair in full batches (see
+nmt_english.Translator.translate_mixed()).
+"""
+
+import numpy as np
+
+# languages of the LDC2020T07 dataset, and English (not translated)
+LANGUAGES = ["de", "es", "it", "zh", "en"]
+# EasyNMT's default number of sentences per batch
+DEFAULT_BATCH_SIZE = 16
+
+
+class LanguageDetector(object):
+
+    def __init__(self, languages=LANGUAGES, batch_size=256):
+        """
+        Load langid's model, restricted to languages.
+
+        Parameters
+        ----------
+        languages : list, optional
+            Iso-Codes of the languages to tell apart. The default is
+            LANGUAGES.
+        batch_size : int, optional
+            Number of sentences whose features are held in memory at once
+            (each row has one count per feature). The default is 256.
+
+        """
+        from langid.langid import LanguageIdentifier, model
+        identifier = LanguageIdentifier.from_modelstring(model, norm_probs=False)
+        identifier.set_languages(languages)
+        self.languages = list(identifier.nb_classes)
+        self.batch_size = batch_size
+        self.n_features = identifier.nb_numfeats
+        self.log_p_feature = np.ascontiguousarray(identifier.nb_ptc, dtype=np.float64)
+        self.log_p_language = np.asarray(identifier.nb_pc, dtype=np.float64)
+        self.next_state = list(identifier.tk_nextmove)
+        # features produced on entering each state of the tokenizer's
+        # automaton, in compressed sparse row form
+        self.n_states = len(self.next_state) >> 8
+        lengths = np.zeros(self.n_states, dtype=np.int64)
+        for state, features in identifier.tk_output.items():
+            lengths[state] = len(features)
+        self.output_offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.output_features = np.zeros(self.output_offsets[-1], dtype=np.int64)
+        for state, features in identifier.tk_output.items():
+            self.output_features[self.output_offsets[state]:self.output_offsets[state + 1]] = features
+
+    def features(self, sentences):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            len(sentences) x n_features matrix of feature counts (the rows of
+            langid's instance2fv()).
+
+        """
+        rows, states = [], []
+        next_state = self.next_state
+        for i, sentence in enumerate(sentences):
+            state = 0
+            visited = []
+            for byte in sentence.encode("utf-8"):
+                state = next_state[(state << 8) + byte]
+                visited.append(state)
+            states.extend(visited)
+            rows.extend([i] * len(visited))
+
+        # how often each sentence entered each state, expanded to the features
+        # of the state
+        visits, counts = np.unique(np.array(rows, dtype=np.int64) * self.n_states +
+                                   np.array(states, dtype=np.int64), return_counts=True)
+        rows, states = visits // self.n_states, visits % self.n_states
+        lengths = self.output_offsets[states + 1] - self.output_offsets[states]
+        starts = np.repeat(self.output_offsets[states] - np.cumsum(lengths) + lengths, lengths)
+        features = self.output_features[starts + np.arange(lengths.sum())]
+        flat = np.repeat(rows, lengths) * self.n_features + features
+        counts = np.bincount(flat, weights=np.repeat(counts, lengths), minlength=len(sentences) * self.n_features)
+        return counts.reshape(len(sentences), self.n_features)
+
+    def detect(self, sentences):
+        """
+        Identify the language of each sentence.
+
+        Returns
+        -------
+        languages : list
+            Iso-Code of each sentence's language.
+        confidences : numpy.ndarray
+            Probability of each sentence's language.
+
+        """
+        languages = []
+        confidences = np.zeros(len(sentences))
+        for start in range(0, len(sentences), self.batch_size):
+            scores = self.features(sentences[start:start + self.batch_size]) @ self.log_p_feature + self.log_p_language
+            best = np.argmax(scores, axis=1)
+            with np.errstate(over="ignore"):
+                confidences[start:start + len(best)] = 1 / np.exp(scores - scores[np.arange(len(best)), best][:, None]).sum(1)
+            languages.extend(self.languages[k] for k in best)
+        return languages, confidences
+
+
+def group_by_language(languages):
+    """
+    Returns
+    -------
+    dict
+        Positions of the sentences of each language, in input order.
+
+    """
+    groups = {}
+    for i, language in enumerate(languages):
+        groups.setdefault(language, []).append(i)
+    return groups
+
+
+def batch_fill(languages, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Compare the batches of translating the sentences grouped by language with
+    translating the runs of consecutive sentences of the same language in
+    input order.
+
+    Returns
+    -------
+    dict
+        For each language the sentences, the batches and their fill (the
+        fraction of the batches' capacity used) when grouped, and the batches
+        and fill in input order.
+
+    """
+    runs = {}
+    previous, length = None, 0
+    for language in list(languages) + [None]:
+        if language != previous and previous is not None:
+            runs.setdefault(previous, []).append(length)
+            length = 0
+        previous = language
+        length += 1
+
+    fill = {}
+    for language, lengths in runs.items():
+        sentences = sum(lengths)
+        batches = -(-sentences // batch_size)
+        in_order_batches = sum(-(-length // batch_size) for length in lengths)
+        fill[language] = {"sentences": sentences,
+                          "batches": batches,
+                          "fill": sentences / (batches * batch_size),
+                          "in_order_batches": in_order_batches,
+                          "in_order_fill": sentences / (in_order_batches * batch_size)}
+    return fill
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous micro-batching of single-sentence and single-graph requests.
+Requests are queued and handed to the model as one batch as soon as either
+max_batch_size requests are waiting or the oldest request has waited
+max_wait seconds; each caller's future resolves to its own result. The model
+runs in one background thread, so the event loop is never blocked; while it
+is busy, new requests collect into the next batch.
+"""
+
+from amr_parser import load_stog, load_gtos, parse_sents, stog_model_version
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import collections
+import time
+import numpy as np
+
+
+class MicroBatcher(object):
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.01, window=10000):
+        """
+        Parameters
+        ----------
+        process_batch : Callable
+            Function mapping a list of inputs to the list of their results.
+        max_batch_size : int, optional
+            Largest batch handed to process_batch. The default is 16.
+        max_wait : float, optional
+            Seconds the oldest request may wait for more requests before its
+            batch is flushed. The default is 0.01.
+        window : int, optional
+            Number of most recent requests the latency metrics are computed
+            over. The default is 10000.
+
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._deadline = None
+        self._running = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._latencies = collections.deque(maxlen=window)
+        self._batch_sizes = collections.deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+
+    async def submit(self, item):
+        """
+        Queue one input and wait for its result.
+
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._deadline is None:
+            self._deadline = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+        # while the model is busy, requests keep collecting into the next batch
+        if self._running or not self._pending:
+            return
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        self._running = True
+        asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self.process_batch, [item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            now = time.perf_counter()
+            self.batches += 1
+            self._batch_sizes.append(len(batch))
+            results = list(results)
+            for (_, future, submitted), result in zip(batch, results):
+                self._latencies.append(now - submitted)
+                if not future.done():
+                    future.set_result(result)
+            # requests without a result would otherwise wait forever
+            if len(results) != len(batch):
+                error = RuntimeError("process_batch returned {} results for {} requests".format(
+                    len(results), len(batch)))
+                for _, future, _ in batch[len(results):]:
+                    if not future.done():
+                        future.set_exception(error)
+        finally:
+            self._running = False
+        if self._pending:
+            waited = time.perf_counter() - self._pending[0][2]
+            if len(self._pending) >= self.max_batch_size or waited >= self.max_wait:
+                self._flush()
+            elif self._deadline is None:
+                self._deadline = loop.call_later(self.max_wait - waited, self._flush)
+
+    def metrics(self):
+        """
+        Returns
+        -------
+        dict
+            Configuration, number of requests and batches, mean batch size and
+            the p50/p99 latency in milliseconds over the recent window.
+
+        """
+        latencies = np.array(self._latencies) * 1000
+        return {"max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class AMRBatchService(object):
+
+    def __init__(self, path_to_stog=None, path_to_gtos=None, device=None, parse_cache=None,
+                 max_batch_size=16, max_wait=0.01):
+        """
+        Async sentence to graph and graph to sentence API for services that
+        receive one sentence or graph per request. The models are loaded on
+        first use.
+
+        Parameters
+        ----------
+        path_to_stog : String, optional
+            Path to the sentence to graph model dir.
+        path_to_gtos : String, optional
+            Path to the graph to sentence model dir.
+        device : String, optional
+            Device to load the models to.
+        parse_cache : caches.ParseCache, optional
+            Cache of previously parsed graphs.
+        max_batch_size : int, optional
+            Largest micro-batch per model. The default is 16.
+        max_wait : float, optional
+            Seconds a request may wait for its batch to fill. The default is
+            0.01.
+
+        """
+        self.path_to_stog = path_to_stog
+        self.path_to_gtos = path_to_gtos
+        self.device = device
+        self.parse_cache = parse_cache
+        self._model_version = None
+        self.stog_batcher = MicroBatcher(self._parse_batch, max_batch_size, max_wait)
+        self.gtos_batcher = MicroBatcher(self._generate_batch, max_batch_size, max_wait)
+
+    def _parse_batch(self, sentences):
+        stog = load_stog(self.path_to_stog, self.device)
+        if self.parse_cache is not None and self._model_version is None:
+            self._model_version = stog_model_version(self.path_to_stog)
+        return parse_sents(stog, sentences, self.parse_cache, self._model_version)
+
+    def _generate_batch(self, graphs):
+        sentences, _ = load_gtos(self.path_to_gtos, self.device).generate(graphs)
+        return sentences
+
+    async def sent_to_graph(self, sentence):
+        """
+        Returns
+        -------
+        String
+            AMR graph of one english sentence (None if parsing failed).
+
+        """
+        return await self.stog_batcher.submit(sentence)
+
+    async def graph_to_sent(self, graph):
+        """
+        Returns
+        -------
+        String
+            English sentence generated from one AMR graph.
+
+        """
+        return await self.gtos_batcher.submit(graph)
+
+    def metrics(self):
+        return {"stog": self.stog_batcher.metrics(), "gtos": self.gtos_batcher.metrics()}
+
+    def close(self):
+        self.stog_batcher.close()
+        self.gtos_batcher.close()
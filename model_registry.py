@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry for the pretrained models used in the pipeline (EasyNMT,
+amrlib StoG/GtoS and Sentence-BERT). Models are loaded lazily on first use,
+shared between all callers and kept in a least-recently-used cache so that
+only a bounded number of them stays resident.
+"""
+
+from collections import OrderedDict, Counter
+from instrumentation import span
+import threading
+
+
+class ModelRegistry(object):
+
+    def __init__(self, max_models=4):
+        self.max_models = max_models
+        self.load_counts = Counter()
+        self._models = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, kind, loader, name=None, model_dir=None, device=None):
+        """
+        Return the model registered under (kind, name, model_dir, device) and
+        load it with loader() if it is not resident yet.
+
+        Parameters
+        ----------
+        kind : String
+            Kind of model, e.g. "easynmt", "stog", "gtos" or "sbert".
+        loader : Callable
+            Function without arguments that loads and returns the model.
+        name : String, optional
+            Name of the model.
+        model_dir : String, optional
+            Directory the model is loaded from.
+        device : String, optional
+            Device the model is loaded to.
+
+        Returns
+        -------
+        model
+            The loaded model object.
+
+        """
+        key = (kind, name, model_dir, device)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            with span("load_model", "model", kind=kind, model=name, model_dir=model_dir, device=device):
+                model = loader()
+            self.load_counts[key] += 1
+            self._models[key] = model
+            while len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                print("Model evicted from registry:", self._format_key(evicted))
+            return model
+
+    def evict(self, kind=None):
+        """
+        Remove all resident models (of the given kind) from the registry.
+
+        Parameters
+        ----------
+        kind : String, optional
+            Only evict models of this kind. The default evicts all models.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._lock:
+            for key in list(self._models):
+                if kind is None or key[0] == kind:
+                    del self._models[key]
+
+    def resident(self):
+        """
+        Returns
+        -------
+        list
+            Keys of the resident models, least recently used first.
+
+        """
+        with self._lock:
+            return list(self._models)
+
+    def report(self):
+        """
+        Print how many times each model was loaded in this process.
+
+        Returns
+        -------
+        dict
+            Mapping of model keys to their load counts.
+
+        """
+        print("Model loads:")
+        for key, count in self.load_counts.items():
+            print("  " + self._format_key(key) + ":", count)
+        return dict(self.load_counts)
+
+    @staticmethod
+    def _format_key(key):
+        kind, name, model_dir, device = key
+        return "{} (name={}, dir={}, device={})".format(kind, name, model_dir, device)
+
+
+registry = ModelRegistry()
+
+
+def get_model(kind, loader, name=None, model_dir=None, device=None):
+    """
+    Shortcut for registry.get() on the process-wide registry.
+
+    """
+    return registry.get(kind, loader, name=name, model_dir=model_dir, device=device)
@@ -5,22 +5,181 @@ a list of sentences, save the translated sentences and compare them to a list
 of gold standard English sentences with BLEU and the cosine similarity of 
 Sentence-BERT Embeddings.
 
+EasyNMT, Sentence-BERT and torch are imported only when a model is first
+loaded, so that importing this module (e.g. for BLEU) stays fast.
+
 @author: s-uhr
 """
 
-from easynmt import EasyNMT
-from nltk.translate.bleu_score import sentence_bleu
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from scipy.spatial import distance
+from model_registry import get_model
+from instrumentation import span, context
+from embedding_store import EmbeddingStore
+import bleu as bleu_scoring
+import multiprocessing
+import multiprocessing.connection
 import os
+import time
+
+
+def load_easynmt(model_name='opus-mt', device='cpu', quantize=False):
+    """
+    Import EasyNMT and load a translation model (with int8 linear layers if
+    quantize, see quantization.py).
+
+    """
+    from easynmt import EasyNMT
+    model = EasyNMT(model_name, device=device)
+    if quantize:
+        from quantization import quantize_easynmt
+        model = quantize_easynmt(model)
+    return model
+
+
+def load_sbert(sbert_name='bert-base-nli-mean-tokens'):
+    """
+    Import sentence_transformers and load a Sentence-BERT model.
+
+    """
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(sbert_name)
+
+
+def load_language_detector(languages=None):
+    """
+    Load the per-sentence language detector (once per process).
+
+    """
+    from language_detection import LanguageDetector, LANGUAGES
+    languages = languages or LANGUAGES
+    return get_model("langid", lambda: LanguageDetector(languages), name=",".join(languages))
+
+
+def iter_sentence_chunks(path, chunk_size=32):
+    """
+    Read a file with one sentence per line lazily in chunks of chunk_size
+    sentences, so that only one chunk is held in memory at a time.
+
+    Parameters
+    ----------
+    path : String
+        Absolute or relative path to the file.
+    chunk_size : int, optional
+        Number of sentences per chunk. The default is 32.
+
+    Yields
+    ------
+    list
+        List of at most chunk_size sentences (without line breaks).
+
+    """
+    chunk = []
+    with open(path, mode="r", encoding="utf-8") as fr:
+        for line in fr:
+            chunk.append(line.rstrip("\n"))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def normalize_rows(embeddings):
+    """
+    Scale each row of an embedding matrix to unit length (rows of zeros stay
+    zero).
+
+    Returns
+    -------
+    numpy.ndarray
+        Contiguous float32 matrix of row-normalized embeddings.
+
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+
+
+def token_budget_batches(token_counts, max_tokens=4096, max_batch_size=None):
+    """
+    Group sentences into batches of similar length whose padded size
+    (number of sentences * longest sentence) stays within max_tokens.
+
+    Parameters
+    ----------
+    token_counts : list
+        Number of source tokens of each sentence.
+    max_tokens : int, optional
+        Maximum number of (padded) tokens per batch. The default is 4096.
+    max_batch_size : int, optional
+        Maximum number of sentences per batch. The default is unlimited.
+
+    Returns
+    -------
+    batches : list
+        List of batches, each a list of sentence indices.
+    efficiencies : list
+        Padding efficiency of each batch (real tokens / padded tokens).
+
+    """
+    order = sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True)
+    batches = []
+    efficiencies = []
+    batch = []
+    for i in order:
+        # sentences arrive longest first, so the first one sets the padded length
+        longest = max(token_counts[batch[0]], 1) if batch else max(token_counts[i], 1)
+        full = (len(batch) + 1) * longest > max_tokens
+        if batch and (full or len(batch) == max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    for batch in batches:
+        padded = len(batch) * max(token_counts[batch[0]], 1)
+        efficiencies.append(sum(token_counts[i] for i in batch) / padded)
+    return batches, efficiencies
+
 
 class Translator(object):
 
-    def __init__(self, model_name='opus-mt', device='cpu'):
+    def __init__(self, model_name='opus-mt', device='cpu', cache=None, max_tokens=None, max_batch_size=None,
+                 n_workers=1, shard_pool=None, embedding_dir=None, encode_batch_size=32, encode_threads=None,
+                 quantize=False, supervisor=None, evaluation_path="translation_evaluation.txt"):
         self.model_name = model_name
         self.device = device
-        self.model = EasyNMT(self.model_name, device=self.device)
+        # int8 inference on CPU; its translations are cached apart from fp32's
+        self.quantize = quantize
+        registry_name = model_name + ":int8" if quantize else model_name
+        # optional supervision.Supervisor: length and time budgets per sentence
+        # (in this process, not in the workers of a ShardPool); its
+        # translations are cached apart from unsupervised ones
+        self.supervisor = supervisor
+        self.cache_name = registry_name + (":" + supervisor.version() if supervisor is not None else "")
+        self.cache = cache  # optional caches.TranslationCache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # token budget per batch (None: EasyNMT's default batching)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.batch_efficiencies = []
+        # worker processes for sharded translation on CPU; a ShardPool can be
+        # passed in to share its workers between Translators
+        self.n_workers = n_workers
+        self.shard_pool = shard_pool
+        self._owns_shard_pool = False
+        # directory of the persistent sentence embedding store (None: no store)
+        self.embedding_dir = embedding_dir
+        self.encode_batch_size = encode_batch_size
+        self.encode_threads = encode_threads  # torch threads while encoding (None: torch default)
+        # the evaluation reports are appended to evaluation_path and collected
+        # in evaluation_report (None: only collected, e.g. for a worker
+        # process whose parent writes them)
+        self.evaluation_path = evaluation_path
+        self.evaluation_report = []
+        self.model = get_model("easynmt", lambda: load_easynmt(model_name, device, quantize),
+                               name=registry_name, device=device)
         # self.sentences_to_translate
         # self.gold_sentences
         # self.translation
@@ -47,14 +206,18 @@ class Translator(object):
 
         """
         self.to_translate_path = to_translate_path
-        with open(self.to_translate_path, mode="r", encoding="utf-8") as fr:
-            self.sentences_to_translate = fr.read().split("\n")
+        with span("read_sentences", "io", file=to_translate_path) as args:
+            with open(self.to_translate_path, mode="r", encoding="utf-8") as fr:
+                self.sentences_to_translate = fr.read().split("\n")
+            args["sentences"] = len(self.sentences_to_translate)
         
         print("Sentences to translate loaded from", self.to_translate_path)
         
         if gold_path != "None":
-            with open(gold_path, mode="r", encoding='utf-8') as fr:
-                self.gold_sentences = fr.read().split("\n")
+            with span("read_sentences", "io", file=gold_path) as args:
+                with open(gold_path, mode="r", encoding='utf-8') as fr:
+                    self.gold_sentences = fr.read().split("\n")
+                args["sentences"] = len(self.gold_sentences)
                 
             print("Gold sentences loaded from", gold_path)
         
@@ -72,6 +235,9 @@ class Translator(object):
 
         Parameters
         ----------
+        source_language : String
+            Iso-Code of the language to translate from, or None to detect
+            the language of each sentence (see translate_mixed()).
         target_language : String, optional
             Iso-Code of the language to translate to. The default is 'en'.
 
@@ -82,14 +248,241 @@ class Translator(object):
 
         """
         print("... translating to target language:", target_language)
-        self.translation = self.model.translate(self.sentences_to_translate,
-                                                target_lang=target_language,
-                                                source_lang=source_language)
+        with span("translate", "generation", file=getattr(self, "to_translate_path", None),
+                  source_language=source_language, sentences=len(self.sentences_to_translate)):
+            if source_language is None:
+                self.translation = self.translate_mixed(self.sentences_to_translate, target_language)
+            else:
+                self.translation = self.translate_sentences(self.sentences_to_translate,
+                                                            source_language, target_language)
+        
+        if self.cache is not None:
+            print("Translation cache:", self.cache_hits, "hits,", self.cache_misses, "misses")
         
         #print(self.translation)
         return self.translation
     
     
+    def translate_sentences(self, sentences, source_language, target_language='en'):
+        """
+        Translate a list of sentences. If the Translator has a cache, only the
+        sentences not found in the cache are sent to the model; the cache hit
+        and miss counts of this call are stored in cache_hits and cache_misses.
+
+        Parameters
+        ----------
+        sentences : list
+            List of sentences to translate.
+        source_language : String
+            Iso-Code of the language to translate from.
+        target_language : String, optional
+            Iso-Code of the language to translate to. The default is 'en'.
+
+        Returns
+        -------
+        list
+            List of translated sentences in the order of the input.
+
+        """
+        if self.cache is None:
+            return self._translate_uncached(sentences, source_language, target_language)
+        
+        translation = self.cache.get_many(self.cache_name, source_language, target_language, sentences)
+        misses = [i for i, t in enumerate(translation) if t is None]
+        self.cache_hits = len(sentences) - len(misses)
+        self.cache_misses = len(misses)
+        
+        if misses:
+            # translate each distinct missing sentence only once
+            unique = list(dict.fromkeys(sentences[i] for i in misses))
+            translated = dict(zip(unique, self._translate_uncached(unique, source_language, target_language)))
+            # fallbacks and translations stopped at a time budget are not cached
+            degraded = self.supervisor.degraded if self.supervisor is not None and self.shard_pool is None else ()
+            cached = [s for i, s in enumerate(unique) if i not in degraded]
+            self.cache.put_many(self.cache_name, source_language, target_language,
+                                cached, [translated[s] for s in cached])
+            for i in misses:
+                translation[i] = translated[sentences[i]]
+        
+        return translation
+    
+    
+    def translate_mixed(self, sentences, target_language='en', languages=None):
+        """
+        Translate sentences of several languages: detect the language of
+        each sentence, translate the sentences of each language together
+        with the model of its language pair (so that they fill whole
+        batches) and restore the input order. Sentences detected as the
+        target language are kept as they are. The detected languages and the
+        batch fill per language are stored in detected_languages and
+        language_batches, the cache hits and misses of all languages in
+        cache_hits and cache_misses.
+
+        Parameters
+        ----------
+        sentences : list
+            List of sentences to translate.
+        target_language : String, optional
+            Iso-Code of the language to translate to. The default is 'en'.
+        languages : list, optional
+            Iso-Codes of the languages to detect. The default is
+            language_detection.LANGUAGES.
+
+        Returns
+        -------
+        list
+            List of translated sentences in the order of the input.
+
+        """
+        from language_detection import group_by_language, batch_fill
+        detector = load_language_detector(languages)
+        start = time.perf_counter()
+        with span("detect_language", "tokenization", sentences=len(sentences)):
+            self.detected_languages, _ = detector.detect(sentences)
+        elapsed = time.perf_counter() - start
+        self.language_batches = batch_fill(self.detected_languages)
+
+        translation = [None] * len(sentences)
+        # translate_sentences() counts the hits and misses of one language
+        cache_hits = cache_misses = 0
+        for language, positions in group_by_language(self.detected_languages).items():
+            group = [sentences[i] for i in positions]
+            if language != target_language:
+                with context(language=language):
+                    group = self.translate_sentences(group, language, target_language)
+                cache_hits += self.cache_hits
+                cache_misses += self.cache_misses
+            for i, sentence in zip(positions, group):
+                translation[i] = sentence
+        self.cache_hits, self.cache_misses = cache_hits, cache_misses
+
+        print("Language detection: {} sentences, {:.0f} sentences/s".format(
+            len(sentences), len(sentences) / elapsed if elapsed else float("inf")))
+        for language, fill in sorted(self.language_batches.items()):
+            print("  {}: {} sentences, {} batches ({:.0%} full), in input order {} batches ({:.0%} full)".format(
+                language, fill["sentences"], fill["batches"], fill["fill"], fill["in_order_batches"],
+                fill["in_order_fill"]))
+        return translation
+    
+    
+    def count_tokens(self, sentences, source_language, target_language='en'):
+        """
+        Count the source tokens of each sentence with the tokenizer of the
+        Opus-MT model for the language pair (whitespace tokens for other
+        models or if the tokenizer is not available).
+
+        Returns
+        -------
+        list
+            Number of tokens of each sentence.
+
+        """
+        with span("count_tokens", "tokenization", sentences=len(sentences)):
+            translator = getattr(self.model, "translator", None)
+            if hasattr(translator, "load_model"):
+                try:
+                    model_name = 'Helsinki-NLP/opus-mt-{}-{}'.format(source_language, target_language)
+                    tokenizer, _ = translator.load_model(model_name)
+                    return [len(ids) for ids in tokenizer(sentences, truncation=True)['input_ids']]
+                except OSError:
+                    pass
+            # Mandarin has no whitespace: fall back to characters
+            return [len(sentence.split()) if ' ' in sentence.strip() else len(sentence) for sentence in sentences]
+    
+    
+    def _translate_uncached(self, sentences, source_language, target_language):
+        if self.shard_pool is None and self.n_workers > 1:
+            self.shard_pool = ShardPool(self.n_workers, self.model_name, self.max_tokens, self.max_batch_size,
+                                        self.quantize)
+            self._owns_shard_pool = True
+        if self.shard_pool is not None and sentences:
+            return self.shard_pool.translate(sentences, source_language, target_language)
+        if self.supervisor is not None:
+            return self._translate_supervised(sentences, source_language, target_language)
+        return self._translate_batched(sentences, source_language, target_language)
+    
+    
+    def _translate_supervised(self, sentences, source_language, target_language):
+        from supervision import deadline_kwargs
+        # EasyNMT passes further keyword arguments on to generate(); sentences
+        # that cannot be translated are kept in the source language
+        return self.supervisor.run(
+            "translate", sentences,
+            process=lambda batch, seconds: self._translate_batched(batch, source_language, target_language,
+                                                                   **deadline_kwargs(seconds)),
+            retry=lambda sentence, seconds: self._translate_batched([sentence], source_language, target_language,
+                                                                    beam_size=1, **deadline_kwargs(seconds))[0],
+            failed=lambda sentence, translation: bool(sentence.strip()) and not (translation or "").strip(),
+            fallback=lambda sentence: sentence,
+            join=lambda sentence, translations: " ".join(translations))
+    
+    
+    def close(self):
+        """
+        Stop the worker processes of sharded translation started by this
+        Translator (if any).
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._owns_shard_pool:
+            self.shard_pool.close()
+            self.shard_pool = None
+            self._owns_shard_pool = False
+    
+    
+    def _translate_batched(self, sentences, source_language, target_language, **kwargs):
+        if self.max_tokens is None or not sentences:
+            with span("translate_batch", "generation", sentences=len(sentences)):
+                return self.model.translate(sentences, target_lang=target_language,
+                                            source_lang=source_language, **kwargs)
+        
+        token_counts = self.count_tokens(sentences, source_language, target_language)
+        batches, self.batch_efficiencies = token_budget_batches(token_counts, self.max_tokens,
+                                                                self.max_batch_size)
+        translation = [None] * len(sentences)
+        for batch in batches:
+            with span("translate_batch", "generation", sentences=len(batch)):
+                translated = self.model.translate([sentences[i] for i in batch], target_lang=target_language,
+                                                  source_lang=source_language, batch_size=len(batch), **kwargs)
+            for i, sentence in zip(batch, translated):
+                translation[i] = sentence
+        
+        print("{} batches, padding efficiency: mean {:.3f}, min {:.3f}".format(
+            len(batches), np.mean(self.batch_efficiencies), np.min(self.batch_efficiencies)))
+        return translation
+    
+    
+    def translate_stream(self, chunks, source_language, target_language='en'):
+        """
+        Translate an iterable of sentence chunks lazily, one chunk at a time.
+        Unlike translate(), the translations are not stored in the class.
+
+        Parameters
+        ----------
+        chunks : Iterable
+            Iterable of lists of sentences, e.g. from iter_sentence_chunks().
+        source_language : String
+            Iso-Code of the language to translate from, or None to detect
+            the language of each sentence (see translate_mixed()).
+        target_language : String, optional
+            Iso-Code of the language to translate to. The default is 'en'.
+
+        Yields
+        ------
+        list
+            List of translated sentences for each chunk.
+
+        """
+        for chunk in chunks:
+            if source_language is None:
+                yield self.translate_mixed(chunk, target_language)
+            else:
+                yield self.translate_sentences(chunk, source_language, target_language)
+    
+    
     def save_translation(self, path):
         """
         Save translation to path, one sentence per line.
@@ -104,10 +497,11 @@ class Translator(object):
         None.
 
         """
-        with open(path, mode="w", encoding='utf-8') as fw:
-            for sentence in self.translation:
-                fw.write(sentence)
-                fw.write("\n")
+        with span("save_translation", "serialization", file=path, sentences=len(self.translation)):
+            with open(path, mode="w", encoding='utf-8') as fw:
+                for sentence in self.translation:
+                    fw.write(sentence)
+                    fw.write("\n")
         
         print("Translations saved to", path)
         
@@ -125,22 +519,22 @@ class Translator(object):
             Mean of the sentences' bleu scores.
 
         """
-        bleu_scores = []
-        
-        for original, translation in zip(self.gold_sentences, self.translation):
-            
-            bleu = sentence_bleu([original.split()], translation.split(), weights=(0.5, 0.5))
-            bleu_scores.append(bleu)
+        # n-grams are counted once per pair; sentence BLEU, corpus BLEU and the
+        # bootstrap interval are all computed from these statistics
+        with span("bleu", "scoring", file=self.to_translate_path, sentences=len(self.translation)):
+            self.bleu_stats = bleu_scoring.corpus_stats(self.gold_sentences, self.translation)
+            bleu_scores = bleu_scoring.sentence_bleu_scores(self.bleu_stats)
             
-        bleu = np.mean(bleu_scores)
-        standard_dev = np.std(bleu_scores)
+            bleu = np.mean(bleu_scores)
+            standard_dev = np.std(bleu_scores)
+            corpus_bleu = bleu_scoring.corpus_bleu_score(self.bleu_stats)
+            interval = bleu_scoring.bootstrap(self.bleu_stats)["corpus_bleu"]
         
         bleu_eval = "Bleu Score (mean of all sentences): "+"{:2.4f}".format(bleu)+"; σ = "+"{:2.4f}".format(standard_dev)
+        bleu_eval += "\nCorpus Bleu Score: "+"{:2.4f}".format(corpus_bleu)+"; 95% CI = [{:2.4f}, {:2.4f}]".format(*interval)
         print(bleu_eval)
         
-        with open("translation_evaluation.txt", "a", encoding='utf-8') as fa:
-            fa.write("\n\n## " + self.to_translate_path)
-            fa.write("\n" + bleu_eval + "\n")
+        self._write_evaluation("\n\n## " + self.to_translate_path + "\n" + bleu_eval + "\n")
         
         return bleu
     
@@ -159,19 +553,36 @@ class Translator(object):
             Sentence embeddings of the English translations.
 
         """
-        sbert_model = SentenceTransformer('bert-base-nli-mean-tokens')
         print("... creating sentence embeddings")
         
-        self.sentence_embeddings_gold = sbert_model.encode(self.gold_sentences,
-                                                           show_progress_bar=False,
-                                                           device=self.device)
-        self.sentence_embeddings_translation = sbert_model.encode(self.translation,
-                                                                  show_progress_bar=False,
-                                                                  device=self.device)
+        self.sentence_embeddings_gold = self._encode(self.gold_sentences)
+        self.sentence_embeddings_translation = self._encode(self.translation)
         
         return self.sentence_embeddings_gold, self.sentence_embeddings_translation
     
     
+    def _encode(self, sentences, sbert_name='bert-base-nli-mean-tokens'):
+        def encode(to_encode):
+            sbert_model = get_model("sbert", lambda: load_sbert(sbert_name), name=sbert_name)
+            threads = None
+            if self.encode_threads is not None:
+                import torch
+                threads = torch.get_num_threads()
+                torch.set_num_threads(self.encode_threads)
+            try:
+                with span("encode", "generation", sentences=len(to_encode)):
+                    return sbert_model.encode(to_encode, batch_size=self.encode_batch_size,
+                                              show_progress_bar=False, device=self.device)
+            finally:
+                if threads is not None:
+                    torch.set_num_threads(threads)
+        
+        # with a store, only sentences that were never encoded before are encoded
+        if self.embedding_dir is not None:
+            return EmbeddingStore(self.embedding_dir, sbert_name).encode(sentences, encode)
+        return np.ascontiguousarray(encode(sentences), dtype=np.float32)
+    
+    
     def evaluate_cosine_similarity(self):
         """
         Computes pairwise cosine similarity between gold and translation sentence
@@ -183,16 +594,13 @@ class Translator(object):
             The mean of all pairwise cosine similarities.
 
         """
-        self.create_sentence_embeddings()
-        
-        cosine_scores = []
-        i=1
-        
-        for original, translation in zip(self.sentence_embeddings_gold, self.sentence_embeddings_translation):
-            sim = 1 - distance.cosine(original, translation)
-            #print(i, "similarity = ", sim)
-            i+=1
-            cosine_scores.append(sim)
+        with span("cosine_similarity", "scoring", file=getattr(self, "to_translate_path", None), sentences=len(self.translation)):
+            self.create_sentence_embeddings()
+            
+            n = min(len(self.sentence_embeddings_gold), len(self.sentence_embeddings_translation))
+            gold = normalize_rows(self.sentence_embeddings_gold[:n])
+            translation = normalize_rows(self.sentence_embeddings_translation[:n])
+            cosine_scores = np.einsum('ij,ij->i', gold, translation)
         
         cosine_mean = np.mean(cosine_scores)
         standard_dev = np.std(cosine_scores)
@@ -200,10 +608,223 @@ class Translator(object):
         cosine_eval = "Cosine similarity gold––translation (mean of all sentences): " + "{:2.4f}".format(cosine_mean) + "; σ = " + "{:2.4f}".format(standard_dev)
         print(cosine_eval, "\n")
         
-        with open("translation_evaluation.txt", "a", encoding='utf-8') as fa:
-            fa.write(cosine_eval)
+        self._write_evaluation(cosine_eval)
             
         return cosine_mean
+    
+    
+    def _write_evaluation(self, text):
+        self.evaluation_report.append(text)
+        if self.evaluation_path is not None:
+            with open(self.evaluation_path, "a", encoding='utf-8') as fa:
+                fa.write(text)
+    
+    
+    def similarity_matrix(self):
+        """
+        Computes the cosine similarity of every gold sentence with every
+        translated sentence (for alignment diagnostics). Uses the embeddings of
+        the last create_sentence_embeddings() call.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape (number of gold sentences, number of translations).
+
+        """
+        return normalize_rows(self.sentence_embeddings_gold) @ normalize_rows(self.sentence_embeddings_translation).T
+
+
+
+def _shard_worker(cores, model_name, max_tokens, max_batch_size, quantize, connection):
+    import torch
+    # pin the worker to its cores and let torch use exactly those
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    translator = Translator(model_name, device='cpu', max_tokens=max_tokens, max_batch_size=max_batch_size,
+                            quantize=quantize)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        shard_id, sentences, source_language, target_language = task
+        try:
+            translation = translator._translate_batched(sentences, source_language, target_language)
+            connection.send(("done", shard_id, translation))
+        except Exception as e:
+            connection.send(("error", shard_id, repr(e)))
+
+
+class ShardPool(object):
+
+    def __init__(self, n_workers, model_name='opus-mt', max_tokens=None, max_batch_size=None, quantize=False):
+        """
+        Pool of worker processes that translate contiguous shards of a list of
+        sentences on CPU. Each worker is pinned to its own subset of cores and
+        holds its own copy of the model. Shards of workers that fail are
+        re-queued and the worker is restarted.
+
+        Parameters
+        ----------
+        n_workers : int
+            Number of worker processes.
+        model_name : String, optional
+            EasyNMT model name. The default is 'opus-mt'.
+        max_tokens : int, optional
+            Token budget per batch within the workers (see Translator).
+        max_batch_size : int, optional
+            Maximum number of sentences per batch within the workers.
+        quantize : Boolean, optional
+            Translate with int8 models (see Translator).
+
+        """
+        if hasattr(os, "sched_getaffinity"):
+            cores = sorted(os.sched_getaffinity(0))
+        else:
+            cores = list(range(os.cpu_count()))
+        n_workers = max(1, min(n_workers, len(cores)))
+        self.core_sets = [[int(core) for core in c] for c in np.array_split(cores, n_workers)]
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.quantize = quantize
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [None] * n_workers
+        self.connections = [None] * n_workers
+        for worker_id in range(n_workers):
+            self._start_worker(worker_id)
+    
+    def _start_worker(self, worker_id):
+        # one pipe per worker: a failing worker cannot corrupt the others' channels
+        # and the pool always knows which shard each worker holds
+        connection, child_connection = self.context.Pipe()
+        self.workers[worker_id] = self.context.Process(
+            target=_shard_worker, daemon=True,
+            args=(self.core_sets[worker_id], self.model_name, self.max_tokens, self.max_batch_size,
+                  self.quantize, child_connection))
+        self.workers[worker_id].start()
+        child_connection.close()
+        self.connections[worker_id] = connection
+    
+    def translate(self, sentences, source_language, target_language='en', shards_per_worker=4, max_retries=2):
+        """
+        Translate sentences in contiguous shards across the worker processes.
+
+        Parameters
+        ----------
+        sentences : list
+            List of sentences to translate.
+        source_language : String
+            Iso-Code of the language to translate from.
+        target_language : String, optional
+            Iso-Code of the language to translate to. The default is 'en'.
+        shards_per_worker : int, optional
+            Number of shards per worker (smaller shards balance the load
+            better). The default is 4.
+        max_retries : int, optional
+            How often a shard is re-queued after its worker failed. The
+            default is 2.
+
+        Returns
+        -------
+        list
+            List of translated sentences in the order of the input.
+
+        """
+        n_shards = min(len(sentences), len(self.workers) * shards_per_worker)
+        bounds = np.linspace(0, len(sentences), n_shards + 1).astype(int)
+        shards = [sentences[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        pending = list(range(len(shards)))
+        assigned = {}  # worker id -> shard id
+        translated = {}
+        retries = [0] * len(shards)
+        
+        def requeue(shard_id, reason):
+            retries[shard_id] += 1
+            if retries[shard_id] > max_retries:
+                raise RuntimeError("Shard {} failed {} times: {}".format(shard_id, retries[shard_id], reason))
+            print("Re-queuing shard", shard_id, "-", reason)
+            pending.insert(0, shard_id)
+        
+        while len(translated) < len(shards):
+            for worker_id in range(len(self.workers)):
+                if worker_id not in assigned and pending:
+                    shard_id = pending.pop(0)
+                    assigned[worker_id] = shard_id
+                    self.connections[worker_id].send((shard_id, shards[shard_id], source_language, target_language))
+            
+            multiprocessing.connection.wait(self.connections + [w.sentinel for w in self.workers], timeout=1.0)
+            for worker_id, (worker, connection) in enumerate(zip(self.workers, self.connections)):
+                try:
+                    if not connection.poll():
+                        if worker.is_alive():
+                            continue
+                        raise EOFError
+                    kind, shard_id, payload = connection.recv()
+                except (EOFError, OSError):
+                    worker.join()
+                    shard_id = assigned.pop(worker_id, None)
+                    self._start_worker(worker_id)
+                    if shard_id is not None:
+                        requeue(shard_id, "worker {} exited with code {}".format(worker_id, worker.exitcode))
+                    continue
+                del assigned[worker_id]
+                if kind == "done":
+                    translated[shard_id] = payload
+                else:
+                    requeue(shard_id, payload)
+        
+        return [sentence for shard_id in range(len(shards)) for sentence in translated[shard_id]]
+    
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.connections = []
+
+
+def measure_shard_scaling(to_translate_path, source_language, worker_counts=(1, 2, 4, 8)):
+    """
+    Translate a file with increasing numbers of worker processes and report
+    the throughput of each setting.
+
+    Parameters
+    ----------
+    to_translate_path : String
+        Absolute or relative path to file with sentences to translate.
+    source_language : String
+        Iso-Code of the language to translate from.
+    worker_counts : tuple, optional
+        Numbers of workers to measure. The default is (1, 2, 4, 8).
+
+    Returns
+    -------
+    dict
+        Sentences per second for each number of workers.
+
+    """
+    scaling = {}
+    for n_workers in worker_counts:
+        translator = Translator(n_workers=n_workers)
+        sentences = translator.load_sentences(to_translate_path)
+        # start the workers and load their models before timing
+        translator._translate_uncached(sentences[:n_workers * 4], source_language, 'en')
+        start = time.perf_counter()
+        translator.translate(source_language=source_language)
+        elapsed = time.perf_counter() - start
+        translator.close()
+        scaling[n_workers] = len(sentences) / elapsed
+        print("{} worker(s): {:.2f} sentences/s (speedup {:.2f}x)".format(
+            n_workers, scaling[n_workers], scaling[n_workers] / scaling[worker_counts[0]]))
+    return scaling
 
 
 
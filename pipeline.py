@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming translate -> parse pipeline. The input file is read in chunks, each
+translated chunk is handed to the AMR parser through a bounded queue and the
+graphs are written as soon as they are parsed, so translation and parsing
+overlap and memory does not grow with the size of the input.
+
+Usage:
+    python pipeline.py -lang <lang> -input_file <file> [-chunk_size <n>] [-queue_size <n>]
+
+With -lang auto, the language of each sentence is detected and each chunk is
+translated grouped by language (larger chunks fill the batches better).
+"""
+
+from amr_parser import load_stog, parse_sents, write_graphs
+from nmt_english import Translator, iter_sentence_chunks
+from model_registry import registry
+from quantization import set_threads
+from supervision import add_supervision_arguments, supervisor_from_arguments
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Returns
+    -------
+    float
+        Peak resident set size of this process in MB (None on Windows).
+
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def stream_translate_parse(to_translate_path, source_language, translation_path, amr_path,
+                           target_language='en', chunk_size=32, queue_size=4,
+                           path_to_model=None, device='cpu', quantize=False, supervisor=None):
+    """
+    Translate a file chunk by chunk and parse the translated chunks to AMR
+    graphs while the next chunks are being translated. Translations and graphs
+    are appended to their files as they arrive.
+
+    In contrast to Translator.load_sentences(), no empty sentence is produced
+    for the final line break, so the AMR file has no trailing placeholder graph.
+
+    Parameters
+    ----------
+    to_translate_path : String
+        Path to the file with sentences to translate, one per line.
+    source_language : String
+        Iso-Code of the language to translate from, or None to detect the
+        language of each sentence.
+    translation_path : String
+        Path to save the translations to.
+    amr_path : String
+        Path to save the AMR graphs to.
+    target_language : String, optional
+        Iso-Code of the language to translate to. The default is 'en'.
+    chunk_size : int, optional
+        Number of sentences translated and parsed together. The default is 32.
+    queue_size : int, optional
+        Maximum number of translated chunks waiting to be parsed. The default is 4.
+    path_to_model : String, optional
+        Path to the AMR model dir.
+    device : String, optional
+        Device to run both models on. The default is 'cpu'.
+    quantize : Boolean, optional
+        Run both models with int8 linear layers (see quantization.py).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence for translating and parsing.
+
+    Returns
+    -------
+    dict
+        Number of sentences, elapsed seconds, sentences per second and peak
+        resident memory in MB.
+
+    """
+    translator = Translator(device=device, quantize=quantize, supervisor=supervisor)
+    stog = load_stog(path_to_model, device, quantize)
+    translated_chunks = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def produce():
+        try:
+            chunks = iter_sentence_chunks(to_translate_path, chunk_size)
+            with open(translation_path, mode="w", encoding='utf-8') as fw:
+                for translation in translator.translate_stream(chunks, source_language, target_language):
+                    for sentence in translation:
+                        fw.write(sentence)
+                        fw.write("\n")
+                    fw.flush()
+                    translated_chunks.put(translation)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            translated_chunks.put(None)
+
+    print("Streaming", to_translate_path, "from", source_language or "detected languages", "to AMR...")
+    start = time.perf_counter()
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    n_sentences = 0
+    with open(amr_path, mode="w", encoding='utf-8') as gr:
+        while True:
+            translation = translated_chunks.get()
+            if translation is None:
+                break
+            write_graphs(parse_sents(stog, translation, supervisor=supervisor), gr)
+            gr.flush()
+            n_sentences += len(translation)
+    producer.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    report = {"sentences": n_sentences,
+              "seconds": elapsed,
+              "sentences_per_second": n_sentences / elapsed if elapsed else 0.0,
+              "peak_rss_mb": peak_rss_mb()}
+    print("Translations saved to", translation_path)
+    print("Graphs saved to", amr_path)
+    print("{} sentences in {:.1f}s ({:.2f} sentences/s), peak RSS: {} MB".format(
+        n_sentences, elapsed, report["sentences_per_second"],
+        "n/a" if report["peak_rss_mb"] is None else "{:.0f}".format(report["peak_rss_mb"])))
+    return report
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Translate, then parse a file as a stream.")
+    parser.add_argument("-lang", required=True, help='"de", "es", "it", "zh", or "auto" for mixed input')
+    parser.add_argument("-input_file", required=True)
+    parser.add_argument("-chunk_size", type=int, default=32)
+    parser.add_argument("-queue_size", type=int, default=4)
+    parser.add_argument("-model_dir", default=None, help="path to the AMR model dir")
+    parser.add_argument("-device", default="cpu")
+    parser.add_argument("-quantize", action="store_true", help="int8 inference on CPU")
+    parser.add_argument("-threads", type=int, default=None, help="torch threads (default: torch's default)")
+    add_supervision_arguments(parser)
+    parser.add_argument("-supervision_log", default=None,
+                        help="where -supervise records the split, retried and fallback sentences")
+    args = parser.parse_args()
+    supervisor = supervisor_from_arguments(args)
+    if args.threads is not None:
+        set_threads(args.threads)
+
+    for folder in ['translations', 'AMRgraphs']:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    name = os.path.basename(args.input_file)[:-4]
+    stream_translate_parse(args.input_file, None if args.lang == "auto" else args.lang,
+                           "translations/" + name + "_nmt.txt",
+                           "AMRgraphs/" + name + "_AMR.txt",
+                           chunk_size=args.chunk_size, queue_size=args.queue_size,
+                           path_to_model=args.model_dir, device=args.device, quantize=args.quantize,
+                           supervisor=supervisor)
+    if supervisor is not None:
+        supervisor.report()
+        if args.supervision_log:
+            supervisor.write(args.supervision_log)
+    registry.report()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Int8 CPU inference: dynamic quantization of the linear layers of the opus-mt
+(Marian) translation models and the amrlib sentence to graph (T5) model. The
+weights of the linear layers are stored as int8 and the activations are
+quantized on the fly, which reduces memory traffic on CPU at a small cost in
+accuracy (see benchmark.py -quantization_report).
+
+Quantized models are saved in a cache directory, keyed by the model, its
+version and the torch version, so that each model is quantized only once;
+later runs load the quantized model from disk.
+"""
+
+from instrumentation import span
+import hashlib
+import os
+
+QUANTIZED_DIR = "cache/quantized"
+
+
+def set_threads(threads=None):
+    """
+    Set the number of threads torch uses for inference on CPU (None keeps
+    torch's default).
+
+    Returns
+    -------
+    int
+        The number of threads torch uses.
+
+    """
+    import torch
+    if threads is not None:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def quantize_linear(model):
+    """
+    Returns
+    -------
+    torch.nn.Module
+        model with its linear layers dynamically quantized to int8.
+
+    """
+    import torch
+    with span("quantize", "model", model=type(model).__name__):
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def checkpoint_version(model_name):
+    """
+    Identify the checkpoint of a transformers model (a hub name or a local
+    directory) by the resolved paths, sizes and modification times of its
+    config and weight files, like amr_parser.stog_model_version(), so that
+    its quantized version is made again when the checkpoint changes.
+
+    Returns
+    -------
+    String
+        Checkpoint version identifier.
+
+    """
+    if os.path.isdir(model_name):
+        paths = [os.path.join(model_name, name) for name in sorted(os.listdir(model_name))]
+    else:
+        try:
+            from transformers.utils import cached_file
+        except ImportError:  # transformers < 4.22
+            from transformers.file_utils import cached_path, hf_bucket_url
+
+            def cached_file(name, filename):
+                return cached_path(hf_bucket_url(name, filename=filename))
+        paths = []
+        for filename in ("config.json", "pytorch_model.bin", "model.safetensors"):
+            try:
+                path = cached_file(model_name, filename)
+            except (OSError, ValueError):
+                # checkpoints come with one of the weight formats
+                continue
+            if path is not None:
+                paths.append(path)
+    fingerprint = hashlib.sha1(model_name.encode("utf-8"))
+    for path in paths:
+        # files in the hub cache are links to blobs named by their hash
+        stat = os.stat(path)
+        fingerprint.update("{}:{}:{}".format(os.path.realpath(path), stat.st_size,
+                                             stat.st_mtime_ns).encode("utf-8"))
+    return model_name + "-" + fingerprint.hexdigest()[:12]
+
+
+class QuantizedModelCache(object):
+
+    def __init__(self, directory=QUANTIZED_DIR):
+        """
+        Directory of quantized models, one file per model and version.
+
+        Parameters
+        ----------
+        directory : String, optional
+            The default is "cache/quantized".
+
+        """
+        self.directory = directory
+
+    def path(self, name, version):
+        import torch
+        fingerprint = hashlib.sha1("\x1f".join([name, version, torch.__version__]).encode("utf-8"))
+        return os.path.join(self.directory, "{}-{}.pt".format(name.replace("/", "_"),
+                                                               fingerprint.hexdigest()[:12]))
+
+    def load(self, name, version, model):
+        """
+        Load the quantized model of name and version from the cache, or
+        quantize model and save it.
+
+        Parameters
+        ----------
+        name : String
+            Name of the model, e.g. "Helsinki-NLP/opus-mt-es-en".
+        version : String
+            Version of the model's weights; a new version is quantized again.
+        model : torch.nn.Module
+            The fp32 model.
+
+        Returns
+        -------
+        torch.nn.Module
+            The quantized model.
+
+        """
+        import torch
+        path = self.path(name, version)
+        if os.path.exists(path):
+            with span("load_quantized", "model", model=name):
+                try:
+                    return torch.load(path, map_location="cpu", weights_only=False)
+                except TypeError:
+                    # torch < 1.13 always unpickles the whole object
+                    return torch.load(path, map_location="cpu")
+
+        quantized = quantize_linear(model)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with span("save_quantized", "serialization", model=name):
+            torch.save(quantized, temp_path)
+            os.replace(temp_path, path)
+        print("Quantized model saved to", path)
+        return quantized
+
+
+def quantize_easynmt(model, cache=None):
+    """
+    Make an EasyNMT opus-mt model translate with int8 Marian models: each
+    language pair's model is replaced by its quantized version (of its
+    current checkpoint, see checkpoint_version()) when EasyNMT first loads
+    it.
+
+    Parameters
+    ----------
+    model : easynmt.EasyNMT
+        The loaded EasyNMT model.
+    cache : QuantizedModelCache, optional
+        The default is a cache in QUANTIZED_DIR.
+
+    Returns
+    -------
+    easynmt.EasyNMT
+        model.
+
+    """
+    cache = cache or QuantizedModelCache()
+    translator = model.translator
+    load_model = translator.load_model
+
+    def load_quantized(model_name):
+        loaded = model_name in translator.models
+        tokenizer, marian = load_model(model_name)
+        if not loaded:
+            marian = cache.load(model_name, checkpoint_version(model_name), marian)
+            marian.eval()
+            translator.models[model_name]["model"] = marian
+        return tokenizer, marian
+
+    translator.load_model = load_quantized
+    return model
+
+
+def quantize_stog(stog, model_version, cache=None):
+    """
+    Replace the T5 model of an amrlib sentence to graph inference object by
+    its int8 version.
+
+    Parameters
+    ----------
+    stog : Object
+        amrlib sentence to graph inference object (on CPU).
+    model_version : String
+        Version of the model, see amr_parser.stog_model_version().
+    cache : QuantizedModelCache, optional
+        The default is a cache in QUANTIZED_DIR.
+
+    Returns
+    -------
+    Object
+        stog.
+
+    """
+    cache = cache or QuantizedModelCache()
+    stog.model = cache.load("stog", model_version, stog.model)
+    stog.model.eval()
+    return stog
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent translation of the LDC2020T07 files. The (language, category)
+files are discovered from their names; each language runs in its own worker
+process, which loads only its own opus-mt language-pair model. As many
+languages run at the same time as the core and memory budgets allow, and
+within a language the files are translated largest first.
+"""
+
+from caches import TranslationCache
+from instrumentation import context, tracer
+import multiprocessing
+import os
+import queue
+import re
+import time
+
+# e.g. amr-release-2.0-amrs-test-bolt.sentences.ES.txt
+FILE_PATTERN = re.compile(r"^(?P<prefix>.+-(?P<category>[a-z]+))\.sentences\.(?P<language>[A-Z]{2})\.txt$")
+
+
+def discover_jobs(data_dir="amr_2-four_translations/data",
+                  source_dir="amr_2-four_translations/english_source_sentences",
+                  translation_dir="translations"):
+    """
+    Find the files to translate and their English gold sentences by name.
+
+    Parameters
+    ----------
+    data_dir : String, optional
+        Directory of the source language files.
+    source_dir : String, optional
+        Directory of the English source sentences (<prefix>_source.txt).
+    translation_dir : String, optional
+        Directory to save the translations to.
+
+    Returns
+    -------
+    dict
+        For each language (e.g. "de"), its jobs sorted by file size, largest
+        first. A job is a dict with language, category, path, gold_path,
+        translation_path and size.
+
+    """
+    jobs = {}
+    for name in sorted(os.listdir(data_dir)):
+        match = FILE_PATTERN.match(name)
+        if match is None:
+            continue
+        path = os.path.join(data_dir, name)
+        language = match.group("language").lower()
+        jobs.setdefault(language, []).append({
+            "language": language,
+            "category": match.group("category"),
+            "path": path,
+            "gold_path": os.path.join(source_dir, match.group("prefix") + "_source.txt"),
+            "translation_path": os.path.join(translation_dir, name[:-4] + "_nmt.txt"),
+            "size": os.path.getsize(path)})
+    for language_jobs in jobs.values():
+        language_jobs.sort(key=lambda job: job["size"], reverse=True)
+    return jobs
+
+
+def _language_worker(language, jobs, cores, options, results):
+    # the models are only needed in the workers
+    from nmt_english import Translator
+    from supervision import Supervisor
+    import torch
+    # pin the worker to its cores and let torch use exactly those
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    translator = Translator(cache=TranslationCache(options["cache_path"]), max_tokens=options["max_tokens"],
+                            embedding_dir=options["embedding_dir"], quantize=options["quantize"],
+                            evaluation_path=None,
+                            supervisor=Supervisor(**options["supervision"]) if options["supervision"] else None)
+    for job in jobs:
+        start = time.perf_counter()
+        translator.evaluation_report = []
+        try:
+            with context(language=language, category=job["category"]):
+                translator.load_sentences(job["path"], job["gold_path"])
+                translator.translate(source_language=language)
+                translator.save_translation(job["translation_path"])
+                bleu = translator.evaluate_bleu()
+                cosine_similarity = translator.evaluate_cosine_similarity()
+            results.put(("done", language, job, {
+                "sentences": len(translator.sentences_to_translate),
+                "seconds": time.perf_counter() - start,
+                "bleu": float(bleu),
+                "cosine_similarity": float(cosine_similarity),
+                # written by the main process, so reports of different
+                # languages do not interleave
+                "evaluation": "".join(translator.evaluation_report) + "\n---",
+                "supervision": translator.supervisor.drain() if translator.supervisor else []}))
+        except Exception as e:
+            results.put(("error", language, job, repr(e)))
+    # the spans of this worker are added to the trace of the main process
+    results.put(("finished", language, None, tracer.drain()))
+
+
+def schedule_translations(jobs, cores=None, memory_mb=None, worker_memory_mb=2500, max_tokens=None,
+                          cache_path="cache/translations.sqlite", embedding_dir="cache/embeddings",
+                          on_done=None, quantize=False, supervisor=None):
+    """
+    Translate the jobs of several languages concurrently, one worker process
+    per language.
+
+    Parameters
+    ----------
+    jobs : dict
+        Jobs of each language, see discover_jobs().
+    cores : int, optional
+        Number of cores to use. The default is all cores available.
+    memory_mb : int, optional
+        Memory budget in MB. The default is no limit.
+    worker_memory_mb : int, optional
+        Expected memory of one worker (translation model and Sentence-BERT)
+        in MB. The default is 2500.
+    max_tokens : int, optional
+        Token budget per translation batch (see Translator).
+    cache_path : String, optional
+        Path to the translation cache shared by the workers.
+    embedding_dir : String, optional
+        Directory of the sentence embedding store.
+    on_done : Callable, optional
+        Called in this process with (job, result) for every finished job,
+        e.g. to record it in a manifest.
+    quantize : Boolean, optional
+        Translate with int8 models (see Translator).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence; each worker uses its settings
+        and the records of the workers are added to it.
+
+    Returns
+    -------
+    list
+        Timing of every job: language, category, sentences, seconds and
+        sentences per second (or the error, also for the jobs of a worker that
+        died before reporting them).
+
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    available = available[:cores or len(available)]
+    concurrency = min(len(jobs), len(available))
+    if memory_mb is not None:
+        concurrency = min(concurrency, max(1, memory_mb // worker_memory_mb))
+    concurrency = max(concurrency, 1)
+    # the languages with the most text start first, so the last ones to finish are short
+    pending = sorted(jobs, key=lambda language: sum(job["size"] for job in jobs[language]), reverse=True)
+    slots = [available[i::concurrency] for i in range(concurrency)]
+    print("Translating", len(pending), "languages,", concurrency, "at a time on", len(available), "cores")
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    options = {"cache_path": cache_path, "max_tokens": max_tokens, "embedding_dir": embedding_dir,
+               "quantize": quantize, "supervision": supervisor.settings() if supervisor else None}
+    running = {}
+    # paths of the jobs each worker reported, as done or failed
+    reported = {language: set() for language in jobs}
+    timings = []
+    start = time.perf_counter()
+    while pending or running:
+        while pending and slots:
+            language = pending.pop(0)
+            cores_of_worker = slots.pop()
+            process = context.Process(target=_language_worker,
+                                      args=(language, jobs[language], cores_of_worker, options, results))
+            process.start()
+            running[language] = (process, cores_of_worker, time.perf_counter() - start)
+        try:
+            status, language, job, result = results.get(timeout=1.0)
+        except queue.Empty:
+            # a worker that died without reporting frees its slot
+            for language, (process, cores_of_worker, _) in list(running.items()):
+                if not process.is_alive() and results.empty():
+                    print("Worker for", language, "exited with code", process.exitcode)
+                    del running[language]
+                    slots.append(cores_of_worker)
+                    for job in jobs[language]:
+                        if job["path"] not in reported[language]:
+                            timings.append({"language": language, "category": job["category"],
+                                            "error": "worker exited with code {}".format(process.exitcode)})
+            continue
+
+        if status == "finished":
+            tracer.extend(result)
+            process, cores_of_worker, _ = running.pop(language)
+            process.join()
+            slots.append(cores_of_worker)
+            continue
+
+        reported[language].add(job["path"])
+        if status == "done":
+            with open("translation_evaluation.txt", "a", encoding='utf-8') as fa:
+                fa.write(result.pop("evaluation"))
+            records = result.pop("supervision")
+            if supervisor is not None:
+                supervisor.extend(records)
+            timings.append({"language": language, "category": job["category"], "sentences": result["sentences"],
+                            "seconds": result["seconds"],
+                            "sentences_per_second": result["sentences"] / result["seconds"] if result["seconds"] else 0.0,
+                            "finished_at": time.perf_counter() - start})
+            if on_done is not None:
+                on_done(job, result)
+        else:
+            print("Translation of", job["path"], "failed:", result)
+            timings.append({"language": language, "category": job["category"], "error": result})
+
+    print("\nTranslation jobs ({:.1f}s in total):".format(time.perf_counter() - start))
+    for timing in timings:
+        if "error" in timing:
+            print("  {:<3} {:<10} failed: {}".format(timing["language"], timing["category"], timing["error"]))
+        else:
+            print("  {:<3} {:<10} {:6d} sentences {:8.1f}s {:7.2f} sentences/s  (finished at {:.1f}s)".format(
+                timing["language"], timing["category"], timing["sentences"], timing["seconds"],
+                timing["sentences_per_second"], timing["finished_at"]))
+    return timings
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized SMATCH alignment. The triples of a pair of graphs are encoded once
+as integer arrays: the candidate node pairs (test node, gold node), the
+matches each pair scores on its own (instance and attribute triples) and the
+relation matches between two pairs. Hill-climbing then evaluates all moves
+and all swaps of a step at once with NumPy instead of one Python dict lookup
+at a time.
+
+The search is the same as smatch.get_best_match: the same smart and random
+initializations (drawing from a random.Random in the same order), the same
+moves and swaps, visited in the same order with the same tie-breaking, and
+the same number of restarts. With an equally seeded random generator it
+finds the same alignment and match number.
+"""
+
+import random
+import smatch
+import numpy as np
+
+# largest number of node pairs (test nodes x gold nodes) aligned with smatch's
+# dict-based search instead of arrays
+SMALL_PAIR_SIZE = 144
+
+
+class PairAlignment(object):
+
+    def __init__(self, instance1, attribute1, relation1, instance2, attribute2, relation2, prefix1="a", prefix2="b"):
+        """
+        Encode the smatch triples of a test and a gold graph (nodes renamed to
+        prefix1/prefix2 + index, see amr.AMR.rename_node) for alignment.
+
+        """
+        self.instance1 = instance1
+        self.instance2 = instance2
+        self.n1 = len(instance1)
+        self.n2 = len(instance2)
+        # candidate gold nodes of each test node, as sets filled in the same
+        # order as smatch.compute_pool (their iteration order feeds the random
+        # initializations)
+        self.candidates = [set() for _ in range(self.n1)]
+
+        node1, node2 = [], []
+        for triples1, triples2 in [(instance1, instance2), (attribute1, attribute2)]:
+            for k1, k2 in zip(*np.nonzero(self._same(triples1, triples2, 0) & self._same(triples1, triples2, 2))):
+                node1.append(int(triples1[k1][1][len(prefix1):]))
+                node2.append(int(triples2[k2][1][len(prefix2):]))
+                self.candidates[node1[-1]].add(node2[-1])
+
+        edges1, edges2 = [], []
+        for k1, k2 in zip(*np.nonzero(self._same(relation1, relation2, 0))):
+            source = (int(relation1[k1][1][len(prefix1):]), int(relation2[k2][1][len(prefix2):]))
+            target = (int(relation1[k1][2][len(prefix1):]), int(relation2[k2][2][len(prefix2):]))
+            self.candidates[source[0]].add(source[1])
+            self.candidates[target[0]].add(target[1])
+            if source == target:
+                # a self-loop matching a self-loop counts like an attribute
+                node1.append(source[0])
+                node2.append(source[1])
+            else:
+                edges1.append(source)
+                edges2.append(target)
+
+        # pair ids, sorted by (test node, gold node); id self.null stands for
+        # "not mapped" and every pair that is not a candidate
+        codes = [i * self.n2 + j for i, candidates in enumerate(self.candidates) for j in candidates]
+        self.pairs = np.unique(np.array(codes, dtype=np.int64))
+        self.null = len(self.pairs)
+        self.pair_node1 = self.pairs // max(self.n2, 1)
+        self.pair_node2 = self.pairs % max(self.n2, 1)
+        # pair id of (test node, gold node); the last column is gold node -1
+        self.pair_ids = np.full((self.n1, self.n2 + 1), self.null, dtype=np.int64)
+        self.pair_ids[self.pair_node1, self.pair_node2] = np.arange(self.null)
+
+        self.weights = np.bincount(self._ids(node1, node2), minlength=self.null + 1).astype(np.int64)
+        self.weights[self.null] = 0
+        # relation weights between two pairs, in both directions, as a sparse
+        # matrix: sorted keys (pair id * (null + 1) + pair id) and their counts
+        if edges1:
+            source = self._ids(*zip(*edges1))
+            target = self._ids(*zip(*edges2))
+            keys = np.concatenate([source * (self.null + 1) + target, target * (self.null + 1) + source])
+        else:
+            keys = np.zeros(0, dtype=np.int64)
+        self.edge_keys, edge_counts = np.unique(keys, return_counts=True)
+        self.edge_weights = edge_counts.astype(np.int64)
+        self.edge_source = self.edge_keys // (self.null + 1)
+        self.edge_target = self.edge_keys % (self.null + 1)
+
+    @staticmethod
+    def _same(triples1, triples2, position):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            len(triples1) x len(triples2) matrix, True where the normalized
+            values at position are equal.
+
+        """
+        values = {}
+        ids1 = np.array([values.setdefault(smatch.normalize(t[position]), len(values)) for t in triples1],
+                        dtype=np.int64)
+        ids2 = np.array([values.setdefault(smatch.normalize(t[position]), len(values)) for t in triples2],
+                        dtype=np.int64)
+        return ids1[:, None] == ids2[None, :]
+
+    def _ids(self, nodes1, nodes2):
+        return self.pair_ids[np.asarray(nodes1, dtype=np.int64), np.asarray(nodes2, dtype=np.int64)]
+
+    def relation_weight(self, pairs1, pairs2):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            Number of relation matches between each pair of pairs1 and the
+            pair at the same position of pairs2.
+
+        """
+        keys = pairs1 * (self.null + 1) + pairs2
+        if not len(self.edge_keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.edge_keys, keys), len(self.edge_keys) - 1)
+        return np.where(self.edge_keys[positions] == keys, self.edge_weights[positions], 0)
+
+    def active(self, mapping):
+        """
+        Returns
+        -------
+        numpy.ndarray
+            Pair id of each test node under mapping (a list with the gold
+            node of each test node, -1 if unmapped).
+
+        """
+        return self.pair_ids[np.arange(self.n1), np.asarray(mapping, dtype=np.int64)]
+
+    def match_number(self, mapping):
+        """
+        Number of matching triples under mapping (smatch.compute_match).
+
+        """
+        on = np.zeros(self.null + 1, dtype=np.int64)
+        on[self.active(mapping)] = 1
+        on[self.null] = 0
+        relations = np.sum(self.edge_weights * on[self.edge_source] * on[self.edge_target]) // 2
+        return int(np.dot(self.weights, on) + relations)
+
+    def best_step(self, mapping):
+        """
+        Find the move or swap with the largest gain, visiting them in the
+        order of smatch.get_best_gain (all moves, then all swaps) and keeping
+        the first of equal gains.
+
+        Returns
+        -------
+        tuple
+            (gain, new mapping); the gain is 0 and the mapping unchanged if no
+            step improves the match.
+
+        """
+        mapping = np.asarray(mapping, dtype=np.int64)
+        current = self.active(mapping)
+        on = np.zeros(self.null + 1, dtype=np.int64)
+        on[current] = 1
+        on[self.null] = 0
+        # relation matches of each pair with the currently mapped pairs
+        linked = np.bincount(self.edge_source, weights=self.edge_weights * on[self.edge_target],
+                             minlength=self.null + 1).astype(np.int64)
+        value = self.weights + linked
+
+        # moves of a test node to an unmapped gold node among its candidates
+        best_gain, best = 0, None
+        unmatched = np.ones(self.n2 + 1, dtype=bool)
+        unmatched[mapping] = False
+        moves = np.nonzero(unmatched[self.pair_node2])[0]
+        if len(moves):
+            old = current[self.pair_node1[moves]]
+            gains = value[moves] - value[old] - self.relation_weight(moves, old)
+            k = int(np.argmax(gains))
+            if gains[k] > best_gain:
+                best_gain, best = int(gains[k]), ("move", int(self.pair_node1[moves[k]]), int(self.pair_node2[moves[k]]))
+
+        # swaps of the gold nodes of two test nodes
+        if self.n1 > 1:
+            first, second = np.triu_indices(self.n1, 1)
+            old1, old2 = current[first], current[second]
+            new1 = self.pair_ids[first, mapping[second]]
+            new2 = self.pair_ids[second, mapping[first]]
+            gains = (value[new1] + value[new2] - value[old1] - value[old2]
+                     + self.relation_weight(new1, new2) + self.relation_weight(old1, old2)
+                     - self.relation_weight(new1, old1) - self.relation_weight(new1, old2)
+                     - self.relation_weight(new2, old1) - self.relation_weight(new2, old2))
+            k = int(np.argmax(gains))
+            if gains[k] > best_gain:
+                best_gain, best = int(gains[k]), ("swap", int(first[k]), int(second[k]))
+
+        new_mapping = mapping.tolist()
+        if best is not None:
+            kind, node, other = best
+            if kind == "move":
+                new_mapping[node] = other
+            else:
+                new_mapping[node], new_mapping[other] = new_mapping[other], new_mapping[node]
+        return best_gain, new_mapping
+
+
+def smart_init_mapping(candidates, instance1, instance2, rng):
+    """
+    smatch.smart_init_mapping with the random generator rng: map each test
+    node to the first free candidate with the same concept, the others to a
+    random free candidate.
+
+    """
+    matched = set()
+    result = []
+    no_word_match = []
+    for i, node_candidates in enumerate(candidates):
+        if not node_candidates:
+            result.append(-1)
+            continue
+        value1 = instance1[i][2]
+        for node_index in node_candidates:
+            if value1 == instance2[node_index][2] and node_index not in matched:
+                result.append(node_index)
+                matched.add(node_index)
+                break
+        if len(result) == i:
+            no_word_match.append(i)
+            result.append(-1)
+    for i in no_word_match:
+        node_candidates = list(candidates[i])
+        while node_candidates:
+            rid = rng.randint(0, len(node_candidates) - 1)
+            if node_candidates[rid] in matched:
+                node_candidates.pop(rid)
+            else:
+                matched.add(node_candidates[rid])
+                result[i] = node_candidates[rid]
+                break
+    return result
+
+
+def random_init_mapping(candidates, rng):
+    """
+    smatch.random_init_mapping with the random generator rng.
+
+    """
+    matched = set()
+    result = []
+    for node_candidates in candidates:
+        node_candidates = list(node_candidates)
+        found = False
+        while node_candidates:
+            rid = rng.randint(0, len(node_candidates) - 1)
+            if node_candidates[rid] in matched:
+                node_candidates.pop(rid)
+            else:
+                matched.add(node_candidates[rid])
+                result.append(node_candidates[rid])
+                found = True
+                break
+        if not found:
+            result.append(-1)
+    return result
+
+
+def best_match(instance1, attribute1, relation1, instance2, attribute2, relation2, prefix1="a", prefix2="b",
+               rng=None, restarts=None):
+    """
+    Hill-climbing search for the node mapping with the most matching triples,
+    as smatch.get_best_match.
+
+    Parameters
+    ----------
+    instance1, attribute1, relation1 : List
+        Triples of the test graph.
+    instance2, attribute2, relation2 : List
+        Triples of the gold graph.
+    prefix1, prefix2 : String, optional
+        Prefixes of the node names. The defaults are "a" and "b".
+    rng : random.Random, optional
+        Random generator of the initializations. The default is seeded from
+        the system, like smatch.
+    restarts : int, optional
+        Number of searches (the first from the smart initialization). The
+        default is smatch.iteration_num.
+
+    Returns
+    -------
+    tuple
+        Best mapping (gold node of each test node, -1 if unmapped) and its
+        number of matching triples.
+
+    """
+    rng = rng or random.Random()
+    if len(instance1) * len(instance2) <= SMALL_PAIR_SIZE:
+        # for small graphs, smatch's own dict-based search is faster than
+        # setting up the arrays; it has no randomness apart from the
+        # initializations, so the result is the same
+        candidates, weight_dict = smatch.compute_pool(instance1, attribute1, relation1,
+                                                      instance2, attribute2, relation2, prefix1, prefix2)
+        smatch.match_triple_dict.clear()
+        match_number = lambda mapping: smatch.compute_match(mapping, weight_dict)
+        best_step = lambda mapping, match_num: smatch.get_best_gain(mapping, candidates, weight_dict,
+                                                                    len(instance2), match_num)
+    else:
+        alignment = PairAlignment(instance1, attribute1, relation1, instance2, attribute2, relation2,
+                                  prefix1, prefix2)
+        candidates = alignment.candidates
+        match_number = alignment.match_number
+        best_step = lambda mapping, match_num: alignment.best_step(mapping)
+
+    best_mapping, best_match_num = [-1] * len(instance1), 0
+    for i in range(smatch.iteration_num if restarts is None else restarts):
+        if i == 0:
+            mapping = smart_init_mapping(candidates, instance1, instance2, rng)
+        else:
+            mapping = random_init_mapping(candidates, rng)
+        match_num = match_number(mapping)
+        while True:
+            gain, new_mapping = best_step(mapping, match_num)
+            if gain <= 0:
+                break
+            match_num += gain
+            mapping = new_mapping
+        if match_num > best_match_num:
+            best_mapping, best_match_num = mapping[:], match_num
+    smatch.match_triple_dict.clear()
+    return best_mapping, best_match_num
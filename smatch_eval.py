@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel SMATCH evaluation of several languages against one gold AMR file.
+The gold graphs are parsed once into a picklable index that is shipped to each
+worker process a single time; the predicted graphs of all languages are then
+scored pair by pair across a process pool. The alignments are searched with
+the vectorized hill-climbing of smatch_core, which finds the same alignments
+as the smatch routines of amrlib's compute_scores when their random
+initializations are seeded alike. smatch reseeds its generator from the system
+before every initialization, so amrlib's scores vary from run to run; here each
+pair gets its own generator seeded from the seed and the pair's number (see
+pair_random()) instead, so the scores are reproducible regardless of the
+number of processes, and equal amrlib's exactly when smatch's generator is
+seeded the same way.
+"""
+
+from graph_store import GraphStore, STORE_SUFFIX, read_entries
+from instrumentation import span
+from smatch_core import best_match
+import amr
+import smatch
+import multiprocessing
+import os
+import pickle
+import random
+import time
+import numpy as np
+
+
+class GoldIndex(object):
+
+    def __init__(self, triples):
+        """
+        Parsed gold graphs: for each graph the smatch (instance, attribute,
+        relation) triples with nodes renamed to b0, b1, ... (None if the graph
+        could not be parsed).
+
+        """
+        self.triples = triples
+
+    def __len__(self):
+        return len(self.triples)
+
+    @classmethod
+    def from_file(cls, gold_path):
+        """
+        Parse all graphs of a gold AMR file. Graphs stored in the binary
+        format (".amrb", see graph_store) are read without parsing.
+
+        Parameters
+        ----------
+        gold_path : String
+            Absolute or relative file path to the gold graphs.
+
+        Returns
+        -------
+        GoldIndex
+
+        """
+        with span("read_graphs", "io", file=gold_path) as args:
+            if gold_path.endswith(STORE_SUFFIX):
+                with GraphStore(gold_path) as store:
+                    index = cls([store.smatch_triples(k, "b") for k in range(len(store))])
+            else:
+                index = cls([parse_triples(entry, "b") for entry in read_entries(gold_path)])
+            args["sentences"] = len(index)
+        return index
+
+    def save(self, path):
+        with open(path, mode="wb") as f:
+            pickle.dump(self.triples, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, mode="rb") as f:
+            return cls(pickle.load(f))
+
+
+def parse_triples(entry, prefix):
+    """
+    Parse a one-line AMR string into smatch triples with renamed nodes.
+
+    Returns
+    -------
+    tuple
+        (instance, attribute, relation) triples, or None if parsing failed.
+
+    """
+    try:
+        graph = amr.AMR.parse_AMR_line(entry)
+        graph.rename_node(prefix)
+        return graph.get_triples()
+    except Exception:
+        return None
+
+
+def match_triples(test_triples, gold_triples, rng=None):
+    """
+    Compute the number of matching triples of two parsed graphs (as
+    smatch.get_amr_match does for two AMR strings). rng (a random.Random)
+    draws the random initializations of the search.
+
+    Returns
+    -------
+    tuple
+        Number of matching triples, test triples and gold triples (all 0 if
+        one of the graphs could not be parsed, like amrlib's match_pair).
+
+    """
+    if test_triples is None or gold_triples is None:
+        return 0, 0, 0
+    instance1, attributes1, relation1 = test_triples
+    instance2, attributes2, relation2 = gold_triples
+    try:
+        _, best_match_num = best_match(instance1, attributes1, relation1, instance2, attributes2, relation2,
+                                       "a", "b", rng=rng)
+    except Exception:
+        return 0, 0, 0
+    return (best_match_num,
+            len(instance1) + len(attributes1) + len(relation1),
+            len(instance2) + len(attributes2) + len(relation2))
+
+
+def pair_random(seed, graph_number):
+    """
+    Returns
+    -------
+    random.Random
+        Random generator of the alignment of the graph pair graph_number. It
+        replaces the system reseeding smatch does before each initialization,
+        which makes amrlib's scores differ between runs.
+
+    """
+    return random.Random("%d:%d" % (seed, graph_number))
+
+
+def timing_report(seconds, name="SMATCH"):
+    """
+    Print the mean, p99 and maximum alignment time per graph pair.
+
+    Parameters
+    ----------
+    seconds : List
+        Alignment time of each graph pair.
+
+    Returns
+    -------
+    dict
+        Number of pairs, total seconds, mean/p99/max milliseconds and the
+        number of the slowest pair.
+
+    """
+    milliseconds = np.array(seconds, dtype=np.float64) * 1000
+    if not len(milliseconds):
+        return {"pairs": 0, "seconds": 0.0}
+    report = {"pairs": len(milliseconds),
+              "seconds": float(milliseconds.sum() / 1000),
+              "mean_ms": float(milliseconds.mean()),
+              "p99_ms": float(np.percentile(milliseconds, 99)),
+              "max_ms": float(milliseconds.max()),
+              "slowest_pair": int(np.argmax(milliseconds))}
+    print("{} alignment: {} pairs, {:.1f}s; per pair mean {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms (pair {})".format(
+        name, report["pairs"], report["seconds"], report["mean_ms"], report["p99_ms"], report["max_ms"],
+        report["slowest_pair"]))
+    return report
+
+
+_gold_index = None
+_seed = 0
+
+
+def _init_worker(gold_index, seed=0):
+    global _gold_index, _seed
+    _gold_index = gold_index
+    _seed = seed
+
+
+def _match_entry(task):
+    language, graph_number, entry = task
+    start = time.perf_counter()
+    # entries of binary files arrive already parsed
+    test_triples = parse_triples(entry, "a") if isinstance(entry, str) else entry
+    counts = match_triples(test_triples, _gold_index.triples[graph_number], pair_random(_seed, graph_number))
+    return language, graph_number, counts, time.perf_counter() - start
+
+
+def _match_pair(task):
+    graph_number, test_entry, gold_entry, seed = task
+    start = time.perf_counter()
+    counts = match_triples(parse_triples(test_entry, "a"), parse_triples(gold_entry, "b"),
+                           pair_random(seed, graph_number))
+    return graph_number, counts, time.perf_counter() - start
+
+
+def compute_smatch(test_entries, gold_entries, seed=0, processes=None, chunksize=16, name="SMATCH"):
+    """
+    Compute the SMATCH precision, recall and F1 score of one-line AMR strings
+    against gold strings in parallel (as amrlib's compute_smatch).
+
+    Parameters
+    ----------
+    test_entries : List
+    gold_entries : List
+        One-line AMR strings, see read_entries().
+    seed : int, optional
+        Seed of the random initializations. The default is 0.
+    processes : int, optional
+        Number of worker processes. The default is the number of CPUs.
+    chunksize : int, optional
+        Number of graph pairs sent to a worker at a time. The default is 16.
+    name : String, optional
+        Name of the score in the timing report.
+
+    Returns
+    -------
+    tuple
+        Precision, recall and F1 score.
+
+    """
+    tasks = [(k, test, gold, seed) for k, (test, gold) in enumerate(zip(test_entries, gold_entries))]
+    totals = [0, 0, 0]
+    seconds = [0.0] * len(tasks)
+    with span("align", "scoring", score=name, sentences=len(tasks)):
+        with multiprocessing.Pool(processes or os.cpu_count()) as pool:
+            for graph_number, counts, elapsed in pool.imap_unordered(_match_pair, tasks, chunksize):
+                for i in range(3):
+                    totals[i] += counts[i]
+                seconds[graph_number] = elapsed
+    timing_report(seconds, name)
+    return smatch.compute_f(*totals)
+
+
+def compute_scores(test_path, gold_path, seed=0, processes=None):
+    """
+    Print the SMATCH score and the sub-scores of amrlib's compute_scores for
+    predicted AMR graphs against gold graphs; the Smatch, Unlabeled and No
+    WSD scores are aligned with the vectorized search.
+
+    Parameters
+    ----------
+    test_path : String
+    gold_path : String
+        Absolute or relative file path to the predicted and gold graphs.
+    seed : int, optional
+        Seed of the random initializations. The default is 0.
+    processes : int, optional
+        Number of worker processes. The default is the number of CPUs.
+
+    Returns
+    -------
+    dict
+        (precision, recall, F1) of each score.
+
+    """
+    # amrlib is only needed for the sub-scores
+    from amrlib.evaluate.smatch_enhanced import unlabel, remove_wsd, compute_subscores, output_score
+    from amrlib.evaluate.smatch_reentracy_srl import compute_reentracy_srl
+
+    test_entries = read_entries(test_path)
+    gold_entries = read_entries(gold_path)
+    assert len(test_entries) == len(gold_entries), '%d != %d' % (len(test_entries), len(gold_entries))
+    scores = {"Smatch": compute_smatch(test_entries, gold_entries, seed, processes),
+              "Unlabeled": compute_smatch([unlabel(e) for e in test_entries], [unlabel(e) for e in gold_entries],
+                                          seed, processes, name="Unlabeled"),
+              "No WSD": compute_smatch([remove_wsd(e) for e in test_entries],
+                                       [remove_wsd(e) for e in gold_entries], seed, processes, name="No WSD")}
+    scores.update(compute_subscores(test_entries, gold_entries))
+    scores.update(compute_reentracy_srl(test_entries, gold_entries))
+    for name, (precision, recall, f_score) in scores.items():
+        output_score(name, precision, recall, f_score)
+    return scores
+
+
+def category_sizes(gold_category_paths, categories):
+    """
+    Count the graphs of the gold file of each category, in the order the
+    categories were unified.
+
+    Parameters
+    ----------
+    gold_category_paths : List
+        Paths to the gold AMR file of each category.
+    categories : List
+        Category names in the same order.
+
+    Returns
+    -------
+    list
+        List of (category, number of graphs) tuples.
+
+    """
+    return [(category, len(read_entries(path))) for category, path in zip(categories, gold_category_paths)]
+
+
+def evaluate_languages(gold, pred_paths, categories=None, processes=None, chunksize=16, seed=0):
+    """
+    Compute SMATCH scores of the predicted graphs of several languages against
+    the same gold graphs in parallel.
+
+    Parameters
+    ----------
+    gold : GoldIndex or String
+        Gold index or path to the gold AMR file.
+    pred_paths : dict
+        Path to the predicted AMR file (text or ".amrb") of each language,
+        e.g. {"DE": "..."}.
+    categories : List, optional
+        List of (category, number of graphs) tuples in file order, see
+        category_sizes(). Adds per-category scores.
+    processes : int, optional
+        Number of worker processes. The default is the number of CPUs.
+    chunksize : int, optional
+        Number of graph pairs sent to a worker at a time. The default is 16.
+    seed : int, optional
+        Seed of the random initializations; each graph pair draws from its
+        own generator (see pair_random()). The default is 0.
+
+    Returns
+    -------
+    dict
+        For each language the "total" (precision, recall, F1), with
+        categories the scores of each category, and the "timing" of its
+        graph pairs (see timing_report()).
+
+    """
+    if not isinstance(gold, GoldIndex):
+        gold = GoldIndex.from_file(gold)
+
+    tasks = []
+    for language, pred_path in pred_paths.items():
+        with span("read_graphs", "io", file=pred_path, language=language.lower()) as args:
+            if pred_path.endswith(STORE_SUFFIX):
+                with GraphStore(pred_path) as store:
+                    entries = [store.smatch_triples(k, "a") for k in range(len(store))]
+            else:
+                entries = read_entries(pred_path)
+            args["sentences"] = len(entries)
+        assert len(entries) == len(gold), '%s: %d != %d' % (language, len(entries), len(gold))
+        tasks.extend((language, graph_number, entry) for graph_number, entry in enumerate(entries))
+
+    counts = {language: [None] * len(gold) for language in pred_paths}
+    seconds = {language: [0.0] * len(gold) for language in pred_paths}
+    with span("smatch", "scoring", languages=len(pred_paths), sentences=len(tasks)):
+        with multiprocessing.Pool(processes or os.cpu_count(), initializer=_init_worker,
+                                  initargs=(gold, seed)) as pool:
+            for language, graph_number, pair_counts, elapsed in pool.imap_unordered(_match_entry, tasks, chunksize):
+                counts[language][graph_number] = pair_counts
+                seconds[language][graph_number] = elapsed
+
+    def score(pair_counts):
+        return smatch.compute_f(*(sum(c[i] for c in pair_counts) for i in range(3)))
+
+    results = {}
+    for language in pred_paths:
+        results[language] = {"total": score(counts[language])}
+        if categories:
+            start = 0
+            for category, size in categories:
+                results[language][category] = score(counts[language][start:start + size])
+                start += size
+        print("SMATCH for {} -> P: {:.3f},  R: {:.3f},  F: {:.3f}".format(language, *results[language]["total"]))
+        results[language]["timing"] = timing_report(seconds[language], "SMATCH " + language)
+    return results
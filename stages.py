@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental execution of the pipeline stages. A JSON manifest records for
+every unit of work (e.g. one translated or parsed file) the hashes of its
+inputs, the model version and the hashes of its outputs. Work whose inputs,
+model and outputs are unchanged is skipped; work that was interrupted resumes
+from its last checkpoint.
+"""
+
+from amr_parser import load_stog, parse_sents, read_file, stog_model_version, write_graphs
+from instrumentation import span
+import hashlib
+import json
+import os
+import time
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    Returns
+    -------
+    String
+        SHA-1 of the content of the file at path (None if it does not exist).
+
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, mode="rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+
+    def __init__(self, path="cache/manifest.json"):
+        """
+        Record of completed and partial work, keyed by a unit of work (by
+        convention the path of its main output). It is rewritten atomically
+        after every change, so it survives interruptions.
+
+        Parameters
+        ----------
+        path : String, optional
+            Path to the JSON file. The default is "cache/manifest.json".
+
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, entry):
+        self.entries[key] = entry
+        self.save()
+
+    def save(self):
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temp_path, mode="w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+class Checkpoint(object):
+
+    def __init__(self, manifest, key, entry, state=None):
+        """
+        Partial progress of one unit of work. state is what the work saved
+        at its last checkpoint (None when it starts from scratch).
+
+        """
+        self.manifest = manifest
+        self.key = key
+        self.entry = entry
+        self.state = state
+
+    def save(self, state):
+        """
+        Record progress; an interrupted run resumes from the last state saved.
+
+        """
+        self.state = state
+        self.manifest.set(self.key, dict(self.entry, complete=False, checkpoint=state))
+
+
+class StageRunner(object):
+
+    def __init__(self, manifest, force=False):
+        """
+        Run units of work, skipping those that are up to date.
+
+        Parameters
+        ----------
+        manifest : Manifest
+        force : Boolean, optional
+            Run all work even if it is up to date. The default is False.
+
+        """
+        self.manifest = manifest
+        self.force = force
+        self.timings = []
+
+    def run(self, stage, key, inputs, outputs, model_version, work):
+        """
+        Run work unless the manifest shows it completed with the same input
+        hashes and model version and its outputs are unchanged since.
+
+        Parameters
+        ----------
+        stage : String
+            Name of the stage, e.g. "parse".
+        key : String
+            Unique name of the unit of work.
+        inputs : List
+            Paths to the files the work reads.
+        outputs : List
+            Paths to the files the work writes.
+        model_version : String
+            Version of the model used (None if no model is involved).
+        work : Callable
+            Called with a Checkpoint; returns a JSON-serializable result.
+
+        Returns
+        -------
+        Object
+            Result of work, or the recorded result if the work was skipped.
+
+        """
+        entry = self.signature(stage, inputs, model_version)
+        previous = self.manifest.get(key)
+        if self.up_to_date(key, entry, outputs):
+            self.skip(stage, key)
+            return previous.get("result")
+
+        state = None
+        if not self.force and self._same_signature(previous, entry) and not previous.get("complete"):
+            state = previous.get("checkpoint")
+        checkpoint = Checkpoint(self.manifest, key, entry, state)
+
+        start = time.perf_counter()
+        with span(stage, "stage", key=key, resumed=state is not None):
+            result = work(checkpoint)
+        self.record(key, entry, outputs, result, time.perf_counter() - start,
+                    "resumed" if state is not None else "done")
+        return result
+
+    @staticmethod
+    def signature(stage, inputs, model_version):
+        return {"stage": stage,
+                "inputs": {path: file_hash(path) for path in inputs},
+                "model_version": model_version}
+
+    @staticmethod
+    def _same_signature(previous, entry):
+        return (previous is not None and previous["inputs"] == entry["inputs"]
+                and previous["model_version"] == entry["model_version"])
+
+    def up_to_date(self, key, entry, outputs):
+        """
+        Check whether the work key completed with the signature entry (see
+        signature()) and its outputs are unchanged since.
+
+        """
+        previous = self.manifest.get(key)
+        return (not self.force and self._same_signature(previous, entry) and previous.get("complete", False)
+                and all(file_hash(path) == previous["outputs"].get(path) for path in outputs))
+
+    def skip(self, stage, key):
+        print("Up to date:", key)
+        self.timings.append((stage, key, "skipped", 0.0))
+
+    def record(self, key, entry, outputs, result, elapsed, status="done"):
+        """
+        Record completed work, e.g. work that was run in another process.
+
+        """
+        self.manifest.set(key, dict(entry, complete=True, finished=time.time(), seconds=elapsed, result=result,
+                                    outputs={path: file_hash(path) for path in outputs}))
+        self.timings.append((entry["stage"], key, status, elapsed))
+
+    def report(self):
+        """
+        Print what was run and skipped.
+
+        """
+        print("\nStages:")
+        for stage, key, status, elapsed in self.timings:
+            print("  {:<10} {:<8} {:8.1f}s  {}".format(stage, status, elapsed, key))
+
+
+def parse_resumable(runner, input_path, output_path, path_to_model=None, device=None, cache=None,
+                    checkpoint_every=100, quantize=False, supervisor=None):
+    """
+    Parse a file of english sentences to AMR graphs, appending the graphs to
+    <output_path>.partial and saving a checkpoint every checkpoint_every
+    sentences. After an interruption, the next run continues after the last
+    checkpoint; the finished file is renamed to output_path.
+
+    Parameters
+    ----------
+    runner : StageRunner
+    input_path : String
+        Path to the file with english sentences, one per line.
+    output_path : String
+        Path to save the graphs to.
+    path_to_model : String, optional
+        Path to the AMR model dir.
+    device : String, optional
+        Device to load the model to.
+    cache : caches.ParseCache, optional
+        Cache of previously parsed graphs.
+    checkpoint_every : int, optional
+        Number of sentences between checkpoints. The default is 100.
+    quantize : Boolean, optional
+        Parse with the int8 model (see amr_parser.load_stog()).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence (see amr_parser.parse_supervised()).
+
+    Returns
+    -------
+    dict
+        Number of sentences and of failed parses.
+
+    """
+    model_version = stog_model_version(path_to_model, quantize, supervisor)
+
+    def work(checkpoint):
+        sentences = read_file(input_path)
+        partial_path = output_path + ".partial"
+        state = checkpoint.state if os.path.exists(partial_path) else None
+        done, failed = (state["sentences"], state["failed"]) if state else (0, 0)
+        if state:
+            print("Resuming", output_path, "after sentence", done, "of", len(sentences))
+
+        stog = load_stog(path_to_model, device, quantize)
+        with open(partial_path, mode="a" if state else "w", encoding="utf-8") as gr:
+            # drop graphs written after the last checkpoint
+            gr.truncate(state["bytes"] if state else 0)
+            for start in range(done, len(sentences), checkpoint_every):
+                graphs = parse_sents(stog, sentences[start:start + checkpoint_every], cache, model_version,
+                                     supervisor)
+                with span("save_graphs", "serialization", file=partial_path, sentences=len(graphs)):
+                    write_graphs(graphs, gr)
+                    gr.flush()
+                    os.fsync(gr.fileno())
+                failed += sum(graph is None for graph in graphs)
+                checkpoint.save({"sentences": min(start + checkpoint_every, len(sentences)), "failed": failed,
+                                 "bytes": os.fstat(gr.fileno()).st_size})
+        os.replace(partial_path, output_path)
+        print("Graphs saved to", output_path)
+        return {"sentences": len(sentences), "failed": failed}
+
+    return runner.run("parse", output_path, [input_path], [output_path], model_version, work)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Supervision of translation and parsing, so that one very long or garbled
+sentence cannot stall a whole run. Sentences over a length budget are split
+into pieces that are processed separately and joined again. Each batch gets a
+time budget at which generation is stopped (generate()'s max_time, which
+needs transformers >= 4.4); the sentences of a batch that failed or ran out
+of time are retried one at a time in a side queue with cheaper decoding
+(greedy search) and a time budget per sentence, within a total time budget
+for all retries. The ones that fail again get a fallback. Every split, retry
+and fallback is recorded with its reason.
+"""
+
+from collections import Counter
+from instrumentation import span
+import contextlib
+import functools
+import hashlib
+import json
+import re
+import time
+
+# clause boundaries to split over-long sentences at, for text with and
+# without spaces between words
+SPACED_CLAUSE_END = re.compile(r"(?<=[.;:!?,])\s+")
+UNSPACED_CLAUSE_END = re.compile(r"(?<=[。；：！？，.;:!?,])")
+CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]")
+
+
+def spaced(sentence):
+    # Mandarin has no whitespace between words: its characters are counted
+    return ' ' in sentence.strip() or not CJK.search(sentence)
+
+
+def count_words(sentence):
+    return len(sentence.split()) if spaced(sentence) else len(sentence.strip())
+
+
+def split_sentence(sentence, max_words):
+    """
+    Split a sentence into pieces of at most max_words words (characters for
+    text without spaces), at clause boundaries where possible.
+
+    Returns
+    -------
+    list
+        The pieces (only the sentence itself if it is short enough).
+
+    """
+    if count_words(sentence) <= max_words:
+        return [sentence]
+    words = spaced(sentence)
+    pieces, piece = [], []
+    for clause in (SPACED_CLAUSE_END if words else UNSPACED_CLAUSE_END).split(sentence.strip()):
+        units = clause.split() if words else list(clause)
+        if piece and len(piece) + len(units) > max_words:
+            pieces.append(piece)
+            piece = []
+        # a single clause over the budget is cut
+        while len(units) > max_words:
+            pieces.append(units[:max_words])
+            units = units[max_words:]
+        piece = piece + units
+    if piece:
+        pieces.append(piece)
+    return [(" " if words else "").join(piece) for piece in pieces]
+
+
+def deadline_kwargs(seconds):
+    """
+    Returns
+    -------
+    dict
+        Keyword arguments of generate() that stop generation after seconds
+        (empty for None: no limit).
+
+    """
+    return {} if seconds is None else {"max_time": seconds}
+
+
+@contextlib.contextmanager
+def generate_kwargs(model, **kwargs):
+    """
+    Pass kwargs (e.g. max_time) to every model.generate() call inside the
+    with-block, for callers (like amrlib) that do not forward them.
+
+    """
+    if not kwargs:
+        yield
+        return
+    own = "generate" in vars(model)
+    generate = model.generate
+    model.generate = functools.partial(generate, **kwargs)
+    try:
+        yield
+    finally:
+        if own:
+            model.generate = generate
+        else:
+            del model.generate
+
+
+def add_supervision_arguments(parser):
+    """
+    Add the command line options of supervision to an argparse parser (see
+    supervisor_from_arguments()).
+
+    """
+    parser.add_argument("-supervise", action="store_true",
+                        help="split over-long sentences, stop generation at a time budget and retry failed sentences")
+    parser.add_argument("-max_words", type=int, default=100, help="length budget of a sentence with -supervise")
+    parser.add_argument("-batch_seconds", type=float, default=30.0,
+                        help="time budget of a batch of sentences with -supervise")
+    parser.add_argument("-sentence_seconds", type=float, default=10.0,
+                        help="time budget of a sentence retried alone with -supervise")
+    parser.add_argument("-retry_seconds", type=float, default=300.0,
+                        help="time budget of all retries of a file (or chunk) with -supervise")
+
+
+def supervisor_from_arguments(args):
+    """
+    Returns
+    -------
+    Supervisor
+        The Supervisor of the options added by add_supervision_arguments()
+        (None without -supervise).
+
+    """
+    if not args.supervise:
+        return None
+    return Supervisor(args.max_words, args.batch_seconds, args.sentence_seconds, args.retry_seconds)
+
+
+class Supervisor(object):
+
+    def __init__(self, max_words=100, batch_seconds=30.0, sentence_seconds=10.0, retry_seconds=300.0,
+                 batch_size=16):
+        """
+        Parameters
+        ----------
+        max_words : int, optional
+            Length budget: longer sentences are split into pieces (None: no
+            splitting). The default is 100.
+        batch_seconds : float, optional
+            Time budget of a batch of sentences (None: no time budget). The
+            default is 30.0.
+        sentence_seconds : float, optional
+            Time budget of a sentence retried alone (None: no time budget).
+            The default is 10.0.
+        retry_seconds : float, optional
+            Time budget of all retries of one run() call; once it is used up,
+            the remaining sentences get their fallback (None: no time
+            budget). The default is 300.0.
+        batch_size : int, optional
+            Number of sentences (or pieces) per supervised batch. The default
+            is 16.
+
+        """
+        self.max_words = max_words
+        self.batch_seconds = batch_seconds
+        self.sentence_seconds = sentence_seconds
+        self.retry_seconds = retry_seconds
+        self.batch_size = batch_size
+        self.records = []
+        # positions of the sentences of the last run() whose output is a
+        # fallback or was stopped at a time budget
+        self.degraded = set()
+
+    def settings(self):
+        """
+        Returns
+        -------
+        dict
+            The budgets, to create the same Supervisor in another process.
+
+        """
+        return {"max_words": self.max_words, "batch_seconds": self.batch_seconds,
+                "sentence_seconds": self.sentence_seconds, "retry_seconds": self.retry_seconds,
+                "batch_size": self.batch_size}
+
+    def version(self):
+        """
+        Returns
+        -------
+        String
+            Identifier of the settings, to keep supervised translations and
+            graphs (split, retried with greedy decoding) apart from others in
+            caches and stage signatures.
+
+        """
+        settings = json.dumps(self.settings(), sort_keys=True)
+        return "supervised-" + hashlib.sha1(settings.encode("utf-8")).hexdigest()[:8]
+
+    def _record(self, stage, sentence, reason, action):
+        self.records.append({"stage": stage, "sentence": sentence, "reason": reason, "action": action})
+
+    def run(self, stage, sentences, process, retry, failed, fallback, join):
+        """
+        Process sentences in supervised batches.
+
+        Parameters
+        ----------
+        stage : String
+            Name of the stage for the records, e.g. "translate" or "parse".
+        sentences : list
+            Sentences to process.
+        process : Callable
+            process(batch, seconds) returns the output of each sentence of
+            the batch, stopping generation after seconds (None: no limit).
+        retry : Callable
+            retry(sentence, seconds) returns the output of one sentence with
+            cheaper decoding settings.
+        failed : Callable
+            failed(sentence, output) tells whether output is a failure.
+        fallback : Callable
+            fallback(sentence) returns the output used if the retry fails.
+        join : Callable
+            join(sentence, outputs) joins the outputs of the pieces of a
+            split sentence.
+
+        Returns
+        -------
+        list
+            Output of each sentence in the order of the input. The positions
+            of the sentences whose output (or the output of one of their
+            pieces) is a fallback or was stopped at a time budget are stored
+            in degraded; these outputs should not be cached.
+
+        """
+        pieces, owners = [], []
+        for i, sentence in enumerate(sentences):
+            split = [sentence] if self.max_words is None else split_sentence(sentence, self.max_words)
+            if len(split) > 1:
+                self._record(stage, sentence, "length", "split into {} pieces".format(len(split)))
+            pieces.extend(split)
+            owners.extend([i] * len(split))
+
+        outputs = [None] * len(pieces)
+        side_queue = []
+        for start in range(0, len(pieces), self.batch_size):
+            batch = range(start, min(start + self.batch_size, len(pieces)))
+            begin = time.perf_counter()
+            try:
+                batch_outputs = process([pieces[k] for k in batch], self.batch_seconds)
+            except Exception as e:
+                side_queue.extend((k, "error: " + repr(e)) for k in batch)
+                continue
+            overrun = self.batch_seconds is not None and time.perf_counter() - begin > self.batch_seconds
+            for k, output in zip(batch, batch_outputs):
+                outputs[k] = output
+                if failed(pieces[k], output):
+                    side_queue.append((k, "failed"))
+                elif overrun:
+                    # generation was stopped (or is known to be slow): the
+                    # output may be cut short
+                    side_queue.append((k, "timeout"))
+
+        degraded = set()
+
+        def give_up(k, reason):
+            degraded.add(k)
+            if reason.startswith("timeout") and not failed(pieces[k], outputs[k]):
+                self._record(stage, pieces[k], reason, "kept the output stopped at the time budget")
+            else:
+                outputs[k] = fallback(pieces[k])
+                self._record(stage, pieces[k], reason, "fallback")
+
+        if side_queue:
+            end = None if self.retry_seconds is None else time.perf_counter() + self.retry_seconds
+            with span("retry", "generation", stage=stage, sentences=len(side_queue)):
+                for k, reason in side_queue:
+                    seconds = self.sentence_seconds
+                    if end is not None:
+                        left = end - time.perf_counter()
+                        if left <= 0:
+                            give_up(k, reason + "; retry budget used up")
+                            continue
+                        seconds = left if seconds is None else min(seconds, left)
+                    begin = time.perf_counter()
+                    try:
+                        output = retry(pieces[k], seconds)
+                    except Exception as e:
+                        output, reason = None, reason + "; retry error: " + repr(e)
+                    overrun = seconds is not None and time.perf_counter() - begin > seconds
+                    if not failed(pieces[k], output):
+                        outputs[k] = output
+                        if overrun:
+                            degraded.add(k)
+                        self._record(stage, pieces[k], reason, "retried with greedy decoding" +
+                                     (", stopped at the time budget" if overrun else ""))
+                    else:
+                        give_up(k, reason)
+
+        self.degraded = {owners[k] for k in degraded}
+        parts = [[] for _ in sentences]
+        for k, i in enumerate(owners):
+            parts[i].append(outputs[k])
+        return [piece_outputs[0] if len(piece_outputs) == 1 else join(sentence, piece_outputs)
+                for sentence, piece_outputs in zip(sentences, parts)]
+
+    def drain(self):
+        """
+        Remove and return the records, e.g. to send them from a worker
+        process to the main process.
+
+        """
+        records, self.records = self.records, []
+        return records
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def report(self):
+        """
+        Print the number of splits, retries and fallbacks per stage and
+        reason.
+
+        Returns
+        -------
+        Counter
+            {(stage, reason, action): sentences}.
+
+        """
+        counts = Counter((record["stage"], re.split("[:;]", record["reason"])[0], record["action"])
+                         for record in self.records)
+        print("\nSupervised sentences:" if counts else "\nSupervised sentences: none")
+        for (stage, reason, action), count in sorted(counts.items()):
+            print("  {:<10} {:<8} {:<50} {:6d}".format(stage, reason, action, count))
+        return counts
+
+    def write(self, path):
+        """
+        Write the records to path, one JSON object per line.
+
+        """
+        with open(path, mode="w", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+        print("Supervision records saved to", path)
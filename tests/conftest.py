@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+The modules of the project live in the repository root; the tests read the
+small AMR and sentence files of benchmark_fixtures/.
+"""
+
+import os
+import random
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def fixtures_dir():
+    return os.path.join(ROOT, "benchmark_fixtures")
+
+
+class SeededRandom(random.Random):
+    """A random.Random that keeps its state when smatch calls seed()."""
+
+    def seed(self, a=None, version=2):
+        if a is not None:
+            super().seed(a, version)
+
+
+@pytest.fixture
+def seed_smatch(monkeypatch):
+    """
+    Seed the module-level generator of smatch. smatch reseeds it from the
+    system before every initialization of the search, so the generator
+    installed here ignores those calls.
+    """
+    import smatch
+
+    def seed(a):
+        monkeypatch.setattr(smatch, "random", SeededRandom(a))
+
+    return seed
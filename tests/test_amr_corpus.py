@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+AMRCorpus must delimit graphs exactly as amr_parser.iter_graph_blocks and
+keep its index in step with the file.
+"""
+
+import os
+import shutil
+from amr_corpus import AMRCorpus
+from amr_parser import PLACEHOLDER_GRAPH, iter_graph_blocks
+
+
+def test_graphs_equal_iter_graph_blocks(fixtures_dir, tmp_path):
+    path = str(tmp_path / "graphs.txt")
+    shutil.copyfile(os.path.join(fixtures_dir, "graphs.txt"), path)
+    with AMRCorpus(path) as corpus:
+        blocks = list(iter_graph_blocks(path))
+        assert len(blocks) == 8
+        assert list(corpus) == blocks
+        assert bytes(corpus.raw(3)).decode("utf-8") == blocks[3]
+        assert corpus.by_id("fixture.5") == blocks[4]
+        assert [k for k, _ in corpus.sample(3)] == sorted(k for k, _ in corpus.sample(3))
+
+
+def test_irregular_blocks(tmp_path):
+    # a file header, the placeholder graph (blank line between its comments),
+    # several blank lines, non-ASCII text and no newline at the end
+    path = str(tmp_path / "parsed_AMR.txt")
+    with open(path, mode="w", encoding="utf-8") as f:
+        f.write("# AMR file header\n\n# ::id a.1\n# ::snt Él vio a María.\n(v / ver-01\n  :ARG0 (é / él))\n\n\n\n"
+                + PLACEHOLDER_GRAPH + "\n\n# ::id a.3\n(x / x-ß)")
+    with AMRCorpus(path) as corpus:
+        blocks = list(iter_graph_blocks(path))
+        assert len(blocks) == 3
+        assert list(corpus) == blocks
+        assert list(corpus.ids) == ["a.1", "", "a.3"]
+        assert corpus[1] == PLACEHOLDER_GRAPH
+
+
+def test_index_follows_the_file(fixtures_dir, tmp_path):
+    path = str(tmp_path / "graphs.txt")
+    shutil.copyfile(os.path.join(fixtures_dir, "graphs.txt"), path)
+    with AMRCorpus(path) as corpus:
+        first = corpus[0]
+    index_stamp = os.stat(path + ".idx.npz").st_mtime_ns
+
+    # an unchanged file reuses the saved index
+    with AMRCorpus(path) as corpus:
+        assert corpus[0] == first
+    assert os.stat(path + ".idx.npz").st_mtime_ns == index_stamp
+
+    # a changed file gets a new index
+    with open(path, mode="a", encoding="utf-8") as f:
+        f.write("\n# ::id fixture.9\n(n / new)\n")
+    with AMRCorpus(path) as corpus:
+        assert list(corpus) == list(iter_graph_blocks(path))
+        assert corpus.by_id("fixture.9") == "# ::id fixture.9\n(n / new)"
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+BLEU from the shared n-gram statistics must equal nltk's sentence_bleu and
+corpus_bleu (single reference, no smoothing).
+"""
+
+import os
+import warnings
+import pytest
+from nltk.translate.bleu_score import corpus_bleu, sentence_bleu
+import bleu
+
+
+def sentence_pairs(fixtures_dir):
+    with open(os.path.join(fixtures_dir, "sentences.en.txt"), encoding="utf-8") as f:
+        references = f.read().splitlines()
+    with open(os.path.join(fixtures_dir, "sentences.es.txt"), encoding="utf-8") as f:
+        spanish = f.read().splitlines()
+    hypotheses = []
+    for k, (reference, other) in enumerate(zip(references, spanish)):
+        words = reference.split()
+        # exact, shortened, reordered, repeated, unrelated and empty hypotheses
+        hypotheses.append([reference, " ".join(words[:-2]), " ".join(words[::-1]),
+                           " ".join(words + words[:3]), other, ""][k % 6])
+    return references, hypotheses
+
+
+@pytest.mark.parametrize("weights", [bleu.DEFAULT_WEIGHTS, (0.25, 0.25, 0.25, 0.25)])
+def test_scores_equal_nltk(fixtures_dir, weights):
+    references, hypotheses = sentence_pairs(fixtures_dir)
+    stats = bleu.corpus_stats(references, hypotheses, max_n=len(weights))
+
+    with warnings.catch_warnings():
+        # nltk warns about n-gram orders without matches
+        warnings.simplefilter("ignore")
+        expected = [sentence_bleu([reference.split()], hypothesis.split(), weights=weights)
+                    for reference, hypothesis in zip(references, hypotheses)]
+        expected_corpus = corpus_bleu([[reference.split()] for reference in references],
+                                      [hypothesis.split() for hypothesis in hypotheses], weights=weights)
+
+    assert bleu.sentence_bleu_scores(stats, weights).tolist() == expected
+    assert bleu.corpus_bleu_score(stats, weights) == expected_corpus
+
+
+def test_bootstrap_interval_contains_corpus_bleu(fixtures_dir):
+    references, hypotheses = sentence_pairs(fixtures_dir)
+    stats = bleu.corpus_stats(references, hypotheses)
+    interval = bleu.bootstrap(stats, n_samples=200)["corpus_bleu"]
+    assert interval[0] <= bleu.corpus_bleu_score(stats) <= interval[1]
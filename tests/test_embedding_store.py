@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+EmbeddingStore must return stored embeddings unchanged, also when the store
+or the list of sentences is empty.
+"""
+
+import numpy as np
+from embedding_store import EmbeddingStore
+
+
+def encoder(sentences):
+    return np.array([[len(s), s.count(" "), 1.0] for s in sentences], dtype=np.float32)
+
+
+def test_empty(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    assert store.matrix.shape == (0, 0)
+    assert store.get([]).shape == (0, 0)
+    assert store.encode([], encoder).shape == (0, 0)
+    store.add(["a b"], encoder(["a b"]))
+    assert store.get([]).shape == (0, 3)
+
+
+def test_encode_only_missing_sentences(tmp_path):
+    sentences = ["the boy", "a girl eats", "the boy", "ok"]
+    calls = []
+
+    def counting_encoder(to_encode):
+        calls.append(list(to_encode))
+        return encoder(to_encode)
+
+    store = EmbeddingStore(str(tmp_path), "model")
+    assert np.array_equal(store.encode(sentences[:2], counting_encoder), encoder(sentences[:2]))
+    assert np.array_equal(store.encode(sentences, counting_encoder), encoder(sentences))
+    assert calls == [["the boy", "a girl eats"], ["ok"]]
+
+    # a second store reads the rows back from disk
+    reopened = EmbeddingStore(str(tmp_path), "model")
+    assert len(reopened) == 3
+    assert np.array_equal(reopened.get(sentences), encoder(sentences))
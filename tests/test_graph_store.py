@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Graphs written to a graph store must read back as the same PENMAN trees and
+the same smatch triples as parsing the text.
+"""
+
+import os
+import shutil
+import penman
+from amr_parser import iter_graph_blocks
+from graph_store import GraphStore, STORE_SUFFIX, convert, entry_line, write_graph_store
+from smatch_eval import parse_triples
+
+EXTRA_GRAPHS = [
+    None,
+    "(b / broken",
+    '# ::snt Él dijo "sí".\n(d / decir-01\n   :ARG0 (é / él)\n   :ARG1 (s / "sí")\n   :polarity -\n   :quant 3.5)',
+]
+
+
+def check_store(store, graphs):
+    assert len(store) == len(graphs)
+    for k, graph in enumerate(graphs):
+        try:
+            tree = penman.parse(graph) if graph is not None else None
+        except penman.DecodeError:
+            tree = None
+        assert store.tree(k) == tree
+        assert store[k] == (None if tree is None else penman.format(tree))
+        expected = None if graph is None else parse_triples(entry_line(graph), "a")
+        assert store.smatch_triples(k, "a") == expected
+
+
+def test_round_trip(fixtures_dir, tmp_path):
+    graphs = list(iter_graph_blocks(os.path.join(fixtures_dir, "graphs.txt"))) + EXTRA_GRAPHS
+    path = str(tmp_path / ("graphs" + STORE_SUFFIX))
+    assert write_graph_store(graphs, path) == len(graphs)
+    with GraphStore(path) as store:
+        check_store(store, graphs)
+        assert store.tree(8) is None and store.smatch_triples(8, "b") is None
+        assert store.tree(9) is None
+        assert store.tree(10).metadata == {"snt": 'Él dijo "sí".'}
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+def test_convert(fixtures_dir, tmp_path):
+    amr_path = str(tmp_path / "graphs.txt")
+    shutil.copyfile(os.path.join(fixtures_dir, "graphs.txt"), amr_path)
+    store_path = amr_path + STORE_SUFFIX
+    assert convert(amr_path, store_path) == 8
+    with GraphStore(store_path) as store:
+        check_store(store, list(iter_graph_blocks(amr_path)))
+        assert list(store) == [store.penman(k) for k in range(8)]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+The batched LanguageDetector must identify the same languages as langid's
+classify() and give the probabilities it returns with norm_probs=True.
+"""
+
+import os
+import pytest
+from language_detection import LANGUAGES, LanguageDetector
+
+SENTENCES = ["Der Junge will nach New York fahren.",
+             "Il ragazzo vuole andare a New York.",
+             "这个男孩想去纽约。",
+             "The boy wants to go to New York.",
+             "ok",
+             ""]
+
+
+def test_detect_equals_langid_classify(fixtures_dir):
+    langid = pytest.importorskip("langid.langid")
+    identifier = langid.LanguageIdentifier.from_modelstring(langid.model, norm_probs=True)
+    identifier.set_languages(LANGUAGES)
+    sentences = list(SENTENCES)
+    for name in ["sentences.en.txt", "sentences.es.txt"]:
+        with open(os.path.join(fixtures_dir, name), encoding="utf-8") as f:
+            sentences.extend(line.strip() for line in f)
+
+    languages, confidences = LanguageDetector(batch_size=7).detect(sentences)
+    expected = [identifier.classify(sentence) for sentence in sentences]
+    assert languages == [language for language, _ in expected]
+    assert confidences == pytest.approx([confidence for _, confidence in expected], rel=1e-9)
+    assert languages[:4] == ["de", "it", "zh", "en"]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+smatch_core.best_match must find the same alignment and match number as
+smatch.get_best_match with an equally seeded random generator, on both its
+dict-based path (small pairs) and its array path (large pairs).
+"""
+
+import os
+import random
+import smatch
+from amr_parser import combine_graphs, iter_graph_blocks
+from graph_store import entry_line
+from smatch_core import SMALL_PAIR_SIZE, best_match
+from smatch_eval import parse_triples
+
+SEEDS = [0, 1, 7, 2024]
+
+
+def load_graphs(fixtures_dir):
+    graphs = list(iter_graph_blocks(os.path.join(fixtures_dir, "graphs.txt")))
+    # multi-sentence graphs of several fixtures, for pairs beyond SMALL_PAIR_SIZE
+    large = [combine_graphs("", graphs), combine_graphs("", graphs[::-1]),
+             combine_graphs("", graphs[1::2] + graphs[::2])]
+    return graphs, large
+
+
+def smatch_best_match(test, gold, seed, seed_smatch):
+    seed_smatch(seed)
+    smatch.match_triple_dict.clear()
+    return smatch.get_best_match(*test, *gold, "a", "b")
+
+
+def check_pairs(pairs, seed_smatch, seeds=SEEDS):
+    for test_graph, gold_graph in pairs:
+        test = parse_triples(entry_line(test_graph), "a")
+        gold = parse_triples(entry_line(gold_graph), "b")
+        for seed in seeds:
+            expected = smatch_best_match(test, gold, seed, seed_smatch)
+            assert best_match(*test, *gold, "a", "b", rng=random.Random(seed)) == tuple(expected)
+
+
+def test_small_pairs(fixtures_dir, seed_smatch):
+    graphs, _ = load_graphs(fixtures_dir)
+    pairs = [(g1, g2) for g1 in graphs for g2 in graphs]
+    assert all(len(parse_triples(entry_line(g1), "a")[0]) * len(parse_triples(entry_line(g2), "b")[0])
+               <= SMALL_PAIR_SIZE for g1, g2 in pairs)
+    check_pairs(pairs, seed_smatch)
+
+
+def test_large_pairs(fixtures_dir, seed_smatch):
+    graphs, large = load_graphs(fixtures_dir)
+    pairs = [(large[0], large[1]), (large[2], large[0]), (large[0], graphs[3]), (graphs[6], large[1])]
+    assert all(len(parse_triples(entry_line(g1), "a")[0]) * len(parse_triples(entry_line(g2), "b")[0])
+               > SMALL_PAIR_SIZE for g1, g2 in pairs)
+    check_pairs(pairs, seed_smatch, SEEDS[:2])
+
+
+def test_restarts(fixtures_dir, monkeypatch, seed_smatch):
+    _, large = load_graphs(fixtures_dir)
+    test = parse_triples(entry_line(large[0]), "a")
+    gold = parse_triples(entry_line(large[2]), "b")
+    monkeypatch.setattr(smatch, "iteration_num", 12)
+    expected = smatch_best_match(test, gold, 3, seed_smatch)
+    assert best_match(*test, *gold, "a", "b", rng=random.Random(3), restarts=12) == tuple(expected)
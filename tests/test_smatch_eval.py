@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+The pooled SMATCH of several languages (evaluate_languages) must give the
+same totals as scoring each file on its own, and as amrlib's smatch routines
+when smatch's generator is seeded for each pair as pair_random() seeds it.
+"""
+
+import os
+import pytest
+from amr_parser import combine_graphs
+from graph_store import read_entries
+from smatch_eval import GoldIndex, compute_smatch, evaluate_languages
+
+
+class SeededPool(object):
+    """
+    Serial stand-in for the process pool of amrlib's compute_smatch that seeds
+    smatch for each graph pair as smatch_eval.pair_random() does.
+    """
+
+    def __init__(self, seed, seed_smatch):
+        self.seed = seed
+        self.seed_smatch = seed_smatch
+
+    def imap_unordered(self, func, pairs):
+        for graph_number, pair in enumerate(pairs):
+            self.seed_smatch("%d:%d" % (self.seed, graph_number))
+            yield func(pair)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+@pytest.fixture
+def amrlib_smatch(monkeypatch, seed_smatch):
+    """amrlib's smatch_enhanced, scoring with the per-pair seeds of seed."""
+    smatch_enhanced = pytest.importorskip("amrlib.evaluate.smatch_enhanced")
+
+    def with_seed(seed):
+        monkeypatch.setattr(smatch_enhanced, "Pool", lambda: SeededPool(seed, seed_smatch))
+        return smatch_enhanced
+
+    return with_seed
+
+
+def write_graphs(fixtures_dir, tmp_path):
+    # gold graphs: the fixtures and multi-sentence graphs of several fixtures
+    # (with a repeated one), large enough that the alignment found depends on
+    # the random initializations; predictions of three "languages": the gold
+    # graphs, the gold graphs shifted by one (other graphs, partial matches)
+    # and the shifted graphs with one graph smatch cannot parse
+    with open(os.path.join(fixtures_dir, "graphs.txt"), encoding="utf-8") as f:
+        blocks = [block for block in f.read().split("\n\n") if block.strip()]
+    gold = blocks + [combine_graphs("combined %d" % i, blocks[i:i + 3] + blocks[i:i + 1]) for i in range(4)]
+    shifted = gold[1:] + gold[:1]
+    broken = shifted[:9] + ["# ::snt broken\n(b / broken"] + shifted[10:]
+    paths = {}
+    for language, graphs in [("gold", gold), ("DE", gold), ("ES", shifted), ("IT", broken)]:
+        paths[language] = str(tmp_path / (language + "_AMR.txt"))
+        with open(paths[language], mode="w", encoding="utf-8") as f:
+            f.write("\n\n".join(graphs) + "\n\n")
+    return paths.pop("gold"), paths
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_pooled_totals_equal_per_file_scores(fixtures_dir, tmp_path, seed):
+    gold_path, pred_paths = write_graphs(fixtures_dir, tmp_path)
+    gold_entries = read_entries(gold_path)
+
+    results = evaluate_languages(GoldIndex.from_file(gold_path), pred_paths, processes=2, chunksize=3, seed=seed)
+    for language, pred_path in pred_paths.items():
+        assert results[language]["total"] == compute_smatch(read_entries(pred_path), gold_entries, seed=seed,
+                                                            processes=2)
+    assert results["DE"]["total"] == (1.0, 1.0, 1.0)
+    assert results["IT"]["total"][2] < results["ES"]["total"][2]
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_compute_scores_equal_amrlib_compute_scores(fixtures_dir, tmp_path, monkeypatch, amrlib_smatch, seed):
+    smatch_enhanced = amrlib_smatch(seed)
+    from smatch_eval import compute_scores
+    gold_path, pred_paths = write_graphs(fixtures_dir, tmp_path)
+    printed = []
+    monkeypatch.setattr(smatch_enhanced, "output_score", lambda *score: printed.append(score))
+
+    for pred_path in pred_paths.values():
+        del printed[:]
+        # amrlib prints the scores and returns None
+        assert smatch_enhanced.compute_scores(pred_path, gold_path) is None
+        expected = printed[:]
+        del printed[:]
+        scores = compute_scores(pred_path, gold_path, seed, processes=2)
+        assert [(name,) + tuple(score) for name, score in scores.items()] == expected
+        assert printed == expected
+
+
+def test_pooled_totals_equal_compute_scores(fixtures_dir, tmp_path):
+    pytest.importorskip("amrlib")
+    from smatch_eval import compute_scores
+    gold_path, pred_paths = write_graphs(fixtures_dir, tmp_path)
+
+    results = evaluate_languages(gold_path, pred_paths, processes=2)
+    for language, pred_path in pred_paths.items():
+        assert results[language]["total"] == compute_scores(pred_path, gold_path, processes=2)["Smatch"]
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_pooled_totals_equal_amrlib_compute_smatch(fixtures_dir, tmp_path, amrlib_smatch, seed):
+    smatch_enhanced = amrlib_smatch(seed)
+    gold_path, pred_paths = write_graphs(fixtures_dir, tmp_path)
+    gold_entries = smatch_enhanced.get_entries(gold_path)
+
+    results = evaluate_languages(GoldIndex.from_file(gold_path), pred_paths, processes=2, chunksize=3, seed=seed)
+    for language, pred_path in pred_paths.items():
+        assert results[language]["total"] == smatch_enhanced.compute_smatch(smatch_enhanced.get_entries(pred_path),
+                                                                            gold_entries)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+An interrupted parse_resumable run must continue after its last checkpoint
+and produce the same file as an uninterrupted run.
+"""
+
+import os
+import pytest
+import stages
+from stages import Manifest, StageRunner, parse_resumable
+
+
+class FakeStog(object):
+    """Parses every sentence to the same small graph; fails on call fail_on."""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.parsed = []
+
+    def parse_sents(self, sentences):
+        if len(self.parsed) == self.fail_on:
+            raise RuntimeError("interrupted")
+        self.parsed.append(list(sentences))
+        return ["# ::snt %s\n(s / sentence\n   :quant %d)" % (s.strip(), len(s.split())) for s in sentences]
+
+
+@pytest.fixture
+def parse_setup(tmp_path, monkeypatch):
+    model_dir = tmp_path / "model_stog"
+    model_dir.mkdir()
+    (model_dir / "config.json").write_text("{}")
+    input_path = tmp_path / "sentences.txt"
+    input_path.write_text("".join("sentence number %d%s\n" % (i, " word" * i) for i in range(10)))
+
+    def run(output_path, fail_on=None):
+        stog = FakeStog(fail_on)
+        monkeypatch.setattr(stages, "load_stog", lambda *args: stog)
+        runner = StageRunner(Manifest(str(tmp_path / "manifest.json")))
+        result = parse_resumable(runner, str(input_path), str(output_path), str(model_dir), checkpoint_every=3)
+        return result, runner, stog
+
+    return tmp_path, run
+
+
+def test_resume_after_truncate(parse_setup):
+    tmp_path, run = parse_setup
+    with pytest.raises(RuntimeError):
+        run(tmp_path / "graphs.txt", fail_on=2)
+    partial_path = tmp_path / "graphs.txt.partial"
+    assert partial_path.exists() and not (tmp_path / "graphs.txt").exists()
+
+    # graphs written after the last checkpoint are dropped on resume
+    with open(str(partial_path), mode="a", encoding="utf-8") as f:
+        f.write("# ::snt half written\n(h / half")
+    result, runner, stog = run(tmp_path / "graphs.txt")
+    assert result == {"sentences": 10, "failed": 0}
+    assert [len(batch) for batch in stog.parsed] == [3, 1]
+    assert stog.parsed[0][0].startswith("sentence number 6 ")
+    assert runner.timings[0][2] == "resumed"
+    assert not partial_path.exists()
+
+    # same output as a run without interruption
+    run(tmp_path / "uninterrupted.txt")
+    assert (tmp_path / "graphs.txt").read_text() == (tmp_path / "uninterrupted.txt").read_text()
+
+    # a finished file is not parsed again
+    result, runner, stog = run(tmp_path / "graphs.txt")
+    assert result == {"sentences": 10, "failed": 0}
+    assert stog.parsed == [] and runner.timings[0][2] == "skipped"
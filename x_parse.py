@@ -5,64 +5,103 @@ Created on Fri Jul 16 09:54:36 2021
 @author: s-uhr
 """
 
-from amr_parser import sent_to_graph, graph_to_sent, read_file, save_graphs, evaluate_smatch
-from nmt_english import Translator
+from supervision import add_supervision_arguments, supervisor_from_arguments
+import argparse
+import json
 import multiprocessing
-import os
-import locale
-import sys
-
-def truncate_files(filename):
-    # cut off the last 5 lines to omit the obsolete AMR graph
-    with open(filename, mode='r+', encoding=preferred_encoding) as f:
-        lines = f.readlines()[:-5]
-        print(lines)
-        f.truncate()
-        f.seek(0)
-        f.writelines(lines)
+import socket
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def submit(request, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+    """
+    Send a request to a running x_parse server and wait for its response.
+
+    Parameters
+    ----------
+    request : dict
+        JSON-serializable request, e.g. {"lang": "es", "input_file": "..."}.
+    host : String, optional
+    port : int, optional
+        Address of the server.
+    timeout : float, optional
+        Seconds to wait for the connection and the response. The default
+        waits until the job is finished.
+
+    Returns
+    -------
+    dict
+        The server's response.
+
+    """
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        conn.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        with conn.makefile('rb') as response:
+            return json.loads(response.readline().decode('utf-8'))
+
+
+def server_running(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Check whether an x_parse server accepts requests at host:port.
+
+    """
+    try:
+        return submit({"ping": True}, host, port, timeout=1.0).get("ok", False)
+    except (OSError, ValueError):
+        return False
+
 
 if __name__ == '__main__':
-    arguments = sys.argv
-    
-    source_language = arguments[2]
-    file_to_translate = arguments[4]
-    
-    gold_amrs = "amr_2-four_translations/AMR/" + file_to_translate[29:-17] + ".txt"
-    
-    if not os.path.exists('translations'):
-        os.makedirs('translations')
-        
-    if not os.path.exists('AMRgraphs'):
-        os.makedirs('AMRgraphs')
-    
-    amr_gsii = False
-    
-    print("\nParsing file", file_to_translate, "from", source_language + ".\n")
-    
     multiprocessing.freeze_support()
-    preferred_encoding = locale.getpreferredencoding()
-    preferred_encoding = 'utf-8'
-    
-    english_source_sentences = os.listdir("amr_2-four_translations/english_source_sentences")  # where the original english sentence files are stored
-    translations = sorted(os.listdir("translations"))  # where the translated files are stored
-    amr_graphs = sorted(os.listdir("AMRgraphs"))  # where to store the parsed AMR graphs
-
-    categories = ["bolt", "consensus", "dfa", "proxy", "xinhua"]  # categories included in the dataset for each language
-    languages = ["DE", "ES", "IT", "ZH"]  # languages included in the dataset
-    
-    # Translate file and save it to translations folder
-    translator = Translator()
-    translator.load_sentences(file_to_translate)
-    translator.translate(source_language=source_language)
-    translator.save_translation("translations/" + file_to_translate[29:-4] + "_nmt.txt")
-    translation_file = "translations/" + file_to_translate[29:-4] + "_nmt.txt"
-
-    # parse translated file to AMR graphs save it to AMRgraphs folder
-    sentences = read_file(translation_file)
-    graphs = sent_to_graph(sentences, device="cpu") #TODO REMOVE CPU
-    new_path = "AMRgraphs/" + translation_file[13:-8] + "_AMR.txt"
-    save_graphs(graphs, path=new_path)
-    truncate_files(new_path) # TODO apparently not working
-    
-    evaluate_smatch(gold_amrs, new_path)
-    
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Translate, then parse a file of the LDC2020T07 dataset.")
+    parser.add_argument("-lang", required=True, help='"de", "es", "it", or "zh"')
+    parser.add_argument("-input_file", required=True)
+    parser.add_argument("-host", default=DEFAULT_HOST)
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-local", action="store_true", help="do not submit to a running server")
+    parser.add_argument("-trace", default=None, help="save the timing spans of a local run to this file")
+    parser.add_argument("-trace_format", choices=["jsonl", "chrome"], default="jsonl")
+    parser.add_argument("-profile", default=None, help="sample the Python stacks of a local run to this file")
+    parser.add_argument("-quantize", action="store_true", help="int8 inference (the server must run with it)")
+    parser.add_argument("-threads", type=int, default=None, help="torch threads of a local run")
+    add_supervision_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.local and server_running(args.host, args.port):
+        print("\nSubmitting file", args.input_file, "to x_parse server at", args.host + ":" + str(args.port))
+        # the server rejects the job if it does not run with these settings
+        supervisor = supervisor_from_arguments(args)
+        result = submit({"lang": args.lang, "input_file": args.input_file, "quantize": args.quantize,
+                         "supervision": supervisor.settings() if supervisor else None}, args.host, args.port)
+        if not result["ok"]:
+            raise RuntimeError("x_parse server failed: " + result["error"])
+        print("Graphs saved to", result["amr_file"])
+        print("SMATCH scores: " + str(result["smatch"]))
+        for record in result.get("supervision", []):
+            print("  {stage}: {reason} -> {action}: {sentence}".format(**record))
+    else:
+        # no server running: load the models in this process
+        from x_parse_server import parse_file
+        from model_registry import registry
+        from caches import ParseCache
+        from instrumentation import tracer
+        from quantization import set_threads
+
+        if args.threads is not None:
+            set_threads(args.threads)
+        if args.profile:
+            tracer.start_profiler()
+        supervisor = supervisor_from_arguments(args)
+        parse_file(args.lang, args.input_file, device="cpu", parse_cache=ParseCache("cache/graphs.sqlite"),
+                   quantize=args.quantize, supervisor=supervisor)
+        if supervisor is not None:
+            supervisor.report()
+        registry.report()
+        tracer.summary()
+        if args.trace:
+            tracer.write(args.trace, args.trace_format)
+        if args.profile:
+            tracer.stop_profiler(args.profile)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Long-running server for x_parse.py that keeps the machine translation and AMR
+models loaded between requests. Jobs (translate -> parse -> smatch) are
+submitted as JSON lines, either over a local TCP socket or on stdin, queued and
+processed one after another by a single worker thread.
+
+Start the server from the project root:
+    python x_parse_server.py [-host <host>] [-port <port>] [-stdin]
+
+Request:  {"lang": "es", "input_file": "amr_2-four_translations/data/..."}
+Response: {"ok": true, "graphs": [...], "smatch": {...}, ...}
+
+A request may also state the settings it expects the server to run with,
+"quantize" (true/false) and "supervision" (Supervisor.settings() or null);
+requests whose settings differ from the server's are rejected.
+"""
+
+from amr_parser import sent_to_graph, read_file, save_graphs, smatch_scores
+from nmt_english import Translator
+from caches import ParseCache
+from instrumentation import context
+from quantization import set_threads
+from supervision import add_supervision_arguments, supervisor_from_arguments
+from scheduler import FILE_PATTERN
+from x_parse import DEFAULT_HOST, DEFAULT_PORT
+from concurrent.futures import Future
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import socketserver
+import sys
+import threading
+
+
+def truncate_files(filename, encoding='utf-8'):
+    # cut off the last 5 lines to omit the obsolete AMR graph
+    with open(filename, mode='r+', encoding=encoding) as f:
+        lines = f.readlines()[:-5]
+        f.seek(0)
+        f.writelines(lines)
+        f.truncate()
+
+
+def parse_file(source_language, file_to_translate, device="cpu", parse_cache=None, quantize=False,
+               supervisor=None):
+    """
+    Translate a file of the LDC2020T07 dataset to English, parse the
+    translation to AMR graphs and compute the SMATCH score against the gold
+    graphs.
+
+    Parameters
+    ----------
+    source_language : String
+        Iso-Code of the language of the file ("de", "es", "it" or "zh").
+    file_to_translate : String
+        Path to the file, e.g.
+        "amr_2-four_translations/data/amr-release-2.0-amrs-test-bolt.sentences.ES.txt".
+    device : String, optional
+        Device to run the models on. The default is "cpu".
+    parse_cache : caches.ParseCache, optional
+        Cache of previously parsed graphs.
+    quantize : Boolean, optional
+        Translate and parse with int8 models (see quantization.py).
+    supervisor : supervision.Supervisor, optional
+        Length and time budgets per sentence for translating and parsing.
+
+    Returns
+    -------
+    dict
+        Paths of the written files, the parsed graphs and the SMATCH scores.
+
+    """
+    gold_amrs = "amr_2-four_translations/AMR/" + file_to_translate[29:-17] + ".txt"
+
+    if not os.path.exists('translations'):
+        os.makedirs('translations')
+
+    if not os.path.exists('AMRgraphs'):
+        os.makedirs('AMRgraphs')
+
+    match = FILE_PATTERN.match(os.path.basename(file_to_translate))
+    with context(language=source_language, category=match.group("category") if match else None):
+        print("\nParsing file", file_to_translate, "from", source_language + ".\n")
+
+        # Translate file and save it to translations folder
+        translator = Translator(device=device, quantize=quantize, supervisor=supervisor)
+        translator.load_sentences(file_to_translate)
+        translator.translate(source_language=source_language)
+        translation_file = "translations/" + file_to_translate[29:-4] + "_nmt.txt"
+        translator.save_translation(translation_file)
+
+        # parse translated file to AMR graphs save it to AMRgraphs folder
+        sentences = read_file(translation_file)
+        graphs = sent_to_graph(sentences, device=device, cache=parse_cache, quantize=quantize,
+                               supervisor=supervisor)
+        new_path = "AMRgraphs/" + translation_file[13:-8] + "_AMR.txt"
+        save_graphs(graphs, path=new_path)
+        truncate_files(new_path)
+
+        scores = smatch_scores(gold_amrs, new_path)
+        print("SMATCH scores: " + str(scores))
+
+    return {"translation_file": translation_file,
+            "amr_file": new_path,
+            "graphs": graphs,
+            "smatch": scores}
+
+
+class JobQueue(object):
+    """
+    Queue of parse jobs processed one after another by a single worker thread,
+    so that the models are only ever used by one job at a time.
+
+    """
+
+    def __init__(self, device="cpu", parse_cache_path="cache/graphs.sqlite", quantize=False, supervisor=None):
+        self.device = device
+        self.quantize = quantize
+        self.supervisor = supervisor
+        self.parse_cache_path = parse_cache_path
+        self.jobs = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def check(self, request):
+        """
+        Returns
+        -------
+        String
+            Why the server cannot serve request (None if it can).
+
+        """
+        if not isinstance(request, dict):
+            return "a request must be a JSON object"
+        settings = {"quantize": self.quantize,
+                    "supervision": self.supervisor.settings() if self.supervisor else None}
+        for name, value in settings.items():
+            if name in request and request[name] != value:
+                return "the server runs with {} = {}, the request asks for {}".format(
+                    name, json.dumps(value), json.dumps(request[name]))
+        return None
+
+    def submit(self, request):
+        """
+        Queue a request and return a Future that resolves to its response
+        (an error response if the request cannot be served, see check()).
+
+        """
+        future = Future()
+        error = self.check(request)
+        if error is not None:
+            future.set_result({"ok": False, "error": error})
+        else:
+            self.jobs.put((request, future))
+        return future
+
+    def _work(self):
+        # SQLite connections are used from the thread that opened them
+        parse_cache = ParseCache(self.parse_cache_path) if self.parse_cache_path else None
+        while True:
+            request, future = self.jobs.get()
+            try:
+                result = parse_file(request["lang"], request["input_file"], device=self.device,
+                                    parse_cache=parse_cache, quantize=self.quantize, supervisor=self.supervisor)
+                result["ok"] = True
+                # the split, retried and fallback sentences of this job
+                result["supervision"] = self.supervisor.drain() if self.supervisor else []
+                future.set_result(result)
+            except Exception as e:
+                future.set_result({"ok": False, "error": repr(e)})
+            finally:
+                self.jobs.task_done()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as e:
+                response = {"ok": False, "error": repr(e)}
+            else:
+                if isinstance(request, dict) and request.get("ping"):
+                    response = {"ok": True, "queued": self.server.job_queue.jobs.qsize()}
+                else:
+                    response = self.server.job_queue.submit(request).result()
+            self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+            self.wfile.flush()
+
+
+class XParseServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, device="cpu", quantize=False, supervisor=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _RequestHandler)
+        self.job_queue = JobQueue(device=device, quantize=quantize, supervisor=supervisor)
+
+
+def serve_stdin(device="cpu", quantize=False, supervisor=None):
+    """
+    Read one JSON request per line from stdin and write one JSON response per
+    line to stdout. Progress messages are redirected to stderr.
+
+    """
+    job_queue = JobQueue(device=device, quantize=quantize, supervisor=supervisor)
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            try:
+                response = job_queue.submit(json.loads(line)).result()
+            except ValueError as e:
+                response = {"ok": False, "error": repr(e)}
+            out.write(json.dumps(response) + "\n")
+            out.flush()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Keep the x_parse.py models loaded and serve parse jobs.")
+    parser.add_argument("-host", default=DEFAULT_HOST)
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-device", default="cpu")
+    parser.add_argument("-stdin", action="store_true", help="read JSON-lines jobs from stdin instead of a socket")
+    parser.add_argument("-quantize", action="store_true", help="int8 inference on CPU")
+    parser.add_argument("-threads", type=int, default=None, help="torch threads (default: torch's default)")
+    add_supervision_arguments(parser)
+    args = parser.parse_args()
+    if args.threads is not None:
+        set_threads(args.threads)
+    supervisor = supervisor_from_arguments(args)
+
+    if args.stdin:
+        serve_stdin(device=args.device, quantize=args.quantize, supervisor=supervisor)
+    else:
+        server = XParseServer(args.host, args.port, device=args.device, quantize=args.quantize,
+                              supervisor=supervisor)
+        print("x_parse server listening on", args.host + ":" + str(args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()